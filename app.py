@@ -1,87 +1,207 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, request, jsonify, Response, current_app
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
-from pymongo import MongoClient
+import json
+import threading
+import click
 from dotenv import load_dotenv
-from flask_bcrypt import Bcrypt
-import requests
 
+# Antes dos módulos abaixo, que leem a configuração (TRIAGEM_MODO, BCRYPT_LOG_ROUNDS...) no import
 load_dotenv()
-mongo_uri = os.getenv('MONGO_URI')
-db_name = os.getenv('DB_NAME', 'healthcenter')
-app = Flask(__name__)
-bcrypt = Bcrypt(app)
-CORS(app)
+
+from banco import get_client, estatisticas_pool
+import filas
+import senhas
+import credenciais
+import autenticacao
+from autenticacao import exige_funcionario, exige_dono_ou_funcionario
+from perfis import perfis
+import metricas
+from registro import log, pseudonimo
+from triagem_ia import classificar_sintomas
+import triagem_ia
+from cache_sintomas import criar_cache
+import indices
+from pymongo.errors import DuplicateKeyError
+from disponibilidade import disponibilidade
+from eventos import barramento
+import estimativa
+from estimativa import TEMPO_GRAVIDADE, agenda_atendimento, agenda_triagem
+import simulacao
+import ciclo
+import unidades
+from unidades import UNIDADE_PADRAO
+
+# As rotas ficam num blueprint e o app é montado em create_app() (no fim do arquivo)
+rotas = Blueprint('healthcenter', __name__, cli_group=None)
+
+# Só confere a assinatura do token (autenticacao.py); quem pode o quê fica nas rotas
+@rotas.before_app_request
+def verificar_token():
+    return autenticacao.carregar_usuario()
+
+
+# Rotas das filas existem com e sem o prefixo /unidades/<unidade>; sem o prefixo
+# valem para a UNIDADE_PADRAO (ver unidades.py)
+def rota_da_unidade(regra, **opcoes):
+    def registrar(funcao):
+        rotas.add_url_rule(regra, view_func=funcao, defaults={'unidade': UNIDADE_PADRAO}, **opcoes)
+        rotas.add_url_rule('/unidades/<unidade>' + regra, view_func=funcao, **opcoes)
+        return funcao
+    return registrar
+
+
+# Processo preso a outras unidades (UNIDADES_ATENDIDAS): o balanceador mandou para o lugar errado
+@rotas.before_app_request
+def conferir_unidade():
+    unidade = (request.view_args or {}).get('unidade')
+    if unidade is not None and not unidades.atende(unidade):
+        return jsonify({'erro': f"Unidade {unidade} não é atendida por este servidor"}), 421
 
 #----------------------------------------------------------------------------------------------------------------------------------
+# O client é criado uma vez por processo (ver banco.py); aqui só escolhemos o banco
 def connect_db():
     try:
-        print(f"Tentando conectar usando a URI: {mongo_uri}")
-        client = MongoClient(mongo_uri)
-        db = client[db_name]
-        return db
+        client = get_client(os.getenv('MONGO_URI'))
+        return client[os.getenv('DB_NAME', 'healthcenter')]
     except Exception as e:
-        print(f"Erro ao conectar ao MongoDB: {e}")
+        log.error("erro ao conectar ao MongoDB", extra={'campos': {'erro': str(e)}})
         return None
 #----------------------------------------------------------------------------------------------------------------------------------
-TEMPO_GRAVIDADE = {
-    "leve": 20,
-    "moderada": 40,
-    "grave": 70
-}
+# Gravidades já classificadas, por texto de sintomas normalizado (TRIAGEM_CACHE=memoria|mongo)
+cache_sintomas = criar_cache(lambda: connect_db()['cache_triagem'])
 #----------------------------------------------------------------------------------------------------------------------------------
-def distribuir_baldes(tempos, n_funcionarios):
-    baldes = [0] * n_funcionarios
-    for tempo in tempos:
-        idx = baldes.index(min(baldes))
-        baldes[idx] += tempo
-    return baldes
+# Liveness: o processo responde. Readiness: o banco responde e o worker não está
+# drenando (ciclo.py); com 503 o balanceador para de mandar pedidos para cá.
+@rotas.route('/saude/viva', methods=['GET'])
+def saude_viva():
+    return jsonify({'status': 'ok', 'pid': os.getpid()}), 200
+
+
+@rotas.route('/saude/pronta', methods=['GET'])
+def saude_pronta():
+    if ciclo.drenando.is_set():
+        return jsonify({'status': 'drenando'}), 503
+    try:
+        connect_db().command('ping')
+    except Exception as e:
+        return jsonify({'status': 'sem_banco', 'erro': str(e)}), 503
+    return jsonify({'status': 'pronto'}), 200
+
+
+@rotas.route('/saude', methods=['GET'])
+def saude():
+    return jsonify({
+        'status': 'ok',
+        'pool_mongo': estatisticas_pool.resumo(),
+        'cache_sintomas': cache_sintomas.resumo(),
+        'triagem_ia': triagem_ia.resumo(),
+        'disponibilidade': disponibilidade.resumo(),
+        'credenciais': credenciais.ausentes.resumo(),
+        'perfis': perfis.resumo()
+    }), 200
+
+# Formato de texto do Prometheus. Os histogramas vêm do middleware (metricas.py);
+# tamanho das filas e demais medidores são lidos na hora da coleta.
+@rotas.route('/metrics', methods=['GET'])
+def metrics():
+    db = connect_db()
+    pool = estatisticas_pool.resumo()
+    medidores = {
+        'fila_pacientes': ('Pacientes em cada fila', [
+            ({'fila': fila}, db[fila].estimated_document_count())
+            for fila in (filas.FILA_TRIAGEM, filas.FILA_ATENDIMENTO)
+        ]),
+        'funcionarios_disponiveis': ('Funcionários disponíveis por unidade e cargo (contagem em memória)', [
+            ({'unidade': unidade, 'cargo': cargo}, n)
+            for unidade, contagens in sorted(disponibilidade.resumo()['contagens'].items())
+            for cargo, n in sorted(contagens.items())
+        ]),
+        'mongo_pool_conexoes': ('Conexões do pool do Mongo', [
+            ({'estado': 'abertas'}, pool['conexoes_abertas']),
+            ({'estado': 'em_uso'}, pool['conexoes_em_uso']),
+        ]),
+        'triagem_classificacoes': ('Classificações por caminho desde o início do processo', [
+            ({'caminho': caminho}, n) for caminho, n in triagem_ia.caminhos.resumo().items()
+        ]),
+        'triagem_ia_disjuntor_aberto': ('1 quando o disjuntor da IA está aberto', [
+            ({}, int(triagem_ia.disjuntor.estado == 'aberto'))
+        ]),
+    }
+    texto = metricas.texto_prometheus(medidores, triagem_ia.latencias)
+    return Response(texto, mimetype='text/plain; version=0.0.4')
 # ---------------------------------------------------------------------------------------------------------------
 #ISSO EH OQ O PACIENTE VE, E ISSO NAO ADD A FILA
-@app.route('/estimativa/<cpf>', methods=['GET'])
+@rotas.route('/estimativa/<cpf>', methods=['GET'])
 def simular_estimativa(cpf):
     gravidade = request.args.get("gravidade", "").lower().strip()
     if gravidade not in TEMPO_GRAVIDADE:
         return jsonify({"erro": "Gravidade inválida"}), 400
 
 #----------------------------------------------------------------------------------------------------------------------------------
-#conectando com a api e função da triagem
-def triagem_sintomas(sintomas: str):
-    headers = {
-        'Authorization': os.getenv('OPEN_AI_KEY'),
-        'Content-Type': 'application/json'
-    }
-
-    data = {
-        "messages": [
-            {
-                "role": "system",
-                "content": (
-                    "Você é um assistente de triagem médica. "
-                    "Ao receber sintomas, você deve estimar a gravidade (leve, moderado, grave) "
-                    "com base no relato e retornar apenas a situação do problema, como leve, moderado ou grave"
-                )
-            },
-            {"role": "user", "content": sintomas}
-        ]
-    }
-
+# Classificação da IA rodando no pool de triagem_ia. O paciente já está na fila
+# com status_ia 'pendente'; aqui só preenchemos o triagemIA quando o modelo responde
+# (ou quando o classificador local assume, se a IA falhar).
+def classificar_em_segundo_plano(db, cpf, chave, sintomas, unidade=UNIDADE_PADRAO):
+    erro = None
     try:
-        response = requests.post(
-            'https://openai-insper.openai.azure.com/openai/deployments/gpt-4o_ProgEficaz/chat/completions?api-version=2025-01-01-preview',
-            #aqui precisa fazer algumas mudanças quando eu fizer o negócio la no azure
-            headers=headers,
-            json=data,
-            timeout=10
-        )
-        response.raise_for_status()
-        result = response.json()
-        return result['choices'][0]['message']['content']
-    except requests.exceptions.RequestException as e:
-        return f"Erro ao conectar à API: {e}"
+        gravidade, resposta_ia, origem = classificar_sintomas(sintomas)
+    except Exception as e:
+        gravidade, resposta_ia, origem = None, f"Erro ao classificar sintomas: {e}", None
+        erro = type(e).__name__
+    # Sem cpf nem texto clínico no log: a resposta da IA fica só no documento da fila
+    log.info("triagem classificada", extra={'campos': {
+        'paciente': pseudonimo(cpf), 'gravidade': gravidade, 'origem': origem, 'erro': erro
+    }})
+
+    if origem == "ia":
+        cache_sintomas.guardar(sintomas, gravidade)
+
+    result = db['fila_triagem'].update_one(
+        {"paciente_cpf": cpf, "posicao_fila": chave},
+        {"$set": {
+            "triagemIA": gravidade,
+            "resposta_ia": resposta_ia.strip(),
+            "origem_triagem": origem,
+            "status_ia": "concluida" if gravidade else "erro"
+        }}
+    )
+    if result.modified_count:
+        filas.marcar_alteracao(db, filas.FILA_TRIAGEM, unidade)
+    return gravidade
+#----------------------------------------------------------------------------------------------------------------------------------
+# Histórico para o simulacao.py comparar e calibrar as estimativas
+def _registrar_eventos(db, tipo, cpfs, unidade, gravidade=None):
+    simulacao.registrar_eventos(db, tipo, cpfs, disponibilidade.contar(db, "triagem", unidade),
+                                disponibilidade.contar(db, "atendimento", unidade), gravidade, unidade=unidade)
 #----------------------------------------------------------------------------------------------------------------------------------
 #BOTAO 1
-@app.route('/login', methods=['POST'])
+# O bcrypt roda no pool de senhas.py; tentativas erradas demais por IP ou por email
+# bloqueiam o login por um tempo (429) antes de gastar CPU com o hash. O IP vem do
+# X-Forwarded-For quando PROXIES_CONFIAVEIS diz quantos proxies há na frente.
+def _conferir_login(db, credencial, senha, chaves):
+    senha_hash = credencial.get('senha')
+    if not senhas.conferir(senha_hash, senha):
+        senhas.limite_login.registrar_falha(*chaves)
+        return jsonify({'msg': 'Senha incorreta'}), 401
+
+    senhas.limite_login.registrar_sucesso(*chaves)
+    # Hash gerado com outro custo (BCRYPT_LOG_ROUNDS mudou): aproveita a senha em
+    # texto que acabou de ser conferida para regravar com o custo atual, em segundo
+    # plano; se o pool estiver cheio fica para o próximo login
+    if senhas.precisa_rehash(senha_hash):
+        senhas.regerar_em_segundo_plano(senha, lambda novo: credenciais.atualizar_senha(db, credencial, novo))
+    return jsonify({
+        'msg': 'Login realizado com sucesso',
+        'cpf': credencial.get('cpf'),
+        'tipo': credencial.get('tipo'),
+        'token': autenticacao.emitir_token(credencial.get('cpf'), credencial.get('tipo'), credencial.get('cargo'))
+    }), 200
+
+
+# Paciente ou funcionário sai de uma consulta só em credenciais (ver credenciais.py)
+@rotas.route('/login', methods=['POST'])
 def login():
     db = connect_db()
     data = request.get_json()
@@ -92,38 +212,25 @@ def login():
     if not email or not senha:
         return jsonify({'msg': 'Email e senha são obrigatórios'}), 400
 
-    # Primeiro verifica se é paciente
-    paciente = db['pacientes'].find_one({'email': email})
-    if paciente:
-        senha_hash = paciente.get('senha')
-        if bcrypt.check_password_hash(senha_hash, senha):
-            return jsonify({
-                'msg': 'Login realizado com sucesso',
-                'cpf': paciente.get('cpf'),
-                'tipo': 'paciente'
-            }), 200
-        else:
-            return jsonify({'msg': 'Senha incorreta'}), 401
-
-    # Depois tenta verificar se é funcionário
-    funcionario = db['funcionarios'].find_one({'email': email})
-    if funcionario:
-        senha_hash = funcionario.get('senha')
-        if bcrypt.check_password_hash(senha_hash, senha):
-            return jsonify({
-                'msg': 'Login realizado com sucesso',
-                'cpf': funcionario.get('cpf'),
-                'tipo': 'funcionario'
-            }), 200
-        else:
-            return jsonify({'msg': 'Senha incorreta'}), 401
-
-    return jsonify({'msg': 'Usuário não encontrado'}), 404
+    chaves = (f"ip:{request.remote_addr}", f"email:{email}")
+    if senhas.limite_login.bloqueado(*chaves):
+        return jsonify({'msg': 'Muitas tentativas de login. Tente novamente mais tarde'}), 429
+
+    credencial = credenciais.buscar(db, email)
+    if credencial is None:
+        # Email desconhecido conta só para o IP, para frear quem testa emails em série
+        senhas.limite_login.registrar_falha(chaves[0])
+        return jsonify({'msg': 'Usuário não encontrado'}), 404
+
+    try:
+        return _conferir_login(db, credencial, senha, chaves)
+    except senhas.PoolSenhasOcupado:
+        return jsonify({'msg': 'Servidor ocupado. Tente novamente em instantes'}), 503
 
 
 #----------------------------------------------------------------------------------------------------------------------------------
 #BOTAO 2
-@app.route('/cadastro', methods=['POST'])
+@rotas.route('/cadastro', methods=['POST'])
 def cadastro():
     db = connect_db()
     data = request.get_json()
@@ -139,10 +246,14 @@ def cadastro():
     if not email or not senha:
         return jsonify({'msg': 'Email e senha são obrigatórios'}), 400
 
-    if db['pacientes'].find_one({'email': email}):
+    # O email é único entre pacientes e funcionários
+    if credenciais.buscar(db, email):
         return jsonify({'msg': 'Usuário já existe'}), 400
 
-    hashed = bcrypt.generate_password_hash(senha).decode('utf-8')
+    try:
+        hashed = senhas.gerar_hash(senha)
+    except senhas.PoolSenhasOcupado:
+        return jsonify({'msg': 'Servidor ocupado. Tente novamente em instantes'}), 503
 
     paciente = {
         'email': email,
@@ -153,18 +264,23 @@ def cadastro():
         'endereco': endereco
     }
 
-    db['pacientes'].insert_one(paciente)
+    try:
+        db['pacientes'].insert_one(paciente)
+    except DuplicateKeyError:
+        # Mesmo email ou cpf gravado entre a verificação e o insert (índices únicos)
+        return jsonify({'msg': 'Usuário já existe'}), 400
+    credenciais.registrar(db, 'paciente', paciente)
+    perfis.invalidar(cpf)
 
     return jsonify({'msg': 'Usuário cadastrado com sucesso'}), 201
 #----------------------------------------------------------------------------------------------------------------------------------
 #BOTAO 3
-@app.route('/triagem/<cpf>', methods=['POST'])
-def entrar_fila_triagem(cpf):
+@rota_da_unidade('/triagem/<cpf>', methods=['POST'])
+@exige_dono_ou_funcionario
+def entrar_fila_triagem(cpf, unidade):
     db = connect_db()
     fila_triagem = db['fila_triagem']
     fila_atendimento = db['fila_atendimento']
-    funcionarios = db['funcionarios']
-    pacientes = db['pacientes']
 
     data = request.get_json()
     sintomas = data.get("sintomas", "").strip()
@@ -172,87 +288,95 @@ def entrar_fila_triagem(cpf):
     if not sintomas:
         return jsonify({"erro": "Sintomas não fornecidos"}), 400
 
-    # Chamada à IA para obter a gravidade
-    resposta_ia = triagem_sintomas(sintomas)
-    print("Resposta da IA:", resposta_ia)
-
-    # Extrair a gravidade da resposta da IA
-    for grav in TEMPO_GRAVIDADE.keys():
-        if grav in resposta_ia.lower():
-            gravidade = grav
-            break
-    else:
-        return jsonify({"erro": "Não foi possível determinar a gravidade a partir dos sintomas"}), 400
-
-    # Verifica se o paciente existe
-    paciente_info = pacientes.find_one({"cpf": cpf})
+    # Verifica se o paciente existe (nome e cpf ficam em memória, ver perfis.py)
+    paciente_info = perfis.obter(db, cpf)
     if not paciente_info:
         return jsonify({"erro": "Paciente não encontrado"}), 404
 
-    # Verifica se já está em alguma fila
+    # Verifica se já está em alguma fila (de qualquer unidade: o cpf é único nas filas)
     if fila_triagem.find_one({"paciente_cpf": cpf}) or fila_atendimento.find_one({"paciente_cpf": cpf}):
         return jsonify({"erro": "Paciente já está em uma das filas"}), 400
 
-    # ----- POSIÇÃO E TEMPO DE TRIAGEM -----
-    posicao_triagem = fila_triagem.count_documents({}) + 1
-    triagistas = funcionarios.count_documents({"disponível": True, "cargo": "triagem"})
+    # Contagens em memória (disponibilidade.py), sem ida ao banco na maioria dos pedidos
+    triagistas = disponibilidade.contar(db, "triagem", unidade)
     if triagistas == 0:
         return jsonify({"erro": "Nenhum funcionário disponível para triagem"}), 500
 
-    tempo_triagem = ((posicao_triagem - 1) // triagistas) * 5 + 5
-
-    # ----- PESSOAS NA FRENTE NO ATENDIMENTO -----
-    fila_triagem_ordenada = list(fila_triagem.find().sort("posicao_fila", 1))
-    fila_atend = list(fila_atendimento.find().sort("posicao_fila", 1))
-
-    gravidades_antes = []
-
-    for p in fila_atend:
-        grav = p.get("triagem_oficial", "").lower().strip()
-        if grav in TEMPO_GRAVIDADE:
-            gravidades_antes.append(grav)
-
-    for p in fila_triagem_ordenada:
-        if p.get("posicao_fila", 999) < posicao_triagem:
-            grav = p.get("triagemIA", "").lower().strip()
-            if grav in TEMPO_GRAVIDADE:
-                gravidades_antes.append(grav)
-
-    atendentes = funcionarios.count_documents({"disponível": True, "cargo": "atendimento"})
+    atendentes = disponibilidade.contar(db, "atendimento", unidade)
     if atendentes == 0:
         return jsonify({"erro": "Nenhum funcionário disponível para atendimento"}), 500
 
-    tempos_antes = [TEMPO_GRAVIDADE[g] for g in gravidades_antes]
-    baldes = distribuir_baldes(tempos_antes, atendentes)
-    espera = min(baldes)
-    tempo_atendimento = espera + TEMPO_GRAVIDADE[gravidade]
-    posicao_atendimento = len(gravidades_antes) + 1
-    tempo_total = tempo_triagem + tempo_atendimento
+    # Primeiro o classificador local (TRIAGEM_MODO); depois sintomas já vistos;
+    # só o que sobrar vai para a IA
+    gravidade = triagem_ia.classificacao_imediata(sintomas)
+    if gravidade is None and triagem_ia.TRIAGEM_MODO != 'local':
+        gravidade = cache_sintomas.obter(sintomas)
+        if gravidade:
+            triagem_ia.caminhos.registrar('cache')
+    status_ia = "concluida" if gravidade else "pendente"
 
     # ----- INSERIR NA FILA -----
+    # Entra já com a vaga garantida; se ainda não tem gravidade, a da IA chega depois
     novo_paciente = {
         "paciente_cpf": cpf,
         "nome": paciente_info.get("nome_completo"),
         "triagemIA": gravidade,
-        "posicao_fila": posicao_triagem,
+        "status_ia": status_ia,
         "sintomas": sintomas
     }
-    fila_triagem.insert_one(novo_paciente)
+    try:
+        chave = filas.entrar(db, filas.FILA_TRIAGEM, novo_paciente, unidade)
+    except DuplicateKeyError:
+        # Outro pedido do mesmo paciente entrou entre a verificação e o insert
+        return jsonify({"erro": "Paciente já está em uma das filas"}), 400
+    if not gravidade:
+        triagem_ia.agendar(classificar_em_segundo_plano, db, cpf, chave, sintomas, unidade)
+    simulacao.registrar_eventos(db, 'entrada', [cpf], triagistas, atendentes, unidade=unidade)
 
-    return jsonify({
-        "msg": "Paciente adicionado à fila de triagem com sucesso",
+    # ----- POSIÇÃO E TEMPO DE TRIAGEM -----
+    # Pela visão da geração atual (snapshot ou memória), sem contar no banco
+    visao_triagem = filas.ordem(db, filas.FILA_TRIAGEM, unidade)
+    posicao_triagem = visao_triagem.posicao_da_chave(chave)
+    tempo_triagem = ((posicao_triagem - 1) // triagistas + 1) * estimativa.TEMPO_TRIAGEM
+
+    # ----- PESSOAS NA FRENTE NO ATENDIMENTO -----
+    # Toda a fila de atendimento + quem chegou antes na triagem, pela agenda
+    # compartilhada da geração atual das duas filas
+    agenda = agenda_triagem(visao_triagem, filas.ordem(db, filas.FILA_ATENDIMENTO, unidade), atendentes)
+    indice = visao_triagem.indice_da_chave(chave)
+
+    espera = agenda.inicio(indice)
+    posicao_atendimento = agenda.validos_antes[indice] + 1
+
+    # Mesmas chaves da resposta de antes do 202. Sem a gravidade ainda, o tempo de
+    # atendimento conta o atendimento mais curto e vem marcado como provisório; a
+    # resposta da IA só existe depois (GET /pacientes), então resposta_ia vai nula
+    provisoria = gravidade is None
+    duracao = TEMPO_GRAVIDADE[gravidade] if gravidade else min(TEMPO_GRAVIDADE.values())
+    tempo_atendimento = espera + duracao
+    tempo_total = tempo_triagem + tempo_atendimento
+
+    resposta = {
+        "msg": "Paciente adicionado à fila de triagem; a análise dos sintomas está em andamento",
         "gravidade_estimada": gravidade,
-        "resposta_ia": resposta_ia.strip(),
+        "resposta_ia": None,
+        "status_ia": status_ia,
+        "estimativa_provisoria": provisoria,
         "posicao_triagem": posicao_triagem,
         "tempo_triagem": f"{tempo_triagem} minutos",
         "posicao_atendimento": posicao_atendimento,
+        "espera_atendimento": f"{espera} minutos",
         "tempo_atendimento": f"{tempo_atendimento} minutos",
         "tempo_total_estimado": f"{tempo_total} minutos"
-    }), 201
+    }
+    if gravidade:
+        resposta["msg"] = "Paciente adicionado à fila de triagem com sucesso"
+    return jsonify(resposta), 202
 
 #----------------------------------------------------------------------------------------------------------------------------------
 #BOTAO 4
-@app.route('/triagem/<cpf>', methods=['PUT'])
+@rotas.route('/triagem/<cpf>', methods=['PUT'])
+@exige_dono_ou_funcionario
 def triagem(cpf):
     db = connect_db()
     data = request.get_json()
@@ -279,6 +403,7 @@ def triagem(cpf):
     campos_novos = [k for k in atualizacoes if k not in paciente]
 
     db['pacientes'].update_one({'cpf': cpf}, {'$set': atualizacoes})
+    perfis.invalidar(cpf)
 
     if campos_novos:
         return jsonify({'msg': 'Informações de saúde adicionadas com sucesso'}), 200
@@ -287,31 +412,17 @@ def triagem(cpf):
 
 #--------------------------------------------------------------------------------------------------------------
 # BOTAO 5
-@app.route('/atendimento/<cpf>', methods=['DELETE'])
-def remover_paciente_da_fila(cpf):
+@rota_da_unidade('/atendimento/<cpf>', methods=['DELETE'])
+@exige_funcionario
+def remover_paciente_da_fila(cpf, unidade):
     db = connect_db()
-    fila_atendimento = db['fila_atendimento']
-    
-    # Encontra o paciente
-    paciente = fila_atendimento.find_one({"paciente_cpf": cpf})
+
+    # Remove o paciente da fila; quem estava atrás não precisa ser reescrito,
+    # a posição exibida é calculada na leitura
+    paciente = filas.sair(db, filas.FILA_ATENDIMENTO, cpf, unidade)
     if not paciente:
         return jsonify({"erro": "Paciente não encontrado na fila de atendimento"}), 404
-
-    posicao_removida = paciente.get("posicao_fila", None)
-    
-    # Remove o paciente da fila
-    result = fila_atendimento.delete_one({"paciente_cpf": cpf})
-    if result.deleted_count == 0:
-        return jsonify({"erro": "Erro ao remover paciente"}), 500
-
-    # Atualiza as posições de quem estava atrás
-    fila_restante = list(fila_atendimento.find({"posicao_fila": {"$gt": posicao_removida}}))
-    for p in fila_restante:
-        nova_posicao = p["posicao_fila"] - 1
-        fila_atendimento.update_one(
-            {"paciente_cpf": p["paciente_cpf"]},
-            {"$set": {"posicao_fila": nova_posicao}}
-        )
+    _registrar_eventos(db, 'alta', [cpf], unidade)
 
     return jsonify({
         "msg": "Paciente removido com sucesso",
@@ -320,61 +431,156 @@ def remover_paciente_da_fila(cpf):
         "triagem": paciente["triagem_oficial"]
     }), 200
 
+# Alta em lote: {"cpfs": [...]}
+@rota_da_unidade('/atendimento', methods=['DELETE'])
+@exige_funcionario
+def remover_varios_da_fila(unidade):
+    db = connect_db()
+    data = request.get_json()
+
+    cpfs = data.get('cpfs') if data else None
+    if not isinstance(cpfs, list) or not cpfs:
+        return jsonify({"erro": "Informe a lista de cpfs"}), 400
+
+    removidos = filas.sair_varios(db, filas.FILA_ATENDIMENTO, cpfs, unidade)
+    encontrados = {p["paciente_cpf"] for p in removidos}
+    _registrar_eventos(db, 'alta', [p["paciente_cpf"] for p in removidos], unidade)
+
+    return jsonify({
+        "msg": f"{len(removidos)} paciente(s) removido(s) com sucesso",
+        "removidos": [{
+            "cpf": p["paciente_cpf"],
+            "nome": p.get("nome"),
+            "triagem": p.get("triagem_oficial")
+        } for p in removidos],
+        "nao_encontrados": [cpf for cpf in cpfs if cpf not in encontrados]
+    }), 200
+
 #--------------------------------------------------------------------------------------------------------------
 # BOTAO 6 e 7
-@app.route('/triagem/<cpf>', methods=['GET'])
-def verifica_triagem(cpf):
-    db = connect_db()
-    fila_atendimento = db['fila_atendimento']
-    funcionarios = db['funcionarios']
+# Mesma resposta para a consulta (GET) e para o streaming: (corpo, status)
+def situacao_no_atendimento(db, cpf, unidade=UNIDADE_PADRAO):
+    # Tudo sai da visão da fila (filas.ordem): com a geração em cache é uma leitura
+    # de filas_meta; com geração nova, mais uma do snapshot
+    fila_ordenada = filas.ordem(db, filas.FILA_ATENDIMENTO, unidade)
 
     # Verifica se o paciente está na fila de atendimento
-    paciente = fila_atendimento.find_one({"paciente_cpf": cpf})
+    paciente = fila_ordenada.documento_do_cpf(cpf)
     if not paciente:
-        return jsonify({"erro": "Paciente não está na fila de atendimento"}), 404
+        return {"erro": "Paciente não está na fila de atendimento"}, 404
 
     triagem_oficial = paciente.get("triagem_oficial", "").lower().strip()
 
     if triagem_oficial not in TEMPO_GRAVIDADE:
-        return jsonify({
+        return {
             "msg": "A análise dos seus sintomas ainda não foi concluída... Por favor, tente novamente em alguns segundos."
-        }), 202
-
-    minha_posicao = paciente.get("posicao_fila", 999)
-    fila_ordenada = list(fila_atendimento.find().sort("posicao_fila", 1))
+        }, 202
 
-    gravidades_antes = []
-    for p in fila_ordenada:
-        if p.get("posicao_fila", 999) < minha_posicao:
-            grav = p.get("triagem_oficial", "").lower().strip()
-            if grav in TEMPO_GRAVIDADE:
-                gravidades_antes.append(grav)
+    minha_chave = paciente.get("posicao_fila", 999)
+    minha_posicao = fila_ordenada.posicao_da_chave(minha_chave)
 
-    atendentes = funcionarios.count_documents({"disponível": True, "cargo": "atendimento"})
+    atendentes = disponibilidade.contar(db, "atendimento", unidade)
     if atendentes == 0:
-        return jsonify({"erro": "Nenhum funcionário disponível para atendimento"}), 500
+        return {"erro": "Nenhum funcionário disponível para atendimento"}, 500
 
-    # Calcula tempo estimado real usando distribuição dos tempos nas filas
-    tempos_antes = [TEMPO_GRAVIDADE[g] for g in gravidades_antes]
-    baldes = distribuir_baldes(tempos_antes, atendentes)
-    menor_carga = min(baldes)
+    # Calcula tempo estimado real usando distribuição dos tempos nas filas; a agenda
+    # é montada uma vez por geração da fila e dividida entre todos que consultam
+    agenda = agenda_atendimento(fila_ordenada, atendentes)
+    menor_carga = agenda.inicio(fila_ordenada.indice_da_chave(minha_chave))
 
     # Adiciona seu próprio tempo de atendimento
     tempo_real = menor_carga + TEMPO_GRAVIDADE[triagem_oficial]
 
-    return jsonify({
+    return {
         "msg": "Sua triagem foi concluída!",
         "posicao_na_fila": minha_posicao,
         "tempo_estimado_espera": f"{tempo_real} minutos"
-    }), 200
+    }, 200
+
+
+@rota_da_unidade('/triagem/<cpf>', methods=['GET'])
+@exige_dono_ou_funcionario
+def verifica_triagem(cpf, unidade):
+    corpo, status = situacao_no_atendimento(connect_db(), cpf, unidade)
+    return jsonify(corpo), status
+
+#--------------------------------------------------------------------------------------------------------------
+# Streaming (Server-Sent Events) da posição e do tempo de espera. O paciente se
+# inscreve uma vez e recebe um evento só quando a fila muda de verdade; sem mudança
+# chega apenas um comentário de keep-alive a cada SSE_HEARTBEAT segundos, que também
+# serve para perceber mudanças feitas por outros workers.
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', 15))
+# Cada stream segura uma thread do worker enquanto durar. Passando de SSE_MAX_STREAMS
+# por worker o pedido recebe 503 com Retry-After e o cliente volta a consultar
+# GET /triagem/<cpf>; as outras threads ficam para login, triagem e alta (ver
+# gunicorn.conf.py).
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', 4))
+SSE_RETRY_AFTER = int(os.getenv('SSE_RETRY_AFTER', 30))
+_vagas_sse = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+
+def _evento_sse(nome, corpo):
+    return f"event: {nome}\ndata: {json.dumps(corpo, ensure_ascii=False)}\n\n"
+
+
+@rota_da_unidade('/triagem/<cpf>/eventos', methods=['GET'])
+@exige_dono_ou_funcionario
+def acompanhar_fila(cpf, unidade):
+    db = connect_db()
+    acompanhadas = (filas.FILA_ATENDIMENTO, filas.FILA_TRIAGEM)
+
+    def gerar():
+        versao = barramento.versao(unidade, acompanhadas)
+        geracoes = tuple(filas.geracao(db, fila, unidade) for fila in acompanhadas)
+        ultimo = None
+        while True:
+            if ciclo.drenando.is_set():
+                # Worker saindo: o navegador reconecta sozinho em outro
+                yield _evento_sse("reconectar", {"msg": "Servidor reiniciando"})
+                return
+            corpo, status = situacao_no_atendimento(db, cpf, unidade)
+            if status == 404:
+                if db['fila_triagem'].find_one({"paciente_cpf": cpf, **unidades.filtro(unidade)}, {"_id": 1}) is None:
+                    yield _evento_sse("fim", {"msg": "Paciente não está em nenhuma fila"})
+                    return
+                corpo = {"msg": "Paciente ainda está na fila de triagem"}
+                status = 202
+
+            if (corpo, status) != ultimo:
+                yield _evento_sse("fila", {**corpo, "status": status})
+                ultimo = (corpo, status)
+
+            nova = barramento.esperar(unidade, acompanhadas, versao, timeout=SSE_HEARTBEAT)
+            if nova == versao:
+                # Nada mudou neste processo; confere se outro worker mexeu nas filas
+                atuais = tuple(filas.geracao(db, fila, unidade) for fila in acompanhadas)
+                if atuais == geracoes:
+                    yield ": keep-alive\n\n"
+                    continue
+                geracoes = atuais
+            versao = nova
+
+    vagas = _vagas_sse
+    if not vagas.acquire(blocking=False):
+        return jsonify({'msg': 'Muitos acompanhamentos abertos. Consulte GET /triagem/<cpf>'}), 503, {
+            'Retry-After': str(SSE_RETRY_AFTER)
+        }
+
+    # O gerador só usa o db já resolvido, então não precisa do contexto do pedido
+    resposta = Response(gerar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # A vaga volta quando o servidor fecha a resposta, mesmo que o gerador nem tenha começado
+    resposta.call_on_close(vagas.release)
+    return resposta
 
 #--------------------------------------------------------------------------------------------------------------
 # BOTAO 8
-@app.route('/triagem_e_fila/<cpf>', methods=['PUT'])
-def atualizar_triagem_e_fila(cpf):
+@rota_da_unidade('/triagem_e_fila/<cpf>', methods=['PUT'])
+@exige_funcionario
+def atualizar_triagem_e_fila(cpf, unidade):
     db = connect_db()
-    fila_triagem = db['fila_triagem']
-    fila_atendimento = db['fila_atendimento']
 
     data = request.get_json()
     nova_gravidade = data.get('triagem_oficial', '').lower().strip()
@@ -382,40 +588,179 @@ def atualizar_triagem_e_fila(cpf):
     if nova_gravidade not in TEMPO_GRAVIDADE:
         return jsonify({'erro': 'Gravidade inválida'}), 400
 
-    # Busca o paciente na fila de triagem
-    paciente = fila_triagem.find_one({"paciente_cpf": cpf})
-    if not paciente:
+    # Sai da triagem e entra no fim do atendimento numa operação só (ver filas.promover)
+    try:
+        promovido = filas.promover(db, cpf, nova_gravidade, unidade)
+    except DuplicateKeyError:
+        return jsonify({'erro': 'Paciente já está na fila de atendimento'}), 400
+    if not promovido:
         return jsonify({'erro': 'Paciente não encontrado na fila de triagem'}), 404
+    _registrar_eventos(db, 'promocao', [cpf], unidade, nova_gravidade)
 
-    posicao_removida = paciente.get("posicao_fila")
+    return jsonify({'msg': 'Paciente movido para a fila de atendimento com sucesso'}), 200
+#--------------------------------------------------------------------------------------------------------------
+# Funcionário entrando ou saindo de turno (na unidade onde está lotado)
+@rota_da_unidade('/funcionarios/<cpf>/disponibilidade', methods=['PUT'])
+@exige_funcionario
+def alterar_disponibilidade(cpf, unidade):
+    db = connect_db()
+    data = request.get_json()
 
-    # Atualiza a gravidade oficial e posição na fila de atendimento
-    paciente['triagem_oficial'] = nova_gravidade
-    nova_posicao = fila_atendimento.count_documents({}) + 1
-    paciente['posicao_fila'] = nova_posicao
-    fila_atendimento.insert_one(paciente)
+    disponivel = data.get('disponível', data.get('disponivel'))
+    if not isinstance(disponivel, bool):
+        return jsonify({'erro': 'Informe disponível como true ou false'}), 400
 
-    # Remove da fila de triagem
-    fila_triagem.delete_one({"paciente_cpf": cpf})
+    result = db['funcionarios'].update_one({'cpf': cpf, **unidades.filtro(unidade)}, {'$set': {'disponível': disponivel}})
+    if result.matched_count == 0:
+        return jsonify({'erro': 'Funcionário não encontrado'}), 404
 
-    # Atualiza as posições de quem estava atrás na fila de triagem
-    fila_triagem.update_many(
-        {"posicao_fila": {"$gt": posicao_removida}},
-        {"$inc": {"posicao_fila": -1}}
-    )
+    # As contagens em memória deste worker passam a valer na hora; os outros
+    # workers veem pelo change stream ou quando o TTL vence
+    disponibilidade.invalidar()
 
-    return jsonify({'msg': 'Paciente movido para a fila de atendimento com sucesso'}), 200
+    return jsonify({'msg': 'Disponibilidade atualizada com sucesso', 'disponível': disponivel}), 200
 #--------------------------------------------------------------------------------------------------------------
 
-@app.route('/pacientes', methods=['GET'])
-def get_pacientes():
+# Campos que o painel pode pedir em ?campos=
+CAMPOS_PACIENTES = ('paciente_cpf', 'nome', 'triagemIA', 'status_ia', 'origem_triagem', 'resposta_ia', 'sintomas', 'posicao_fila')
+
+
+# Lista da fila de triagem para o painel dos funcionários.
+#   ?campos=nome,triagemIA   só esses campos (padrão: todos)
+#   ?limite=50&apos=<cursor>  paginação pela chave da fila; com limite, cada item
+#                            traz "cursor", e o próximo pedido usa o do último item
+# A resposta é escrita conforme o cursor do Mongo entrega os documentos, e o ETag
+# muda junto com a geração da fila: painel sem mudança recebe 304.
+@rota_da_unidade('/pacientes', methods=['GET'])
+@exige_funcionario
+def get_pacientes(unidade):
 
     db = connect_db()
     fila_triagem = db['fila_triagem']
 
-    pacientes = list(fila_triagem.find({}, {'_id': 0}))
+    campos = request.args.get('campos')
+    campos = [c.strip() for c in campos.split(',') if c.strip()] if campos else list(CAMPOS_PACIENTES)
+    invalidos = [c for c in campos if c not in CAMPOS_PACIENTES]
+    if invalidos:
+        return jsonify({'erro': f"Campos inválidos: {', '.join(invalidos)}"}), 400
+
+    try:
+        limite = int(request.args['limite']) if 'limite' in request.args else None
+        apos = int(request.args['apos']) if 'apos' in request.args else None
+    except ValueError:
+        return jsonify({'erro': 'limite e apos devem ser números inteiros'}), 400
+    if limite is not None and limite <= 0:
+        return jsonify({'erro': 'limite deve ser maior que zero'}), 400
+
+    geracao = filas.geracao(db, filas.FILA_TRIAGEM, unidade)
+    etag = None
+    if geracao is not None:
+        etag = f"{geracao}-{','.join(campos)}-{limite}-{apos}"
+        if etag in request.if_none_match:
+            return Response(status=304, headers={'ETag': f'"{etag}"'})
+
+    filtro = unidades.filtro(unidade)
+    posicao_inicial = 1
+    if apos is not None:
+        filtro['posicao_fila'] = {'$gt': apos}
+        posicao_inicial = fila_triagem.count_documents({'posicao_fila': {'$lte': apos}, **unidades.filtro(unidade)}) + 1
+
+    projecao = {c: 1 for c in campos}
+    projecao.update({'_id': 0, 'posicao_fila': 1})
+    cursor = fila_triagem.find(filtro, projecao).sort('posicao_fila', 1)
+    if limite is not None:
+        cursor = cursor.limit(limite)
+
+    # O gerador roda depois que a view retorna, já fora do contexto do app: o
+    # serializador é resolvido aqui
+    dumps = current_app.json.dumps
+
+    # posicao_fila no banco é só a chave de ordenação; aqui devolvemos a posição real
+    def gerar():
+        yield '['
+        for i, p in enumerate(cursor):
+            chave = p.pop('posicao_fila', None)
+            if 'posicao_fila' in campos:
+                p['posicao_fila'] = posicao_inicial + i
+            if limite is not None:
+                p['cursor'] = chave
+            yield (',' if i else '') + dumps(p)
+        yield ']'
+
+    headers = {'ETag': f'"{etag}"'} if etag else {}
+    return Response(gerar(), mimetype='application/json', headers=headers)
+
+#--------------------------------------------------------------------------------------------------------------
+# flask --app app criar-indices / verificar-indices
+@rotas.cli.command('criar-indices')
+def comando_criar_indices():
+    for colecao, nome in indices.criar_indices(connect_db()):
+        print(f"{colecao}.{nome}")
+
+
+@rotas.cli.command('verificar-indices')
+def comando_verificar_indices():
+    print(indices.relatorio(connect_db()))
+
+
+# Depois de criar funcionários direto no banco
+@rotas.cli.command('sincronizar-credenciais')
+def comando_sincronizar_credenciais():
+    print(f"{credenciais.sincronizar(connect_db())} credencial(is) sincronizada(s)")
+
+
+# Compara as estimativas com o histórico e grava os tempos calibrados
+@rotas.cli.command('calibrar-tempos')
+@click.option('--saida', default='tempos_calibrados.json')
+@click.option('--unidade', default=UNIDADE_PADRAO)
+def comando_calibrar_tempos(saida, unidade):
+    db = connect_db()
+    eventos = simulacao.carregar_eventos(db, unidade=unidade)
+    tempos = simulacao.ajustar_tempos(eventos)
+    simulacao.salvar_tempos(tempos, saida)
+    print(f"{len(eventos)} evento(s); tempos calibrados em {saida}: {json.dumps(tempos)}")
+    print(f"Estimativas com os tempos atuais: {json.dumps(simulacao.comparar(eventos), ensure_ascii=False)}")
+
+
+# Termina promoções interrompidas (só acontece sem suporte a transações)
+@rotas.cli.command('reparar-filas')
+def comando_reparar_filas():
+    print(f"{filas.reparar_promocoes(connect_db())} paciente(s) reparado(s)")
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Quantos proxies confiáveis (balanceador, nginx) ficam na frente do app. Com 0,
+# request.remote_addr é o endereço de quem conectou; atrás de um proxy isso seria o
+# proxy, e o limite de login por IP valeria para o hospital inteiro.
+PROXIES_CONFIAVEIS = int(os.getenv('PROXIES_CONFIAVEIS', 0))
+
+
+# Fábrica do app. Importar este módulo não monta nada; em produção o wsgi.py chama
+# create_app() (ver gunicorn.conf.py). config sobrescreve o que vier do ambiente
+# (o .env já foi carregado no topo do arquivo).
+def create_app(config=None):
+    novo = Flask(__name__)
+    novo.config.from_mapping(config or {})
+    # /unidades/<padrão>/... responde direto, sem redirecionar para a rota sem prefixo
+    novo.url_map.redirect_defaults = False
+    autenticacao.preparar_chave(novo)
+    CORS(novo)
+    metricas.instrumentar(novo)
+    novo.register_blueprint(rotas)
+    proxies = int(novo.config.get('PROXIES_CONFIAVEIS', PROXIES_CONFIAVEIS))
+    if proxies:
+        novo.wsgi_app = ProxyFix(novo.wsgi_app, x_for=proxies)
+    return novo
+
+
+# `app` continua existindo para o flask --app app e para os testes, criado no
+# primeiro acesso
+def __getattr__(nome):
+    if nome == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
 
-    return jsonify(pacientes)
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    ciclo.preparar_banco()
+    create_app().run(debug=os.getenv('FLASK_DEBUG') == '1')
@@ -0,0 +1,85 @@
+import os
+import secrets
+from functools import wraps
+from flask import request, jsonify, g, current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from registro import log
+
+TOKEN_VALIDADE = int(os.getenv('TOKEN_VALIDADE', 12 * 60 * 60))
+_SAL = 'sessao'
+# Um token velho guardado no navegador não pode impedir o login de um token novo
+ROTAS_PUBLICAS = {'healthcenter.login', 'healthcenter.cadastro', 'healthcenter.saude',
+                  'healthcenter.saude_viva', 'healthcenter.saude_pronta', 'static'}
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Token de sessão assinado (HMAC) com cpf, tipo e cargo. Conferir a assinatura não
+# precisa do banco; com vários workers todos precisam da mesma SECRET_KEY (com
+# preload_app a chave aleatória é gerada no mestre, antes do fork, e vale para todos).
+def preparar_chave(app):
+    if not app.config.get('SECRET_KEY'):
+        chave = os.getenv('SECRET_KEY')
+        if not chave:
+            log.warning("SECRET_KEY não definida; usando uma chave aleatória (tokens não valem depois de reiniciar)")
+            chave = secrets.token_hex(32)
+        app.config['SECRET_KEY'] = chave
+    return app.config['SECRET_KEY']
+
+
+def _serializador():
+    return URLSafeTimedSerializer(preparar_chave(current_app), salt=_SAL)
+
+
+def emitir_token(cpf, tipo, cargo=None):
+    return _serializador().dumps({'cpf': cpf, 'tipo': tipo, 'cargo': cargo})
+
+
+def ler_token(token):
+    try:
+        return _serializador().loads(token, max_age=TOKEN_VALIDADE)
+    except (BadSignature, SignatureExpired):
+        return None
+
+
+def _token_do_pedido():
+    cabecalho = request.headers.get('Authorization', '')
+    if cabecalho.startswith('Bearer '):
+        return cabecalho[len('Bearer '):].strip()
+    # EventSource do navegador não manda cabeçalhos; o stream aceita ?token=
+    return request.args.get('token')
+
+
+def carregar_usuario():
+    # before_request: deixa g.usuario pronto para as rotas. Token inválido ou
+    # vencido já para aqui; sem token segue como anônimo e a rota decide.
+    g.usuario = None
+    token = _token_do_pedido()
+    if not token or request.endpoint in ROTAS_PUBLICAS:
+        return None
+    usuario = ler_token(token)
+    if usuario is None:
+        return jsonify({'msg': 'Token inválido ou expirado'}), 401
+    g.usuario = usuario
+    return None
+
+#----------------------------------------------------------------------------------------------------------------------------------
+def exige_funcionario(rota):
+    @wraps(rota)
+    def protegida(*args, **kwargs):
+        if g.usuario is None:
+            return jsonify({'msg': 'Login necessário'}), 401
+        if g.usuario.get('tipo') != 'funcionario':
+            return jsonify({'msg': 'Acesso restrito a funcionários'}), 403
+        return rota(*args, **kwargs)
+    return protegida
+
+
+# Paciente só mexe no próprio cpf; funcionário pode em qualquer um
+def exige_dono_ou_funcionario(rota):
+    @wraps(rota)
+    def protegida(cpf, *args, **kwargs):
+        if g.usuario is None:
+            return jsonify({'msg': 'Login necessário'}), 401
+        if g.usuario.get('tipo') != 'funcionario' and g.usuario.get('cpf') != cpf:
+            return jsonify({'msg': 'Acesso negado'}), 403
+        return rota(cpf, *args, **kwargs)
+    return protegida
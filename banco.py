@@ -0,0 +1,127 @@
+import os
+import threading
+from pymongo import MongoClient, monitoring
+from metricas import monitor_comandos
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Um único MongoClient por processo (cada worker do gunicorn tem o seu).
+# O pool de conexões é configurado por variáveis de ambiente.
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 50))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Contadores do pool, alimentados pelos eventos de monitoramento do pymongo
+class EstatisticasPool(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.zerar()
+
+    def zerar(self):
+        with self._lock:
+            self.conexoes_abertas = 0
+            self.conexoes_em_uso = 0
+            self.checkouts = 0
+            self.checkouts_falhos = 0
+            self.checkins = 0
+
+    def resumo(self):
+        with self._lock:
+            return {
+                'conexoes_abertas': self.conexoes_abertas,
+                'conexoes_em_uso': self.conexoes_em_uso,
+                'checkouts': self.checkouts,
+                'checkouts_falhos': self.checkouts_falhos,
+                'checkins': self.checkins,
+                'max_pool_size': MONGO_MAX_POOL_SIZE,
+            }
+
+    def connection_created(self, event):
+        with self._lock:
+            self.conexoes_abertas += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.conexoes_abertas -= 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checkouts += 1
+            self.conexoes_em_uso += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkouts_falhos += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checkins += 1
+            self.conexoes_em_uso -= 1
+
+    # Eventos que não usamos, mas que a interface exige
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+estatisticas_pool = EstatisticasPool()
+
+#----------------------------------------------------------------------------------------------------------------------------------
+def get_client(mongo_uri=None):
+    global _client, _client_pid
+
+    # Depois de um fork o client herdado não pode ser reutilizado
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _lock:
+        if _client is None or _client_pid != pid:
+            estatisticas_pool.zerar()
+            _client = MongoClient(
+                mongo_uri or os.getenv('MONGO_URI'),
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connect=False,
+                event_listeners=[estatisticas_pool, monitor_comandos],
+            )
+            _client_pid = pid
+    return _client
+
+
+# Depois do fork o client herdado é só esquecido: fechar mexeria nos sockets do
+# processo mestre. O próximo get_client cria um novo.
+def descartar_client():
+    global _client, _client_pid
+    with _lock:
+        _client = None
+        _client_pid = None
+        estatisticas_pool.zerar()
+
+
+def fechar_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
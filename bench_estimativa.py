@@ -0,0 +1,69 @@
+import random
+import pytest
+from estimativa import Agenda, TEMPO_GRAVIDADE, distribuir_baldes
+
+# Rodar com: python -m pytest bench_estimativa.py --benchmark-only
+pytest.importorskip("pytest_benchmark")
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Implementação antiga, mantida aqui só como referência
+def distribuir_baldes_antigo(tempos, n_funcionarios):
+    baldes = [0] * n_funcionarios
+    for tempo in tempos:
+        idx = baldes.index(min(baldes))
+        baldes[idx] += tempo
+    return baldes
+
+
+def inicios_antigo(tempos, n_funcionarios):
+    # O que as rotas faziam para cada posição: distribuir quem está na frente e pegar o menor balde
+    baldes = [0] * n_funcionarios
+    inicios = []
+    for tempo in tempos:
+        inicios.append(min(baldes))
+        idx = baldes.index(min(baldes))
+        baldes[idx] += tempo
+    return inicios
+
+
+def _tempos(n_pacientes, semente=0):
+    rnd = random.Random(semente)
+    valores = list(TEMPO_GRAVIDADE.values())
+    return [rnd.choice(valores) for _ in range(n_pacientes)]
+
+
+PACIENTES = [10, 1_000, 100_000]
+FUNCIONARIOS = [1, 5, 50, 200]
+
+#----------------------------------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize("n_funcionarios", FUNCIONARIOS)
+@pytest.mark.parametrize("n_pacientes", PACIENTES)
+def test_baldes_antigo(benchmark, n_pacientes, n_funcionarios):
+    tempos = _tempos(n_pacientes)
+    resultado = benchmark.pedantic(distribuir_baldes_antigo, args=(tempos, n_funcionarios), rounds=3)
+    assert resultado == distribuir_baldes(tempos, n_funcionarios)
+
+
+@pytest.mark.parametrize("n_funcionarios", FUNCIONARIOS)
+@pytest.mark.parametrize("n_pacientes", PACIENTES)
+def test_baldes_heap(benchmark, n_pacientes, n_funcionarios):
+    tempos = _tempos(n_pacientes)
+    resultado = benchmark.pedantic(distribuir_baldes, args=(tempos, n_funcionarios), rounds=3)
+    assert resultado == distribuir_baldes_antigo(tempos, n_funcionarios)
+
+
+@pytest.mark.parametrize("n_funcionarios", FUNCIONARIOS)
+@pytest.mark.parametrize("n_pacientes", PACIENTES)
+def test_inicios_agenda(benchmark, n_pacientes, n_funcionarios):
+    tempos = _tempos(n_pacientes)
+    gravidade = {t: g for g, t in TEMPO_GRAVIDADE.items()}
+    documentos = [{"triagem_oficial": gravidade[t]} for t in tempos]
+
+    def montar():
+        agenda = Agenda("triagem_oficial", n_funcionarios)
+        for documento in documentos:
+            agenda.adicionar_documento(documento)
+        return agenda.inicios
+
+    resultado = benchmark.pedantic(montar, rounds=3)
+    assert resultado == inicios_antigo(tempos, n_funcionarios)
@@ -0,0 +1,130 @@
+import pytest
+import mongomock
+import filas
+
+# Rodar com: python -m pytest bench_filas.py --benchmark-only
+pytest.importorskip("pytest_benchmark")
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Conta quantas operações cada caminho manda para o banco (cada uma é uma ida e
+# volta num Mongo de verdade)
+class ColecaoContada:
+    def __init__(self, colecao, contador):
+        self._colecao = colecao
+        self._contador = contador
+
+    def __getattr__(self, nome):
+        atributo = getattr(self._colecao, nome)
+        if not callable(atributo):
+            return atributo
+
+        def contado(*args, **kwargs):
+            self._contador[0] += 1
+            return atributo(*args, **kwargs)
+        return contado
+
+
+class BancoContado:
+    def __init__(self, db):
+        self._db = db
+        self.operacoes = [0]
+
+    def __getitem__(self, nome):
+        return ColecaoContada(self._db[nome], self.operacoes)
+
+    def __getattr__(self, nome):
+        return getattr(self._db, nome)
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Implementação antiga do DELETE /atendimento/<cpf>, mantida aqui só como referência
+def remover_antigo(db, cpf):
+    fila_atendimento = db['fila_atendimento']
+    paciente = fila_atendimento.find_one({"paciente_cpf": cpf})
+    posicao_removida = paciente.get("posicao_fila", None)
+    fila_atendimento.delete_one({"paciente_cpf": cpf})
+    fila_restante = list(fila_atendimento.find({"posicao_fila": {"$gt": posicao_removida}}))
+    for p in fila_restante:
+        fila_atendimento.update_one(
+            {"paciente_cpf": p["paciente_cpf"]},
+            {"$set": {"posicao_fila": p["posicao_fila"] - 1}}
+        )
+
+
+def _fila_antiga(tamanho):
+    db = mongomock.MongoClient().db
+    db.fila_atendimento.insert_many([
+        {"paciente_cpf": str(i), "posicao_fila": i, "triagem_oficial": "leve"} for i in range(1, tamanho + 1)
+    ])
+    return db
+
+
+def _fila_nova(tamanho):
+    db = mongomock.MongoClient().db
+    for i in range(1, tamanho + 1):
+        filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": str(i), "triagem_oficial": "leve"})
+    return db
+
+
+TAMANHOS = [10, 100, 300, 1000]
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Sempre remove quem está na frente, o pior caso da implementação antiga
+@pytest.mark.parametrize("tamanho", TAMANHOS)
+def test_remover_da_frente_antigo(benchmark, tamanho):
+    def preparar():
+        return (BancoContado(_fila_antiga(tamanho)), "1"), {}
+
+    bancos = []
+    benchmark.pedantic(lambda db, cpf: bancos.append(db) or remover_antigo(db, cpf),
+                       setup=preparar, rounds=5)
+    benchmark.extra_info['operacoes_no_banco'] = bancos[-1].operacoes[0]
+    assert bancos[-1].operacoes[0] == tamanho + 2
+
+
+@pytest.mark.parametrize("tamanho", TAMANHOS)
+def test_remover_da_frente_novo(benchmark, tamanho):
+    def preparar():
+        return (BancoContado(_fila_nova(tamanho)), filas.FILA_ATENDIMENTO, "1"), {}
+
+    bancos = []
+    benchmark.pedantic(lambda db, fila, cpf: bancos.append(db) or filas.sair(db, fila, cpf),
+                       setup=preparar, rounds=5)
+    benchmark.extra_info['operacoes_no_banco'] = bancos[-1].operacoes[0]
+    # delete + troca de geração; o snapshot fica para o próximo leitor
+    assert bancos[-1].operacoes[0] == 2
+
+
+@pytest.mark.parametrize("tamanho", TAMANHOS)
+def test_alta_em_lote_de_dez(benchmark, tamanho):
+    cpfs = [str(i) for i in range(1, 11)]
+
+    def preparar():
+        return (BancoContado(_fila_nova(tamanho)), filas.FILA_ATENDIMENTO, cpfs), {}
+
+    bancos = []
+    benchmark.pedantic(lambda db, fila, c: bancos.append(db) or filas.sair_varios(db, fila, c),
+                       setup=preparar, rounds=5)
+    benchmark.extra_info['operacoes_no_banco'] = bancos[-1].operacoes[0]
+    assert bancos[-1].operacoes[0] == 3
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Leitura da fila por um worker que ainda não tem a geração nova em memória (o caso
+# de toda consulta logo depois de uma alteração feita em outro worker)
+@pytest.mark.parametrize("snapshot", [False, True])
+@pytest.mark.parametrize("tamanho", TAMANHOS)
+def test_leitura_com_geracao_nova(benchmark, monkeypatch, tamanho, snapshot):
+    monkeypatch.setattr(filas, 'FILAS_SNAPSHOT', snapshot)
+    db = _fila_nova(tamanho)
+    # O primeiro leitor da geração grava o snapshot; os seguintes só leem
+    filas.ordem(db, filas.FILA_ATENDIMENTO)
+
+    def preparar():
+        filas._ordens.clear()
+        return (BancoContado(db), filas.FILA_ATENDIMENTO), {}
+
+    bancos = []
+    benchmark.pedantic(lambda banco, fila: bancos.append(banco) or filas.ordem(banco, fila),
+                       setup=preparar, rounds=20)
+    benchmark.extra_info['operacoes_no_banco'] = bancos[-1].operacoes[0]
+    # Com ou sem snapshot são duas idas ao banco; a diferença é o que volta na segunda
+    assert bancos[-1].operacoes[0] == 2
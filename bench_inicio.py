@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import pytest
+import mongomock
+import app as app_module
+
+# Rodar com: python -m pytest bench_inicio.py --benchmark-only
+pytest.importorskip("pytest_benchmark")
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Custo de subir um worker: montar o app com create_app(), importar tudo do zero
+# num processo novo (o que cada worker paga sem preload_app) e o primeiro pedido,
+# que paga o client do Mongo e as visões das filas ainda frias.
+def test_create_app(benchmark):
+    app = benchmark(app_module.create_app, {'SECRET_KEY': 'bench'})
+    assert 'healthcenter' in app.blueprints
+
+
+def test_import_a_frio(benchmark):
+    ambiente = {**os.environ, 'SECRET_KEY': 'bench'}
+
+    def importar():
+        subprocess.run([sys.executable, '-c', 'import wsgi'], check=True, env=ambiente,
+                       cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL)
+
+    benchmark.pedantic(importar, rounds=5, iterations=1)
+
+
+def test_primeiro_pedido(benchmark, monkeypatch):
+    import ciclo
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr('app.connect_db', lambda: db)
+
+    def preparar():
+        # Como logo depois do fork: nada em memória
+        ciclo.depois_do_fork()
+        return (app_module.create_app({'SECRET_KEY': 'bench'}).test_client(),), {}
+
+    resposta = benchmark.pedantic(lambda c: c.get('/saude/pronta'), setup=preparar, rounds=20)
+    assert resposta.status_code == 200
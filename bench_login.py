@@ -0,0 +1,73 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import mongomock
+import bcrypt
+import senhas
+from app import app as flask_app
+
+# Rodar com: python -m pytest bench_login.py --benchmark-only
+pytest.importorskip("pytest_benchmark")
+
+USUARIOS = 20
+SENHA = "senha123"
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Rajada de logins como na troca de turno: USUARIOS logins simultâneos. Mede a
+# vazão do login e, ao mesmo tempo, quanto demora um GET /saude que chega no meio.
+def _banco(rounds):
+    db = mongomock.MongoClient().db
+    senha_hash = bcrypt.hashpw(SENHA.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    db.pacientes.insert_many([
+        {"email": f"p{i}@exemplo.com", "senha": senha_hash, "cpf": str(i)} for i in range(USUARIOS)
+    ])
+    return db
+
+
+def _rajada(cliente_por_thread):
+    latencias_saude = []
+
+    def logar(i):
+        resposta = cliente_por_thread().post('/login', json={"email": f"p{i}@exemplo.com", "senha": SENHA})
+        assert resposta.status_code == 200
+
+    def consultar_saude():
+        inicio = time.perf_counter()
+        cliente_por_thread().get('/saude')
+        latencias_saude.append(time.perf_counter() - inicio)
+
+    with ThreadPoolExecutor(max_workers=USUARIOS + 1) as pool:
+        logins = [pool.submit(logar, i) for i in range(USUARIOS)]
+        time.sleep(0.01)
+        saude = pool.submit(consultar_saude)
+        for f in logins + [saude]:
+            f.result()
+    return latencias_saude[0]
+
+
+@pytest.mark.parametrize("rounds", [8, 10, 12])
+@pytest.mark.parametrize("workers", [1, 2, 4])
+def test_rajada_de_logins(benchmark, monkeypatch, rounds, workers):
+    db = _banco(rounds)
+    monkeypatch.setattr('app.connect_db', lambda: db)
+    monkeypatch.setattr(senhas, 'BCRYPT_LOG_ROUNDS', rounds)
+    monkeypatch.setattr(senhas, 'SENHAS_WORKERS', workers)
+    monkeypatch.setattr(senhas, '_vagas', threading.BoundedSemaphore(USUARIOS))
+    senhas.encerrar()
+    senhas.limite_login.limpar()
+
+    local = threading.local()
+
+    def cliente():
+        if not hasattr(local, 'cliente'):
+            local.cliente = flask_app.test_client()
+        return local.cliente
+
+    saude = []
+    benchmark.pedantic(lambda: saude.append(_rajada(cliente)), rounds=3)
+    # Com --benchmark-disable não há estatísticas, só a execução
+    if benchmark.stats:
+        benchmark.extra_info['logins_por_segundo'] = round(USUARIOS / benchmark.stats.stats.mean, 1)
+    benchmark.extra_info['saude_durante_rajada_ms'] = round(max(saude) * 1000, 2)
+    senhas.encerrar()
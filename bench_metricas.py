@@ -0,0 +1,53 @@
+import logging
+import pytest
+import mongomock
+import filas
+import metricas
+from app import app as flask_app
+
+# Rodar com: python -m pytest bench_metricas.py --benchmark-only
+pytest.importorskip("pytest_benchmark")
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Custo do middleware de métricas: o mesmo GET /triagem/<cpf> com e sem
+# instrumentação, e o middleware sozinho, sem a rota.
+CPF = "00000000001"
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    from disponibilidade import disponibilidade
+    import autenticacao
+    db = mongomock.MongoClient().db
+    db.funcionarios.insert_one({"disponível": True, "cargo": "atendimento"})
+    for i in range(100):
+        filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": f"{i:011d}", "triagem_oficial": "leve"})
+    monkeypatch.setattr('app.connect_db', lambda: db)
+    disponibilidade.limpar()
+    metricas.zerar()
+    # O log de cada pedido entra na conta, mas sem encher o terminal
+    monkeypatch.setattr(logging.getLogger('healthcenter').handlers[0], 'emit', lambda registro: None)
+    with flask_app.app_context():
+        token = autenticacao.emitir_token(CPF, "paciente")
+    with flask_app.test_client() as c:
+        c.environ_base['HTTP_AUTHORIZATION'] = f"Bearer {token}"
+        yield c
+
+
+@pytest.mark.parametrize("ativas", [False, True])
+def test_get_triagem(benchmark, cliente, monkeypatch, ativas):
+    monkeypatch.setattr(metricas, 'METRICAS_ATIVAS', ativas)
+    resposta = benchmark(cliente.get, f'/triagem/{CPF}')
+    assert resposta.status_code == 200
+
+
+def test_so_o_middleware(benchmark, monkeypatch):
+    monkeypatch.setattr(logging.getLogger('healthcenter').handlers[0], 'emit', lambda registro: None)
+    resposta = flask_app.response_class("ok")
+
+    def pedido():
+        metricas._antes_do_pedido()
+        metricas._depois_do_pedido(resposta)
+
+    with flask_app.test_request_context(f'/triagem/{CPF}'):
+        benchmark(pedido)
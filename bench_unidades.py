@@ -0,0 +1,80 @@
+import pytest
+import mongomock
+import filas
+from bench_filas import BancoContado
+from app import app as flask_app
+
+# Rodar com: python -m pytest bench_unidades.py --benchmark-only
+pytest.importorskip("pytest_benchmark")
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Custo por pedido numa unidade conforme o deploy ganha unidades, cada uma com a
+# mesma fila. A consulta (GET /unidades/<u>/triagem/<cpf> com geração nova, como
+# outro worker veria) lê filas_meta e o snapshot da unidade; a alta + entrada mexe
+# só nos documentos da unidade e em filas_meta. O número de operações no banco não
+# pode crescer com as unidades.
+#
+# O mongomock não usa índices: a alta (find_one_and_delete por cpf e unidade) ainda
+# percorre a coleção inteira, então o tempo dela cresce aqui e não num Mongo de
+# verdade (índice paciente_cpf_unico). A consulta não passa por essas coleções.
+UNIDADES = [1, 10, 50]
+PACIENTES = 50
+CPF = "00000000001"
+
+
+def _banco(n_unidades):
+    db = mongomock.MongoClient().db
+    for u in range(n_unidades):
+        db.funcionarios.insert_one({"disponível": True, "cargo": "atendimento", "unidade": f"u{u}"})
+        for i in range(PACIENTES):
+            filas.entrar(db, filas.FILA_ATENDIMENTO,
+                         {"paciente_cpf": f"{u:03d}{i:08d}", "nome": str(i), "triagem_oficial": "leve"}, f"u{u}")
+    return db
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    from disponibilidade import disponibilidade
+    import autenticacao
+    with flask_app.app_context():
+        token = autenticacao.emitir_token("0", "funcionario", "atendimento")
+
+    def montar(db):
+        monkeypatch.setattr('app.connect_db', lambda: db)
+        disponibilidade.limpar()
+        c = flask_app.test_client()
+        c.environ_base['HTTP_AUTHORIZATION'] = f"Bearer {token}"
+        return c
+    return montar
+
+
+@pytest.mark.parametrize("n_unidades", UNIDADES)
+def test_consulta_com_geracao_nova(benchmark, cliente, n_unidades):
+    banco = BancoContado(_banco(n_unidades))
+    c = cliente(banco)
+    # O primeiro leitor da geração grava o snapshot; a medida é a dos seguintes
+    c.get(f'/unidades/u0/triagem/{CPF}')
+
+    def consultar():
+        filas._ordens.clear()
+        return c.get(f'/unidades/u0/triagem/{CPF}')
+
+    resposta = benchmark(consultar)
+    assert resposta.status_code == 200
+    banco.operacoes[0] = 0
+    consultar()
+    benchmark.extra_info['operacoes_no_banco'] = banco.operacoes[0]
+
+
+@pytest.mark.parametrize("n_unidades", UNIDADES)
+def test_alta_e_entrada(benchmark, n_unidades):
+    banco = BancoContado(_banco(n_unidades))
+
+    def mexer():
+        filas.sair(banco, filas.FILA_ATENDIMENTO, CPF, "u0")
+        filas.entrar(banco, filas.FILA_ATENDIMENTO, {"paciente_cpf": CPF, "triagem_oficial": "leve"}, "u0")
+
+    benchmark(mexer)
+    banco.operacoes[0] = 0
+    mexer()
+    benchmark.extra_info['operacoes_no_banco'] = banco.operacoes[0]
@@ -0,0 +1,139 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+TRIAGEM_CACHE = os.getenv('TRIAGEM_CACHE', 'memoria')
+TRIAGEM_CACHE_MAX = int(os.getenv('TRIAGEM_CACHE_MAX', 5000))
+TRIAGEM_CACHE_TTL = int(os.getenv('TRIAGEM_CACHE_TTL', 6 * 60 * 60))
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# "Dor de Cabeça!!" e "dor de cabeca" viram a mesma chave
+def normalizar_sintomas(sintomas):
+    texto = unicodedata.normalize('NFKD', sintomas.casefold())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'[\W_]+', ' ', texto)
+    return texto.strip()
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Guarda a gravidade já extraída da resposta da IA, não a resposta inteira.
+# As duas implementações têm a mesma interface: obter, guardar, limpar, resumo.
+class CacheMemoria:
+    def __init__(self, max_itens=TRIAGEM_CACHE_MAX, ttl=TRIAGEM_CACHE_TTL):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, sintomas):
+        chave = normalizar_sintomas(sintomas)
+        agora = time.monotonic()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None or item[1] <= agora:
+                if item is not None:
+                    del self._itens[chave]
+                self.falhas += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return item[0]
+
+    def guardar(self, sintomas, gravidade):
+        chave = normalizar_sintomas(sintomas)
+        with self._lock:
+            self._itens[chave] = (gravidade, time.monotonic() + self.ttl)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self.acertos = 0
+            self.falhas = 0
+
+    def resumo(self):
+        with self._lock:
+            return {'tipo': 'memoria', 'itens': len(self._itens), 'acertos': self.acertos, 'falhas': self.falhas}
+
+
+# Versão compartilhada entre os workers. A expiração fica com um índice TTL em
+# expira_em e o LRU usa usado_em, atualizado a cada acerto.
+class CacheMongo:
+    def __init__(self, colecao, max_itens=TRIAGEM_CACHE_MAX, ttl=TRIAGEM_CACHE_TTL, podar_a_cada=100):
+        # colecao é uma função, para pegar o banco da hora (e o dos testes)
+        self._colecao = colecao
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self.podar_a_cada = podar_a_cada
+        self._escritas = 0
+        self._indices_criados = False
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def _contar(self, acerto):
+        with self._lock:
+            if acerto:
+                self.acertos += 1
+            else:
+                self.falhas += 1
+
+    def obter(self, sintomas):
+        agora = datetime.now(timezone.utc)
+        doc = self._colecao().find_one_and_update(
+            {'_id': normalizar_sintomas(sintomas), 'expira_em': {'$gt': agora}},
+            {'$set': {'usado_em': agora}},
+            projection={'gravidade': 1}
+        )
+        self._contar(doc is not None)
+        return doc['gravidade'] if doc else None
+
+    def guardar(self, sintomas, gravidade):
+        colecao = self._colecao()
+        if not self._indices_criados:
+            colecao.create_index('expira_em', expireAfterSeconds=0)
+            colecao.create_index('usado_em')
+            self._indices_criados = True
+
+        agora = datetime.now(timezone.utc)
+        colecao.update_one(
+            {'_id': normalizar_sintomas(sintomas)},
+            {'$set': {'gravidade': gravidade, 'usado_em': agora,
+                      'expira_em': agora + timedelta(seconds=self.ttl)}},
+            upsert=True
+        )
+
+        with self._lock:
+            self._escritas += 1
+            podar = self._escritas % self.podar_a_cada == 0
+        if podar:
+            self._podar(colecao)
+
+    def _podar(self, colecao):
+        excesso = colecao.estimated_document_count() - self.max_itens
+        if excesso > 0:
+            antigos = colecao.find({}, {'_id': 1}).sort('usado_em', 1).limit(excesso)
+            colecao.delete_many({'_id': {'$in': [d['_id'] for d in antigos]}})
+
+    def limpar(self):
+        self._colecao().delete_many({})
+        with self._lock:
+            self.acertos = 0
+            self.falhas = 0
+
+    def resumo(self):
+        with self._lock:
+            return {'tipo': 'mongo', 'acertos': self.acertos, 'falhas': self.falhas}
+
+
+def criar_cache(colecao=None, tipo=TRIAGEM_CACHE):
+    if tipo == 'mongo':
+        return CacheMongo(colecao)
+    return CacheMemoria()
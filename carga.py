@@ -0,0 +1,284 @@
+import argparse
+import heapq
+import json
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+import mongomock
+import app as app_module
+import senhas
+import triagem_ia
+import credenciais
+from perfis import perfis
+from disponibilidade import disponibilidade
+import estimativa
+from estimativa import TEMPO_GRAVIDADE
+from stub_ia import ServidorIAFalso
+
+# Rodar com: python carga.py --pacientes 500 --chegadas-por-hora 40
+#
+# Um dia de pronto-socorro contra o app Flask, em tempo simulado: chegadas de
+# Poisson, triagem de TEMPO_TRIAGEM minutos, atendimento com duração exponencial
+# de média TEMPO_GRAVIDADE (os dois lidos de estimativa.py, então valem os
+# TEMPOS_CALIBRADOS). Os eventos são gerados com uma semente fixa e executados um a
+# um, na ordem do relógio simulado; só a latência de cada pedido é medida de
+# verdade. Assim duas rodadas com a mesma semente fazem exatamente os mesmos pedidos
+# e o que muda entre elas é o custo de cada rota conforme as filas crescem.
+#
+# A vazão (pedidos/s) é sempre pedidos divididos por tempo de parede: no total, e
+# por rota e faixa de fila sobre o tempo de parede que o dia passou naquela faixa.
+
+MISTURA_PADRAO = {"leve": 0.6, "moderada": 0.3, "grave": 0.1}
+SINTOMAS = {
+    "leve": ["dor de garganta leve", "coriza e espirros", "dor de cabeça leve"],
+    "moderada": ["febre alta há dois dias", "vômito e diarreia", "dor abdominal forte"],
+    "grave": ["dor no peito e falta de ar", "desmaio e confusão", "sangramento intenso"],
+}
+SENHA = "senha-da-carga"
+
+#----------------------------------------------------------------------------------------------------------------------------------
+def percentil(valores, p):
+    # Posto mais próximo; valores já ordenados
+    if not valores:
+        return None
+    i = max(0, min(len(valores) - 1, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[i]
+
+
+class Medicoes:
+    def __init__(self, faixa=50):
+        self.faixa = faixa
+        self.latencias = defaultdict(list)
+        self.status = defaultdict(Counter)
+        # Tempo de parede por faixa: do fim de um pedido ao fim do seguinte, contando
+        # o trabalho do simulador entre eles; os pedidos rodam um de cada vez
+        self.parede = defaultdict(float)
+        self._marca = None
+        # Tempo de parede do dia inteiro
+        self.duracao = None
+
+    def iniciar(self):
+        self._marca = time.perf_counter()
+
+    def registrar(self, rota, tamanho_fila, segundos, status):
+        agora = time.perf_counter()
+        faixa = tamanho_fila // self.faixa
+        if self._marca is not None:
+            self.parede[faixa] += agora - self._marca
+        self._marca = agora
+        self.latencias[(rota, faixa)].append(segundos)
+        self.status[rota][status] += 1
+
+    def relatorio(self):
+        rotas = defaultdict(list)
+        for (rota, faixa), valores in sorted(self.latencias.items()):
+            valores = sorted(valores)
+            rotas[rota].append({
+                'fila': f"{faixa * self.faixa}-{(faixa + 1) * self.faixa - 1}",
+                'pedidos': len(valores),
+                'p50_ms': round(percentil(valores, 50) * 1000, 3),
+                'p95_ms': round(percentil(valores, 95) * 1000, 3),
+                'p99_ms': round(percentil(valores, 99) * 1000, 3),
+                'por_segundo': round(len(valores) / self.parede[faixa], 1) if self.parede[faixa] else None,
+            })
+        pedidos = sum(sum(c.values()) for c in self.status.values())
+        return {
+            'rotas': dict(rotas),
+            'pedidos': pedidos,
+            'duracao_s': round(self.duracao, 3) if self.duracao else None,
+            'por_segundo': round(pedidos / self.duracao, 1) if self.duracao else None,
+            'status': {rota: dict(c) for rota, c in self.status.items()},
+            'erros_5xx': sum(n for c in self.status.values() for s, n in c.items() if s >= 500),
+        }
+
+
+# Quanto o p50 da última faixa de fila cresceu em relação ao da primeira
+def crescimento(relatorio):
+    return {
+        rota: round(faixas[-1]['p50_ms'] / faixas[0]['p50_ms'], 2)
+        for rota, faixas in relatorio['rotas'].items()
+        if len(faixas) > 1 and faixas[0]['p50_ms']
+    }
+
+#----------------------------------------------------------------------------------------------------------------------------------
+def _pedir(cliente, medicoes, tamanho_fila, metodo, rota, url, **kwargs):
+    inicio = time.perf_counter()
+    resposta = cliente.open(url, method=metodo, **kwargs)
+    medicoes.registrar(f"{metodo} {rota}", tamanho_fila, time.perf_counter() - inicio, resposta.status_code)
+    return resposta
+
+
+def _preparar_banco(db, triagistas, atendentes):
+    senha_hash = senhas.gerar_hash(SENHA)
+    funcionarios = [("triagem", i) for i in range(triagistas)] + [("atendimento", i) for i in range(atendentes)]
+    for cargo, i in funcionarios:
+        db.funcionarios.insert_one({
+            "email": f"{cargo}{i}@carga.local", "senha": senha_hash, "cpf": f"9{len(cargo)}{i:09d}",
+            "cargo": cargo, "disponível": True,
+        })
+    return f"{funcionarios[0][0]}0@carga.local"
+
+
+def _zerar_estado():
+    app_module.cache_sintomas.limpar()
+    disponibilidade.limpar()
+    perfis.limpar()
+    credenciais.ausentes.limpar()
+    senhas.limite_login.limpar()
+    triagem_ia.disjuntor.fechar()
+
+
+def simular_dia(pacientes=200, chegadas_por_hora=30, triagistas=2, atendentes=4, mistura=None,
+                latencia_ia=0.05, modo='hybrid', semente=42, consultas_a_cada=10, faixa=50,
+                rounds=4, db=None):
+    rng = random.Random(semente)
+    mistura = mistura or MISTURA_PADRAO
+    db = db if db is not None else mongomock.MongoClient().db
+    medicoes = Medicoes(faixa)
+
+    originais = (app_module.connect_db, triagem_ia.URL_IA, triagem_ia.TRIAGEM_MODO, senhas.BCRYPT_LOG_ROUNDS)
+    servidor_ia = ServidorIAFalso(resposta="moderado", latencia=latencia_ia).iniciar()
+    app_module.connect_db = lambda: db
+    triagem_ia.URL_IA = servidor_ia.url
+    triagem_ia.TRIAGEM_MODO = modo
+    senhas.BCRYPT_LOG_ROUNDS = rounds
+    _zerar_estado()
+    inicio = time.perf_counter()
+    medicoes.iniciar()
+    try:
+        email_funcionario = _preparar_banco(db, triagistas, atendentes)
+        cliente = app_module.app.test_client()
+        resposta = cliente.post('/login', json={"email": email_funcionario, "senha": SENHA})
+        token_funcionario = {"Authorization": f"Bearer {resposta.get_json()['token']}"}
+
+        eventos = []
+        sequencia = iter(range(sys.maxsize))
+
+        def agendar(t, tipo, cpf=None):
+            heapq.heappush(eventos, (t, next(sequencia), tipo, cpf))
+
+        t = 0.0
+        for i in range(pacientes):
+            t += rng.expovariate(chegadas_por_hora / 60)
+            agendar(t, 'chegada', f"{10 ** 9 + i:011d}")
+
+        gravidades = {}
+        tokens = {}
+        esperando_triagem, esperando_atendimento = [], []
+        na_triagem, no_atendimento = set(), set()
+        livres = {'triagem': triagistas, 'atendimento': atendentes}
+
+        def tamanho_fila():
+            return len(na_triagem) + len(no_atendimento)
+
+        while eventos:
+            agora, _, tipo, cpf = heapq.heappop(eventos)
+
+            if tipo == 'chegada':
+                gravidade = rng.choices(list(mistura), weights=list(mistura.values()))[0]
+                gravidades[cpf] = gravidade
+                email = f"{cpf}@carga.local"
+                _pedir(cliente, medicoes, tamanho_fila(), 'POST', '/cadastro', '/cadastro', json={
+                    "email": email, "senha": SENHA, "cpf": cpf, "nome_completo": f"Paciente {cpf}"})
+                resposta = _pedir(cliente, medicoes, tamanho_fila(), 'POST', '/login', '/login',
+                                  json={"email": email, "senha": SENHA})
+                tokens[cpf] = {"Authorization": f"Bearer {resposta.get_json()['token']}"}
+                _pedir(cliente, medicoes, tamanho_fila(), 'POST', '/triagem/<cpf>', f'/triagem/{cpf}',
+                       headers=tokens[cpf], json={"sintomas": rng.choice(SINTOMAS[gravidade])})
+                na_triagem.add(cpf)
+                esperando_triagem.append(cpf)
+                agendar(agora + consultas_a_cada, 'consulta', cpf)
+
+            elif tipo == 'consulta':
+                if cpf in na_triagem or cpf in no_atendimento:
+                    _pedir(cliente, medicoes, tamanho_fila(), 'GET', '/triagem/<cpf>', f'/triagem/{cpf}',
+                           headers=tokens[cpf])
+                    agendar(agora + consultas_a_cada, 'consulta', cpf)
+
+            elif tipo == 'fim_triagem':
+                _pedir(cliente, medicoes, tamanho_fila(), 'PUT', '/triagem_e_fila/<cpf>', f'/triagem_e_fila/{cpf}',
+                       headers=token_funcionario, json={"triagem_oficial": gravidades[cpf]})
+                na_triagem.discard(cpf)
+                no_atendimento.add(cpf)
+                esperando_atendimento.append(cpf)
+                livres['triagem'] += 1
+
+            elif tipo == 'fim_atendimento':
+                _pedir(cliente, medicoes, tamanho_fila(), 'DELETE', '/atendimento/<cpf>', f'/atendimento/{cpf}',
+                       headers=token_funcionario)
+                no_atendimento.discard(cpf)
+                livres['atendimento'] += 1
+
+            # Funcionário livre chama o próximo da fila, na ordem de chegada
+            while livres['triagem'] and esperando_triagem:
+                livres['triagem'] -= 1
+                agendar(agora + estimativa.TEMPO_TRIAGEM, 'fim_triagem', esperando_triagem.pop(0))
+            while livres['atendimento'] and esperando_atendimento:
+                livres['atendimento'] -= 1
+                proximo = esperando_atendimento.pop(0)
+                duracao = rng.expovariate(1 / TEMPO_GRAVIDADE[gravidades[proximo]])
+                agendar(agora + duracao, 'fim_atendimento', proximo)
+
+        # Espera as classificações da IA que ainda estão no pool antes de trocar o banco de volta
+        triagem_ia.encerrar(esperar=True)
+        medicoes.duracao = time.perf_counter() - inicio
+    finally:
+        servidor_ia.parar()
+        app_module.connect_db, triagem_ia.URL_IA, triagem_ia.TRIAGEM_MODO, senhas.BCRYPT_LOG_ROUNDS = originais
+
+    relatorio = medicoes.relatorio()
+    relatorio['ia'] = {'chamadas': servidor_ia.total, 'max_simultaneas': servidor_ia.max_simultaneos}
+    return relatorio
+
+#----------------------------------------------------------------------------------------------------------------------------------
+def imprimir(relatorio):
+    print(f"{'rota':<28} {'fila':>9} {'pedidos':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'pedidos/s':>10}")
+    for rota, faixas in relatorio['rotas'].items():
+        for f in faixas:
+            print(f"{rota:<28} {f['fila']:>9} {f['pedidos']:>8} {f['p50_ms']:>9} {f['p95_ms']:>9} "
+                  f"{f['p99_ms']:>9} {f['por_segundo']!s:>10}")
+    print()
+    print(f"Pedidos: {relatorio['pedidos']} em {relatorio['duracao_s']} s ({relatorio['por_segundo']} pedidos/s)")
+    print(f"Erros 5xx: {relatorio['erros_5xx']}  Chamadas à IA: {relatorio['ia']['chamadas']}")
+    print(f"Crescimento do p50 (última faixa / primeira): {crescimento(relatorio)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Carga de um dia de pronto-socorro contra o app")
+    parser.add_argument('--pacientes', type=int, default=200)
+    parser.add_argument('--chegadas-por-hora', type=float, default=30)
+    parser.add_argument('--triagistas', type=int, default=2)
+    parser.add_argument('--atendentes', type=int, default=4)
+    parser.add_argument('--latencia-ia', type=float, default=0.05, help="segundos")
+    parser.add_argument('--modo', choices=['local', 'remote', 'hybrid'], default='hybrid')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--consultas-a-cada', type=float, default=10, help="minutos simulados")
+    parser.add_argument('--faixa', type=int, default=50, help="largura das faixas de tamanho de fila")
+    parser.add_argument('--json', help="grava o relatório neste arquivo")
+    parser.add_argument('--limite-crescimento', type=float,
+                        help="falha se o p50 de alguma rota crescer mais que isso entre a primeira e a última faixa")
+    args = parser.parse_args(argv)
+
+    relatorio = simular_dia(
+        pacientes=args.pacientes, chegadas_por_hora=args.chegadas_por_hora, triagistas=args.triagistas,
+        atendentes=args.atendentes, latencia_ia=args.latencia_ia, modo=args.modo, semente=args.semente,
+        consultas_a_cada=args.consultas_a_cada, faixa=args.faixa,
+    )
+    imprimir(relatorio)
+    if args.json:
+        with open(args.json, 'w') as arquivo:
+            json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+
+    if relatorio['erros_5xx']:
+        return 1
+    if args.limite_crescimento:
+        estourados = {r: c for r, c in crescimento(relatorio).items() if c > args.limite_crescimento}
+        if estourados:
+            print(f"Rotas acima do limite de crescimento: {estourados}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
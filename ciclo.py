@@ -0,0 +1,56 @@
+import os
+import threading
+import banco
+import filas
+import indices
+import senhas
+import triagem_ia
+from disponibilidade import disponibilidade
+from eventos import barramento
+from registro import log
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Ciclo de vida de cada worker em produção (ver gunicorn.conf.py).
+#
+# Depois do fork: nada herdado do processo mestre é reaproveitado (client do
+# Mongo, sessão HTTP, pools de threads, contagens e visões em memória).
+#
+# No SIGTERM: o worker passa a responder 503 no /saude/pronta para o balanceador
+# tirar ele da rota, os streams SSE se despedem, e os pedidos em andamento
+# terminam dentro do graceful_timeout. Na saída espera as classificações da IA
+# que ainda estão no pool antes de fechar as conexões.
+drenando = threading.Event()
+
+
+# Na subida do servidor, antes dos workers (gunicorn when_ready, python app.py).
+# Fecha o client em seguida para nenhum worker herdar conexões abertas.
+def preparar_banco():
+    db = banco.get_client(os.getenv('MONGO_URI'))[os.getenv('DB_NAME', 'healthcenter')]
+    indices.garantir_indices(db)
+    banco.fechar_client()
+
+
+def depois_do_fork():
+    drenando.clear()
+    banco.descartar_client()
+    triagem_ia.descartar()
+    senhas.descartar()
+    disponibilidade.limpar()
+    filas.limpar_visoes()
+
+
+def iniciar_drenagem():
+    if drenando.is_set():
+        return
+    drenando.set()
+    log.info("drenando worker")
+    # Acorda quem está esperando no barramento para os streams verem a drenagem
+    barramento.acordar_todos()
+
+
+def encerrar_worker():
+    triagem_ia.encerrar(esperar=True)
+    senhas.encerrar(esperar=True)
+    triagem_ia.fechar_sessao()
+    banco.fechar_client()
+    log.info("worker encerrado")
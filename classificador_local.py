@@ -0,0 +1,65 @@
+import re
+from cache_sintomas import normalizar_sintomas
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Classificação por palavras-chave, rodando no próprio processo.
+#
+# Cada gravidade tem uma lista de (expressão, peso), compilada uma vez na importação.
+# A pontuação de uma gravidade é a soma dos pesos das expressões encontradas no texto
+# normalizado. A confiança cai quando nada bate ou quando gravidades diferentes empatam;
+# com confiança baixa quem chama deve perguntar à IA.
+REGRAS = {
+    "grave": [
+        (r"dor no peito|dor toracica|aperto no peito", 1.0),
+        (r"falta de ar|nao consigo respirar|dificuldade (para|de) respirar", 1.0),
+        (r"desmai\w*|inconsciente|perdeu a consciencia", 1.0),
+        (r"convuls\w*|avc|derrame|infarto|paralisi\w*", 1.0),
+        (r"sangramento (forte|intenso)|hemorragia|vomit\w* (com )?sangue", 1.0),
+        (r"queimadura grave|fratura exposta|boca torta", 1.0),
+    ],
+    "moderada": [
+        (r"febre alta|febre (ha|faz) \w+ dias", 0.8),
+        (r"vomit\w*|diarreia", 0.5),
+        (r"dor abdominal|dor na barriga|dor nas costas", 0.5),
+        (r"fratura|torc\w*|corte profundo|ponto\w*", 0.6),
+        (r"falta de apetite|desidrat\w*|tontura", 0.4),
+    ],
+    "leve": [
+        (r"resfriad\w*|gripe|coriza|nariz entupido|espirr\w*", 0.5),
+        (r"dor de garganta|tosse|rouquidao", 0.5),
+        (r"dor de cabeca|enxaqueca", 0.5),
+        (r"enjoo|cansaco|mal estar", 0.3),
+        (r"corte pequeno|arranh\w*|picada", 0.5),
+    ],
+}
+
+# Na dúvida entre duas gravidades com a mesma pontuação, fica com a mais séria
+ORDEM = ["grave", "moderada", "leve"]
+
+_REGRAS = {
+    grav: [(re.compile(rf"\b(?:{expressao})\b"), peso) for expressao, peso in regras]
+    for grav, regras in REGRAS.items()
+}
+
+#----------------------------------------------------------------------------------------------------------------------------------
+def pontuar(sintomas):
+    texto = normalizar_sintomas(sintomas)
+    return {grav: sum(peso for padrao, peso in regras if padrao.search(texto))
+            for grav, regras in _REGRAS.items()}
+
+
+# Devolve (gravidade, confianca), com confianca entre 0 e 1.
+# Sem nenhuma pista fica em "moderada" com confiança zero: melhor superestimar do
+# que mandar um caso sério para o fim da fila.
+def classificar_local(sintomas):
+    pontos = pontuar(sintomas)
+    ordenadas = sorted(ORDEM, key=lambda g: (-pontos[g], ORDEM.index(g)))
+    primeira, segunda = pontos[ordenadas[0]], pontos[ordenadas[1]]
+    if primeira == 0:
+        return "moderada", 0.0
+    confianca = min(1.0, primeira) * (primeira - segunda) / primeira
+    return ordenadas[0], round(confianca, 3)
+
+
+def gravidade_local(sintomas):
+    return classificar_local(sintomas)[0]
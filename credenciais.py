@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from registro import log
+
+CREDENCIAIS = 'credenciais'
+# Ordem em que o login antigo procurava o email
+ORIGENS = (('paciente', 'pacientes'), ('funcionario', 'funcionarios'))
+
+CREDENCIAIS_TTL_AUSENTE = float(os.getenv('CREDENCIAIS_TTL_AUSENTE', 10))
+CREDENCIAIS_MAX_AUSENTES = int(os.getenv('CREDENCIAIS_MAX_AUSENTES', 10000))
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Emails que não existem em lugar nenhum, guardados por pouco tempo para que uma
+# rajada de logins com email errado não vire três consultas por tentativa.
+# O cadastro tira o email daqui; em outro worker ele some sozinho depois do TTL.
+class EmailsAusentes:
+    def __init__(self, max_itens=CREDENCIAIS_MAX_AUSENTES, ttl=CREDENCIAIS_TTL_AUSENTE):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def contem(self, email):
+        agora = time.monotonic()
+        with self._lock:
+            validade = self._itens.get(email)
+            if validade is None:
+                return False
+            if validade <= agora:
+                del self._itens[email]
+                return False
+            return True
+
+    def guardar(self, email):
+        with self._lock:
+            self._itens[email] = time.monotonic() + self.ttl
+            self._itens.move_to_end(email)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def esquecer(self, email):
+        with self._lock:
+            self._itens.pop(email, None)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+    def resumo(self):
+        with self._lock:
+            return {'emails_ausentes': len(self._itens)}
+
+
+ausentes = EmailsAusentes()
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Uma credencial por email (índice único), com o tipo, o cpf, o cargo e o hash da senha:
+# o login acha o usuário com uma consulta só, sem procurar em cada coleção.
+# A credencial é a fonte para o login: todo caminho do app que grava email, senha ou
+# cargo (cadastro, rehash no login) grava aqui também. Usuário criado, alterado ou
+# apagado direto no banco só vale depois de `flask --app app sincronizar-credenciais`.
+def _credencial(tipo, usuario):
+    return {
+        'email': usuario.get('email'),
+        'senha': usuario.get('senha'),
+        'tipo': tipo,
+        'cpf': usuario.get('cpf'),
+        'cargo': usuario.get('cargo'),
+        'origem_id': usuario.get('_id'),
+    }
+
+
+def registrar(db, tipo, usuario):
+    credencial = _credencial(tipo, usuario)
+    db[CREDENCIAIS].update_one({'email': credencial['email']}, {'$set': credencial}, upsert=True)
+    ausentes.esquecer(credencial['email'])
+    return credencial
+
+
+def buscar(db, email):
+    if ausentes.contem(email):
+        return None
+
+    credencial = db[CREDENCIAIS].find_one({'email': email})
+    if credencial:
+        return credencial
+
+    # Usuário de antes da coleção existir (ou funcionário criado direto no banco):
+    # procura do jeito antigo e já deixa a credencial pronta para a próxima vez
+    for tipo, colecao in ORIGENS:
+        usuario = db[colecao].find_one({'email': email})
+        if usuario:
+            return registrar(db, tipo, usuario)
+
+    ausentes.guardar(email)
+    return None
+
+
+def atualizar_senha(db, credencial, senha_hash):
+    colecao = dict(ORIGENS)[credencial['tipo']]
+    db[CREDENCIAIS].update_one({'email': credencial['email'], 'senha': credencial['senha']},
+                               {'$set': {'senha': senha_hash}})
+    db[colecao].update_one({'_id': credencial['origem_id']}, {'$set': {'senha': senha_hash}})
+
+
+# Refaz a coleção a partir de pacientes e funcionarios, para rodar depois de criar
+# ou apagar usuários direto no banco: credencial sem documento de origem é removida.
+# Em email repetido vale o paciente, como no login antigo.
+def sincronizar(db):
+    por_email = {}
+    for tipo, colecao in reversed(ORIGENS):
+        for usuario in db[colecao].find({'email': {'$type': 'string'}}):
+            por_email[usuario['email']] = (tipo, usuario)
+    for tipo, usuario in por_email.values():
+        registrar(db, tipo, usuario)
+    removidas = db[CREDENCIAIS].delete_many({'email': {'$nin': list(por_email)}}).deleted_count
+    if removidas:
+        log.info("credenciais sem usuário removidas", extra={'campos': {'removidas': removidas}})
+    ausentes.limpar()
+    return len(por_email)
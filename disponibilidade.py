@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from registro import log
+import unidades
+from unidades import UNIDADE_PADRAO
+
+DISPONIBILIDADE_TTL = float(os.getenv('DISPONIBILIDADE_TTL', 10))
+# Com o change stream ligado a contagem só é refeita quando algo muda; esse TTL
+# longo é só uma rede de segurança caso algum evento se perca
+DISPONIBILIDADE_TTL_COM_STREAM = float(os.getenv('DISPONIBILIDADE_TTL_COM_STREAM', 300))
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Quantos funcionários disponíveis existem por cargo, guardado em memória.
+#
+# A disponibilidade muda poucas vezes por turno, enquanto os pacientes consultam a
+# fila o tempo todo. As rotas leem daqui sem ir ao banco; a contagem é refeita com
+# uma única agregação quando expira, quando o change stream de funcionarios avisa
+# de uma alteração ou quando alguém chama invalidar().
+#
+# As contagens são por unidade (funcionário sem o campo é da UNIDADE_PADRAO); com
+# UNIDADES_ATENDIDAS a agregação só conta as unidades deste processo.
+class Disponibilidade:
+    def __init__(self, ttl=DISPONIBILIDADE_TTL, ttl_com_stream=DISPONIBILIDADE_TTL_COM_STREAM):
+        self.ttl = ttl
+        self.ttl_com_stream = ttl_com_stream
+        self._lock = threading.Lock()
+        self.limpar()
+
+    def limpar(self):
+        with self._lock:
+            self._contagens = None
+            self._validade = 0.0
+            self._observador = None
+            self._observador_pid = None
+            self.observando = False
+
+    def invalidar(self):
+        with self._lock:
+            self._validade = 0.0
+
+    def contar(self, db, cargo, unidade=UNIDADE_PADRAO):
+        self._iniciar_observador(db)
+        with self._lock:
+            if self._contagens is not None and time.monotonic() < self._validade:
+                return self._contagens.get(unidade, {}).get(cargo, 0)
+
+        contagens = self._recontar(db)
+        ttl = self.ttl_com_stream if self.observando else self.ttl
+        with self._lock:
+            self._contagens = contagens
+            self._validade = time.monotonic() + ttl
+        return contagens.get(unidade, {}).get(cargo, 0)
+
+    def resumo(self):
+        with self._lock:
+            return {
+                'contagens': {u: dict(c) for u, c in (self._contagens or {}).items()},
+                'change_stream': self.observando,
+            }
+
+    def _recontar(self, db):
+        filtro = {'disponível': True}
+        if unidades.UNIDADES_ATENDIDAS:
+            atendidas = list(unidades.UNIDADES_ATENDIDAS)
+            if UNIDADE_PADRAO in unidades.UNIDADES_ATENDIDAS:
+                atendidas.append(None)
+            filtro['unidade'] = {'$in': atendidas}
+        grupos = db['funcionarios'].aggregate([
+            {'$match': filtro},
+            {'$group': {
+                '_id': {'unidade': {'$ifNull': ['$unidade', UNIDADE_PADRAO]}, 'cargo': '$cargo'},
+                'n': {'$sum': 1}
+            }}
+        ])
+        contagens = {}
+        for g in grupos:
+            contagens.setdefault(g['_id']['unidade'], {})[g['_id']['cargo']] = g['n']
+        return contagens
+
+    #------------------------------------------------------------------------------------------------------------------------------
+    # Change stream só existe em replica set; sem ele fica valendo o TTL curto
+    def _iniciar_observador(self, db):
+        pid = os.getpid()
+        if self._observador_pid == pid:
+            return
+        with self._lock:
+            if self._observador_pid == pid:
+                return
+            self._observador_pid = pid
+            try:
+                stream = db['funcionarios'].watch(full_document='updateLookup')
+            except Exception:
+                self.observando = False
+                return
+            self.observando = True
+            self._observador = threading.Thread(
+                target=self._observar, args=(stream,), daemon=True, name='disponibilidade'
+            )
+            self._observador.start()
+
+    def _observar(self, stream):
+        try:
+            with stream:
+                for _ in stream:
+                    self.invalidar()
+        except Exception as e:
+            log.warning("change stream de funcionarios parou", extra={'campos': {'erro': str(e)}})
+        finally:
+            # Volta para o TTL curto; a próxima contagem tenta abrir o stream de novo
+            with self._lock:
+                self.observando = False
+                self._observador_pid = None
+                self._validade = 0.0
+
+
+disponibilidade = Disponibilidade()
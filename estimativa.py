@@ -0,0 +1,144 @@
+import heapq
+import json
+import os
+
+#----------------------------------------------------------------------------------------------------------------------------------
+TEMPO_GRAVIDADE = {
+    "leve": 20,
+    "moderada": 40,
+    "grave": 70
+}
+# Minutos de cada triagem
+TEMPO_TRIAGEM = 5
+
+
+# Tempos calibrados pelo simulacao.py a partir do histórico das filas. Atualiza o
+# dicionário no lugar, para quem já importou TEMPO_GRAVIDADE ver os valores novos.
+def carregar_tempos(caminho):
+    global TEMPO_TRIAGEM
+    with open(caminho) as arquivo:
+        tempos = json.load(arquivo)
+    novos = {g: int(t) for g, t in tempos.get('tempo_gravidade', {}).items() if g in TEMPO_GRAVIDADE and int(t) > 0}
+    TEMPO_GRAVIDADE.update(novos)
+    if int(tempos.get('tempo_triagem', 0)) > 0:
+        TEMPO_TRIAGEM = int(tempos['tempo_triagem'])
+    return dict(TEMPO_GRAVIDADE), TEMPO_TRIAGEM
+
+
+if os.getenv('TEMPOS_CALIBRADOS'):
+    carregar_tempos(os.getenv('TEMPOS_CALIBRADOS'))
+#----------------------------------------------------------------------------------------------------------------------------------
+# Cada tempo vai para o balde de menor carga (empate: menor índice). O heap de
+# (carga, índice) dá a mesma escolha que baldes.index(min(baldes)) em O(log k).
+def distribuir_baldes(tempos, n_funcionarios):
+    cargas = [(0, i) for i in range(n_funcionarios)]
+    for tempo in tempos:
+        carga, idx = cargas[0]
+        heapq.heapreplace(cargas, (carga + tempo, idx))
+
+    baldes = [0] * n_funcionarios
+    for carga, idx in cargas:
+        baldes[idx] = carga
+    return baldes
+
+
+def tempo_do_documento(documento, campo):
+    grav = (documento.get(campo) or "").lower().strip()
+    return TEMPO_GRAVIDADE.get(grav)
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Agenda incremental dos atendentes.
+#
+# Mesma regra do distribuir_baldes (cada paciente vai para o funcionário com menor
+# carga, empate fica com o de menor índice), só que com um heap e guardando, para
+# cada documento da fila, o menor balde no momento em que ele chega. Esse valor é
+# exatamente o min(distribuir_baldes(tempos_antes, n)) que as rotas calculavam, então
+# a estimativa de qualquer posição vira uma consulta em lista.
+class Agenda:
+    def __init__(self, campo, n_funcionarios, tempos_iniciais=()):
+        self.campo = campo
+        self.n_funcionarios = n_funcionarios
+        self._cargas = [(0, i) for i in range(n_funcionarios)]
+        self._alocados_iniciais = 0
+        for tempo in tempos_iniciais:
+            self._alocar(tempo)
+            self._alocados_iniciais += 1
+        self.inicios = []
+        self.validos_antes = []
+        self._validos = 0
+        self.base = None
+
+    # Agenda pronta vinda do snapshot da fila (filas.py), sem refazer as alocações
+    @classmethod
+    def restaurar(cls, campo, inicios, validos_antes, validos, baldes):
+        agenda = cls(campo, len(baldes))
+        agenda._cargas = [(carga, i) for i, carga in enumerate(baldes)]
+        heapq.heapify(agenda._cargas)
+        agenda.inicios = list(inicios)
+        agenda.validos_antes = list(validos_antes)
+        agenda._validos = validos
+        return agenda
+
+    def _alocar(self, tempo):
+        carga, idx = self._cargas[0]
+        heapq.heapreplace(self._cargas, (carga + tempo, idx))
+
+    def adicionar_documento(self, documento):
+        self.inicios.append(self._cargas[0][0])
+        self.validos_antes.append(self._alocados_iniciais + self._validos)
+        tempo = tempo_do_documento(documento, self.campo)
+        if tempo is not None:
+            self._alocar(tempo)
+            self._validos += 1
+
+    def inicio(self, indice):
+        # Menor balde quando o documento de índice `indice` chega na fila
+        return self.inicios[indice]
+
+    def baldes(self):
+        baldes = [0] * self.n_funcionarios
+        for carga, idx in self._cargas:
+            baldes[idx] = carga
+        return baldes
+
+
+def _construtor(campo, n_funcionarios, tempos_iniciais=()):
+    def construir(documentos):
+        agenda = Agenda(campo, n_funcionarios, tempos_iniciais)
+        for documento in documentos:
+            agenda.adicionar_documento(documento)
+        return agenda
+    return construir
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# A agenda fica guardada na visão da fila (filas.OrdemFila), então todos os pedidos
+# da mesma geração usam o mesmo cálculo, e novos pacientes no fim da fila só
+# acrescentam uma entrada.
+def agenda_atendimento(visao_atendimento, n_funcionarios):
+    return visao_atendimento.derivado(
+        ('triagem_oficial', n_funcionarios),
+        _construtor('triagem_oficial', n_funcionarios)
+    )
+
+
+def agenda_triagem(visao_triagem, visao_atendimento, n_funcionarios):
+    # Quem está na triagem entra depois de toda a fila de atendimento, então a
+    # agenda também depende da geração da fila de atendimento
+    chave = ('triagemIA', n_funcionarios)
+
+    def construir(documentos):
+        tempos = [t for t in (tempo_do_documento(d, 'triagem_oficial')
+                              for d in visao_atendimento.documentos) if t is not None]
+        agenda = _construtor('triagemIA', n_funcionarios, tempos)(documentos)
+        agenda.base = (visao_atendimento, len(visao_atendimento))
+        return agenda
+
+    # A visão de atendimento só cresce no fim dentro da mesma geração, então
+    # identidade + tamanho bastam para saber se a base ainda vale
+    agenda = visao_triagem.derivado(chave, construir)
+    if agenda.base != (visao_atendimento, len(visao_atendimento)):
+        with visao_triagem.lock:
+            if visao_triagem.derivados.get(chave) is agenda:
+                del visao_triagem.derivados[chave]
+        agenda = visao_triagem.derivado(chave, construir)
+    return agenda
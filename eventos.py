@@ -0,0 +1,54 @@
+import threading
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Barramento de mudanças das filas, dentro do processo.
+#
+# filas.marcar_alteracao publica aqui depois de toda entrada, promoção e remoção.
+# Quem acompanha a fila por streaming espera neste barramento em vez de consultar
+# o banco de tempos em tempos: uma mudança acorda todos os inscritos de uma vez, e
+# como a agenda de estimativas é guardada por geração da fila, o cálculo pesado
+# acontece uma vez só e é dividido entre todos.
+#
+# Versões por (unidade, fila) e uma condição por unidade: mudança numa unidade só
+# acorda quem acompanha aquela unidade. acordar_todos (drenagem do worker) acorda
+# todo mundo.
+class BarramentoFilas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conds = {}
+        self._versoes = {}
+        self._geral = 0
+
+    def _cond(self, unidade):
+        with self._lock:
+            cond = self._conds.get(unidade)
+            if cond is None:
+                cond = self._conds[unidade] = threading.Condition()
+            return cond
+
+    def versao(self, unidade, filas):
+        return (self._geral,) + tuple(self._versoes.get((unidade, fila), 0) for fila in filas)
+
+    def publicar(self, fila, unidade):
+        cond = self._cond(unidade)
+        with cond:
+            self._versoes[(unidade, fila)] = self._versoes.get((unidade, fila), 0) + 1
+            cond.notify_all()
+
+    def acordar_todos(self):
+        with self._lock:
+            self._geral += 1
+            conds = list(self._conds.values())
+        for cond in conds:
+            with cond:
+                cond.notify_all()
+
+    def esperar(self, unidade, filas, versao_vista, timeout=None):
+        # Devolve a versão atual; se for igual à vista, deu timeout sem mudança
+        cond = self._cond(unidade)
+        with cond:
+            cond.wait_for(lambda: self.versao(unidade, filas) != versao_vista, timeout=timeout)
+            return self.versao(unidade, filas)
+
+
+barramento = BarramentoFilas()
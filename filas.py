@@ -0,0 +1,365 @@
+import os
+import random
+import time
+import uuid
+import threading
+from bisect import bisect_left
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import ConfigurationError, OperationFailure, PyMongoError
+from pymongo.errors import DuplicateKeyError
+from eventos import barramento
+from estimativa import Agenda, agenda_atendimento
+from disponibilidade import disponibilidade
+import unidades
+from unidades import UNIDADE_PADRAO
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Filas persistidas com chaves esparsas.
+#
+# O campo posicao_fila guardado no banco é só uma chave de ordenação: cada entrada
+# recebe o próximo valor de um contador (filas_meta.seq), então remover alguém não
+# mexe em quem está atrás. A posição que o paciente vê é calculada na leitura
+# (quantas chaves menores existem + 1).
+#
+# Cada alteração também troca a "geracao" da fila em filas_meta. Quem lê pode
+# guardar uma visão ordenada da fila em memória e reaproveitá-la enquanto a
+# geração não mudar. Cálculos derivados da fila (ex.: a agenda de estimativas)
+# ficam pendurados na própria visão, então todo mundo que lê a mesma geração
+# divide o mesmo cálculo.
+#
+# Tudo isso existe uma vez por unidade (unidades.py): contador, geração, snapshot
+# e visão em memória de uma unidade nunca olham os pacientes de outra.
+FILA_TRIAGEM = 'fila_triagem'
+FILA_ATENDIMENTO = 'fila_atendimento'
+META = 'filas_meta'
+SNAPSHOT = 'filas_snapshot'
+FILAS_SNAPSHOT = os.getenv('FILAS_SNAPSHOT', '1') != '0'
+
+PROMOCAO_TENTATIVAS = int(os.getenv('PROMOCAO_TENTATIVAS', 5))
+
+#----------------------------------------------------------------------------------------------------------------------------------
+def proxima_chave(db, fila, session=None, unidade=UNIDADE_PADRAO):
+    meta = unidades.chave(fila, unidade)
+    doc = db[META].find_one_and_update(
+        {'_id': meta, 'seq': {'$exists': True}},
+        {'$inc': {'seq': 1}},
+        projection={'seq': 1},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    if doc is not None:
+        return doc['seq']
+
+    # Primeiro uso: o contador começa depois da maior posição já gravada (dados antigos)
+    ultimo = db[fila].find_one(unidades.filtro(unidade), {'posicao_fila': 1},
+                               sort=[('posicao_fila', -1)], session=session)
+    base = ultimo.get('posicao_fila', 0) if ultimo else 0
+    db[META].update_one({'_id': meta}, {'$max': {'seq': base}}, upsert=True, session=session)
+    return proxima_chave(db, fila, session, unidade)
+
+
+def marcar_alteracao(db, fila, unidade=UNIDADE_PADRAO):
+    # Sempre chamado DEPOIS da escrita na fila, para ninguém guardar uma visão velha
+    # com a geração nova. Devolve (geração anterior, geração nova).
+    # O snapshot não é refeito aqui: quem ler a geração nova primeiro grava (ver ordem)
+    nova = uuid.uuid4().hex
+    antes = db[META].find_one_and_update(
+        {'_id': unidades.chave(fila, unidade)},
+        {'$inc': {'versao': 1}, '$set': {'geracao': nova}},
+        projection={'geracao': 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    barramento.publicar(fila, unidade)
+    return (antes or {}).get('geracao'), nova
+
+
+def _meta(db, fila, unidade):
+    return db[META].find_one({'_id': unidades.chave(fila, unidade)}, {'geracao': 1, 'versao': 1}) or {}
+
+
+def geracao(db, fila, unidade=UNIDADE_PADRAO):
+    return _meta(db, fila, unidade).get('geracao')
+
+#----------------------------------------------------------------------------------------------------------------------------------
+def entrar(db, fila, documento, unidade=UNIDADE_PADRAO):
+    documento['unidade'] = unidade
+    documento['posicao_fila'] = proxima_chave(db, fila, unidade=unidade)
+    db[fila].insert_one(documento)
+    antiga, nova = marcar_alteracao(db, fila, unidade)
+
+    # Se a visão em memória era exatamente a da geração anterior, basta acrescentar
+    # o novo paciente no fim em vez de reler a fila inteira. Só vale se a chave for
+    # maior que a última: uma entrada que pegou a chave antes de outra e gravou
+    # depois cairia fora de ordem, e aí a visão é descartada e relida do banco.
+    em_cache = _ordens.get((fila, unidade))
+    if em_cache is not None and antiga is not None and em_cache[0] == antiga:
+        visao = em_cache[1]
+        if not visao.chaves or documento['posicao_fila'] > visao.chaves[-1]:
+            visao.adicionar({k: v for k, v in documento.items() if k != '_id'})
+            _ordens[(fila, unidade)] = (nova, visao)
+        else:
+            _ordens.pop((fila, unidade), None)
+    return documento['posicao_fila']
+
+
+def sair(db, fila, cpf, unidade=UNIDADE_PADRAO):
+    # Uma remoção é sempre um delete + a troca de geração, não importa o tamanho da fila
+    documento = db[fila].find_one_and_delete({'paciente_cpf': cpf, **unidades.filtro(unidade)})
+    if documento is not None:
+        marcar_alteracao(db, fila, unidade)
+    return documento
+
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Promoção da triagem para o atendimento.
+#
+# Com replica set, tudo acontece numa transação: a chave nova vem do contador, o
+# paciente entra no atendimento e sai da triagem, ou nada disso acontece. Erros
+# transitórios (conflito de escrita entre promoções simultâneas, troca de primário)
+# são tentados de novo até PROMOCAO_TENTATIVAS vezes.
+#
+# Sem suporte a transações (Mongo standalone), a triagem é "reservada" com um
+# find_one_and_update atômico antes de mexer no atendimento, então dois pedidos
+# para o mesmo paciente nunca promovem duas vezes. Se o processo cair no meio, o
+# documento fica marcado com promovendo e reparar_promocoes termina o serviço.
+CAMPOS_PROMOVIDOS = ('paciente_cpf', 'nome', 'triagemIA', 'sintomas', 'origem_triagem', 'unidade')
+
+_transacoes = {}
+
+
+def _documento_promovido(paciente, gravidade, unidade):
+    novo = {k: paciente.get(k) for k in CAMPOS_PROMOVIDOS if k in paciente}
+    novo['triagem_oficial'] = gravidade
+    novo['unidade'] = unidade
+    return novo
+
+
+def _suporta_transacoes(db):
+    suporta = _transacoes.get(id(db.client))
+    if suporta is None:
+        try:
+            with db.client.start_session() as s:
+                with s.start_transaction():
+                    db[META].find_one({'_id': FILA_TRIAGEM}, session=s)
+            suporta = True
+        except (NotImplementedError, ConfigurationError, OperationFailure, AttributeError):
+            suporta = False
+        _transacoes[id(db.client)] = suporta
+    return suporta
+
+
+def _promover_em_transacao(db, cpf, gravidade, unidade):
+    for tentativa in range(PROMOCAO_TENTATIVAS):
+        try:
+            with db.client.start_session() as s:
+                with s.start_transaction():
+                    paciente = db[FILA_TRIAGEM].find_one_and_delete(
+                        {'paciente_cpf': cpf, **unidades.filtro(unidade)}, session=s
+                    )
+                    if paciente is None:
+                        return None
+                    novo = _documento_promovido(paciente, gravidade, unidade)
+                    novo['posicao_fila'] = proxima_chave(db, FILA_ATENDIMENTO, s, unidade)
+                    db[FILA_ATENDIMENTO].insert_one(novo, session=s)
+            return novo
+        except PyMongoError as e:
+            transitorio = (e.has_error_label('TransientTransactionError')
+                           or e.has_error_label('UnknownTransactionCommitResult'))
+            if not transitorio or tentativa == PROMOCAO_TENTATIVAS - 1:
+                raise
+            time.sleep(random.uniform(0, 0.01 * 2 ** tentativa))
+
+
+def _promover_sem_transacao(db, cpf, gravidade, unidade):
+    paciente = db[FILA_TRIAGEM].find_one_and_update(
+        {'paciente_cpf': cpf, 'promovendo': None, **unidades.filtro(unidade)},
+        {'$set': {'promovendo': datetime.now(timezone.utc)}}
+    )
+    if paciente is None:
+        return None
+
+    novo = _documento_promovido(paciente, gravidade, unidade)
+    try:
+        novo['posicao_fila'] = proxima_chave(db, FILA_ATENDIMENTO, unidade=unidade)
+        db[FILA_ATENDIMENTO].insert_one(novo)
+    except PyMongoError:
+        db[FILA_TRIAGEM].update_one({'_id': paciente['_id']}, {'$unset': {'promovendo': ''}})
+        raise
+    db[FILA_TRIAGEM].delete_one({'_id': paciente['_id']})
+    return novo
+
+
+def promover(db, cpf, gravidade, unidade=UNIDADE_PADRAO):
+    if _suporta_transacoes(db):
+        novo = _promover_em_transacao(db, cpf, gravidade, unidade)
+    else:
+        novo = _promover_sem_transacao(db, cpf, gravidade, unidade)
+    if novo is not None:
+        novo.pop('_id', None)
+        marcar_alteracao(db, FILA_ATENDIMENTO, unidade)
+        marcar_alteracao(db, FILA_TRIAGEM, unidade)
+    return novo
+
+
+def reparar_promocoes(db):
+    # Termina promoções interrompidas no modo sem transação, de todas as unidades
+    reparados = 0
+    alteradas = set()
+    for paciente in db[FILA_TRIAGEM].find({'promovendo': {'$ne': None}}):
+        if db[FILA_ATENDIMENTO].find_one({'paciente_cpf': paciente['paciente_cpf']}, {'_id': 1}):
+            db[FILA_TRIAGEM].delete_one({'_id': paciente['_id']})
+        else:
+            db[FILA_TRIAGEM].update_one({'_id': paciente['_id']}, {'$unset': {'promovendo': ''}})
+        alteradas.add(paciente.get('unidade') or UNIDADE_PADRAO)
+        reparados += 1
+    for unidade in alteradas:
+        marcar_alteracao(db, FILA_TRIAGEM, unidade)
+    return reparados
+
+
+# Alta de vários pacientes de uma vez: uma leitura para devolver quem saiu, um
+# delete_many e uma troca de geração, não importa quantos nem o tamanho da fila
+def sair_varios(db, fila, cpfs, unidade=UNIDADE_PADRAO):
+    filtro = unidades.filtro(unidade)
+    removidos = list(db[fila].find({'paciente_cpf': {'$in': list(cpfs)}, **filtro}, {'_id': 0}))
+    if removidos:
+        db[fila].delete_many({'paciente_cpf': {'$in': [p['paciente_cpf'] for p in removidos]}, **filtro})
+        marcar_alteracao(db, fila, unidade)
+    return removidos
+
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Snapshot da fila: um documento por fila em filas_snapshot com os cpfs em ordem,
+# as chaves, as gravidades e, no atendimento, a agenda já calculada (início
+# estimado de cada posição) para o número de atendentes do momento.
+#
+# As alterações não mexem nele (a escrita continua custando o mesmo com qualquer
+# tamanho de fila). O primeiro leitor de uma geração nova não encontra snapshot
+# dela, lê a fila inteira como antes e grava o snapshot para os outros workers.
+# Só grava se a versão for maior que a gravada, então um leitor atrasado nunca
+# passa por cima de um snapshot mais novo.
+def gravar_snapshot(db, fila, visao, geracao_lida, versao, unidade=UNIDADE_PADRAO):
+    documentos = visao.documentos
+    snapshot = {
+        'geracao': geracao_lida,
+        'versao': versao,
+        'cpfs': [d.get('paciente_cpf') for d in documentos],
+        'chaves': [d.get('posicao_fila', 0) for d in documentos],
+        'nomes': [d.get('nome') for d in documentos],
+        'triagem_ia': [d.get('triagemIA') for d in documentos],
+        'triagem_oficial': [d.get('triagem_oficial') for d in documentos],
+        'status_ia': [d.get('status_ia') for d in documentos],
+        'agenda': None,
+    }
+    if fila == FILA_ATENDIMENTO:
+        atendentes = disponibilidade.contar(db, 'atendimento', unidade)
+        if atendentes:
+            # A mesma agenda fica na visão e serve a quem está lendo agora
+            agenda = agenda_atendimento(visao, atendentes)
+            snapshot['agenda'] = {
+                'funcionarios': atendentes,
+                'inicios': agenda.inicios,
+                'validos_antes': agenda.validos_antes,
+                'validos': agenda._validos,
+                'baldes': agenda.baldes(),
+            }
+    try:
+        db[SNAPSHOT].update_one({'_id': unidades.chave(fila, unidade), 'versao': {'$lt': versao}},
+                                {'$set': snapshot}, upsert=True)
+    except DuplicateKeyError:
+        # Já existe um snapshot de versão maior
+        pass
+
+
+def _documentos_do_snapshot(snapshot):
+    campos = (('paciente_cpf', 'cpfs'), ('posicao_fila', 'chaves'), ('nome', 'nomes'),
+              ('triagemIA', 'triagem_ia'), ('triagem_oficial', 'triagem_oficial'), ('status_ia', 'status_ia'))
+    colunas = [(campo, snapshot.get(coluna) or [None] * len(snapshot['cpfs'])) for campo, coluna in campos]
+    documentos = []
+    for i in range(len(snapshot['cpfs'])):
+        documento = {campo: valores[i] for campo, valores in colunas if valores[i] is not None}
+        documentos.append(documento)
+    return documentos
+
+
+def _visao_do_snapshot(snapshot):
+    visao = OrdemFila(_documentos_do_snapshot(snapshot))
+    agenda = snapshot.get('agenda')
+    if agenda:
+        visao.derivados[('triagem_oficial', agenda['funcionarios'])] = Agenda.restaurar(
+            'triagem_oficial', agenda['inicios'], agenda['validos_antes'], agenda['validos'], agenda['baldes']
+        )
+    return visao
+
+#----------------------------------------------------------------------------------------------------------------------------------
+class OrdemFila:
+    def __init__(self, documentos):
+        self.documentos = documentos
+        self.chaves = [d.get('posicao_fila', 0) for d in documentos]
+        self._indice = {d.get('paciente_cpf'): i for i, d in enumerate(documentos)}
+        self.derivados = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documentos)
+
+    def adicionar(self, documento):
+        with self.lock:
+            self._indice[documento.get('paciente_cpf')] = len(self.documentos)
+            self.documentos.append(documento)
+            self.chaves.append(documento.get('posicao_fila', 0))
+            for derivado in self.derivados.values():
+                derivado.adicionar_documento(documento)
+
+    def derivado(self, chave, construir):
+        with self.lock:
+            valor = self.derivados.get(chave)
+            if valor is None:
+                valor = construir(self.documentos)
+                self.derivados[chave] = valor
+            return valor
+
+    def indice_da_chave(self, chave):
+        return bisect_left(self.chaves, chave)
+
+    def posicao_da_chave(self, chave):
+        return bisect_left(self.chaves, chave) + 1
+
+    def documento_do_cpf(self, cpf):
+        i = self._indice.get(cpf)
+        return None if i is None else self.documentos[i]
+
+
+_ordens = {}
+
+
+def limpar_visoes():
+    _ordens.clear()
+    _transacoes.clear()
+
+
+def ordem(db, fila, unidade=UNIDADE_PADRAO):
+    # Lê a geração antes da fila: se alguém alterar a fila no meio, a visão guardada
+    # fica com a geração antiga e é descartada na próxima leitura
+    meta = _meta(db, fila, unidade)
+    g = meta.get('geracao')
+    if g is not None:
+        em_cache = _ordens.get((fila, unidade))
+        if em_cache is not None and em_cache[0] == g:
+            return em_cache[1]
+
+    # Geração nova: o snapshot resolve com uma leitura de um documento só
+    visao = None
+    if g is not None and FILAS_SNAPSHOT:
+        snapshot = db[SNAPSHOT].find_one({'_id': unidades.chave(fila, unidade)})
+        if snapshot is not None and snapshot.get('geracao') == g:
+            visao = _visao_do_snapshot(snapshot)
+    if visao is None:
+        visao = OrdemFila(list(db[fila].find(unidades.filtro(unidade), {'_id': 0}).sort('posicao_fila', 1)))
+        if g is not None and FILAS_SNAPSHOT:
+            gravar_snapshot(db, fila, visao, g, meta.get('versao', 0), unidade)
+    if g is not None:
+        _ordens[(fila, unidade)] = (g, visao)
+    return visao
@@ -0,0 +1,59 @@
+import multiprocessing
+import os
+import signal
+from dotenv import load_dotenv
+
+# Rodar com: gunicorn -c gunicorn.conf.py wsgi:app
+load_dotenv()
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Workers pré-forkados com threads (gthread). Cada thread segura um pedido, e os
+# streams SSE ficam presos numa thread enquanto o paciente acompanha a fila.
+# Dimensionamento: GUNICORN_THREADS = SSE_MAX_STREAMS + threads para as outras rotas.
+# O app recusa (503 + Retry-After) o stream que passar de SSE_MAX_STREAMS, então com
+# o padrão de 8 threads e 4 streams sempre sobram 4 threads para login, triagem e
+# alta. Mais pacientes acompanhando pede mais workers (ou mais threads junto com
+# SSE_MAX_STREAMS), nunca SSE_MAX_STREAMS >= GUNICORN_THREADS.
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+worker_class = 'gthread'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+# Para separar unidades em grupos de workers, suba um gunicorn por grupo com
+# UNIDADES_ATENDIDAS=... e roteie /unidades/<unidade>/ no balanceador (unidades.py)
+# Importa o app uma vez no mestre; os workers nascem com tudo já carregado
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') != '0'
+accesslog = None  # o metricas.py já loga cada pedido em JSON
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Ciclo de vida dos workers (ciclo.py)
+def when_ready(server):
+    # Uma vez, no mestre, antes de criar os workers
+    import ciclo
+    ciclo.preparar_banco()
+
+
+def post_fork(server, worker):
+    import ciclo
+    ciclo.depois_do_fork()
+
+
+def post_worker_init(worker):
+    # O gunicorn instala o próprio SIGTERM (para de aceitar e espera o graceful_timeout);
+    # antes dele o worker sai do /saude/pronta e fecha os streams
+    import ciclo
+    anterior = signal.getsignal(signal.SIGTERM)
+
+    def drenar(signum, frame):
+        ciclo.iniciar_drenagem()
+        if callable(anterior):
+            anterior(signum, frame)
+
+    signal.signal(signal.SIGTERM, drenar)
+
+
+def worker_exit(server, worker):
+    import ciclo
+    ciclo.encerrar_worker()
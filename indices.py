@@ -0,0 +1,143 @@
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+from registro import log
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Índices que as rotas precisam. Os únicos de cpf/email usam filtro parcial porque
+# o cadastro não obriga o cpf e documentos antigos podem não ter o campo. Os de
+# filas, funcionários e eventos começam pela unidade (unidades.py), para que as
+# consultas de uma unidade só percorram a parte do índice dela.
+def _so_texto(campo):
+    return {campo: {'$type': 'string'}}
+
+
+INDICES = {
+    'pacientes': [
+        ([('email', ASCENDING)], {'name': 'email_unico', 'unique': True,
+                                  'partialFilterExpression': _so_texto('email')}),
+        ([('cpf', ASCENDING)], {'name': 'cpf_unico', 'unique': True,
+                                'partialFilterExpression': _so_texto('cpf')}),
+    ],
+    'funcionarios': [
+        ([('email', ASCENDING)], {'name': 'email_unico', 'unique': True,
+                                  'partialFilterExpression': _so_texto('email')}),
+        ([('unidade', ASCENDING), ('cargo', ASCENDING), ('disponível', ASCENDING)],
+         {'name': 'unidade_cargo_disponivel'}),
+    ],
+    # Um email só entre pacientes e funcionários; é por aqui que o login procura
+    'credenciais': [
+        ([('email', ASCENDING)], {'name': 'email_unico', 'unique': True}),
+    ],
+    # paciente_cpf único também impede que dois POST simultâneos coloquem a mesma
+    # pessoa duas vezes na fila
+    'fila_triagem': [
+        ([('paciente_cpf', ASCENDING)], {'name': 'paciente_cpf_unico', 'unique': True}),
+        ([('unidade', ASCENDING), ('posicao_fila', ASCENDING)], {'name': 'unidade_posicao_fila'}),
+    ],
+    'fila_atendimento': [
+        ([('paciente_cpf', ASCENDING)], {'name': 'paciente_cpf_unico', 'unique': True}),
+        ([('unidade', ASCENDING), ('posicao_fila', ASCENDING)], {'name': 'unidade_posicao_fila'}),
+    ],
+    # Histórico lido por unidade e intervalo de tempo no simulacao.py
+    'eventos_fila': [
+        ([('unidade', ASCENDING), ('quando', ASCENDING)], {'name': 'unidade_quando'}),
+    ],
+}
+
+# Consulta principal de cada rota: (rota, coleção, filtro, ordenação)
+CONSULTAS_DAS_ROTAS = [
+    ('POST /login', 'credenciais', {'email': 'x@x.com'}, None),
+    ('POST /login', 'pacientes', {'email': 'x@x.com'}, None),
+    ('POST /login', 'funcionarios', {'email': 'x@x.com'}, None),
+    ('POST /cadastro', 'credenciais', {'email': 'x@x.com'}, None),
+    ('POST /triagem/<cpf>', 'pacientes', {'cpf': '00000000000'}, None),
+    ('POST /triagem/<cpf>', 'fila_triagem', {'paciente_cpf': '00000000000'}, None),
+    ('POST /triagem/<cpf>', 'fila_atendimento', {'paciente_cpf': '00000000000'}, None),
+    ('POST /triagem/<cpf>', 'funcionarios', {'unidade': 'x', 'disponível': True, 'cargo': 'triagem'}, None),
+    ('POST /triagem/<cpf>', 'fila_triagem', {'unidade': 'x'}, [('posicao_fila', ASCENDING)]),
+    ('PUT /triagem/<cpf>', 'pacientes', {'cpf': '00000000000'}, None),
+    ('GET /triagem/<cpf>', 'fila_atendimento', {'paciente_cpf': '00000000000'}, None),
+    ('GET /triagem/<cpf>', 'fila_atendimento', {'unidade': 'x'}, [('posicao_fila', ASCENDING)]),
+    ('DELETE /atendimento/<cpf>', 'fila_atendimento', {'paciente_cpf': '00000000000'}, None),
+    ('PUT /triagem_e_fila/<cpf>', 'fila_triagem', {'paciente_cpf': '00000000000'}, None),
+    ('GET /pacientes', 'fila_triagem', {'unidade': 'x'}, [('posicao_fila', ASCENDING)]),
+]
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Um índice recusado pelo servidor (ex.: duplicados antigos impedindo um índice
+# único) vai para o log e não impede os outros; o problema aparece no verificar-indices
+def criar_indices(db):
+    criados = []
+    for colecao, indices in INDICES.items():
+        for chaves, opcoes in indices:
+            try:
+                criados.append((colecao, db[colecao].create_index(chaves, **opcoes)))
+            except OperationFailure as e:
+                log.error("erro ao criar índice", extra={'campos': {
+                    'colecao': colecao, 'indice': opcoes['name'], 'erro': str(e)
+                }})
+    return criados
+
+
+# Criação na subida do servidor (ciclo.preparar_banco), não no primeiro pedido.
+# Sem conexão com o banco desiste de tudo e o app sobe mesmo assim.
+def garantir_indices(db):
+    try:
+        return criar_indices(db)
+    except PyMongoError as e:
+        log.error("erro ao criar índices", extra={'campos': {'erro': str(e)}})
+        return []
+
+
+def indices_faltando(db):
+    faltando = []
+    for colecao, indices in INDICES.items():
+        existentes = [info['key'] for info in db[colecao].index_information().values()]
+        existentes = [[tuple(k) for k in chave] for chave in existentes]
+        for chaves, opcoes in indices:
+            if [tuple(k) for k in chaves] not in existentes:
+                faltando.append((colecao, opcoes['name'], chaves))
+    return faltando
+
+
+def _estagios(plano):
+    # Junta os estágios do plano vencedor (IXSCAN, COLLSCAN, FETCH, SORT...)
+    estagios = []
+    while plano:
+        estagios.append(plano.get('stage'))
+        plano = plano.get('inputStage')
+    return estagios
+
+
+def planos_das_rotas(db):
+    planos = []
+    for rota, colecao, filtro, ordem in CONSULTAS_DAS_ROTAS:
+        cursor = db[colecao].find(filtro)
+        if ordem:
+            cursor = cursor.sort(ordem)
+        try:
+            explicacao = cursor.explain()
+            vencedor = explicacao.get('queryPlanner', {}).get('winningPlan', {})
+            estagios = _estagios(vencedor.get('queryPlan', vencedor))
+        except (AttributeError, NotImplementedError, PyMongoError) as e:
+            estagios = [f"explain indisponível: {e}"]
+        planos.append((rota, colecao, filtro, estagios))
+    return planos
+
+
+def relatorio(db):
+    linhas = []
+    faltando = indices_faltando(db)
+    if faltando:
+        linhas.append("Índices faltando:")
+        for colecao, nome, chaves in faltando:
+            linhas.append(f"  {colecao}.{nome} {chaves}")
+    else:
+        linhas.append("Todos os índices necessários existem.")
+
+    linhas.append("")
+    linhas.append("Planos das consultas das rotas:")
+    for rota, colecao, filtro, estagios in planos_das_rotas(db):
+        alerta = "  <-- varredura completa" if 'COLLSCAN' in estagios else ""
+        linhas.append(f"  {rota:<28} {colecao}.find({filtro}) -> {' > '.join(map(str, estagios))}{alerta}")
+    return "\n".join(linhas)
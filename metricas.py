@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+from flask import request, g
+from pymongo import monitoring
+from registro import log
+
+# Com 0 o middleware não mede nada (usado no bench_metricas.py para medir o custo)
+METRICAS_ATIVAS = os.getenv('METRICAS_ATIVAS', '1') != '0'
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Histograma simples: contagens por faixa (não acumuladas), soma e total.
+# resumo() é o formato do /saude; linhas_prometheus() o do /metrics.
+class Histograma:
+    LIMITES = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, limites=LIMITES):
+        self.limites = limites
+        self._lock = threading.Lock()
+        self.zerar()
+
+    def zerar(self):
+        with self._lock:
+            self.contagens = [0] * (len(self.limites) + 1)
+            self.soma = 0.0
+            self.total = 0
+
+    def observar(self, valor):
+        with self._lock:
+            i = 0
+            while i < len(self.limites) and valor > self.limites[i]:
+                i += 1
+            self.contagens[i] += 1
+            self.soma += valor
+            self.total += 1
+
+    def resumo(self):
+        with self._lock:
+            faixas = {f"<= {l}s": c for l, c in zip(self.limites, self.contagens)}
+            faixas[f"> {self.limites[-1]}s"] = self.contagens[-1]
+            return {'total': self.total, 'soma': round(self.soma, 4), 'faixas': faixas}
+
+    def linhas_prometheus(self, nome, rotulos=None):
+        with self._lock:
+            contagens, soma, total = list(self.contagens), self.soma, self.total
+        linhas = []
+        acumulado = 0
+        for limite, c in zip(self.limites, contagens):
+            acumulado += c
+            linhas.append(f"{nome}_bucket{_rotulos(rotulos, le=limite)} {acumulado}")
+        linhas.append(f"{nome}_bucket{_rotulos(rotulos, le='+Inf')} {total}")
+        linhas.append(f"{nome}_sum{_rotulos(rotulos)} {soma}")
+        linhas.append(f"{nome}_count{_rotulos(rotulos)} {total}")
+        return linhas
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(rotulos=None, **mais):
+    todos = dict(rotulos or {}, **mais)
+    if not todos:
+        return ''
+    return '{' + ','.join(f'{k}="{_escapar(v)}"' for k, v in todos.items()) + '}'
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Comandos enviados ao Mongo. O pymongo avisa o listener na própria thread que
+# executou o comando, então um contador por thread dá os números de cada pedido.
+class MonitorComandos(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.zerar()
+
+    def zerar(self):
+        with self._lock:
+            self.totais = {}
+
+    def iniciar_pedido(self):
+        self._local.comandos = 0
+        self._local.segundos = 0.0
+        self._local.ativo = True
+
+    def terminar_pedido(self):
+        self._local.ativo = False
+        return getattr(self._local, 'comandos', 0), getattr(self._local, 'segundos', 0.0)
+
+    def _registrar(self, evento, falhou):
+        segundos = evento.duration_micros / 1e6
+        if getattr(self._local, 'ativo', False):
+            self._local.comandos += 1
+            self._local.segundos += segundos
+        with self._lock:
+            total = self.totais.setdefault(evento.command_name, [0, 0.0, 0])
+            total[0] += 1
+            total[1] += segundos
+            total[2] += falhou
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._registrar(event, 0)
+
+    def failed(self, event):
+        self._registrar(event, 1)
+
+    def resumo(self):
+        with self._lock:
+            return {nome: {'comandos': n, 'segundos': round(s, 6), 'falhas': f}
+                    for nome, (n, s, f) in self.totais.items()}
+
+
+monitor_comandos = MonitorComandos()
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Por rota (a regra do Flask, não a URL, para não criar uma série por cpf)
+LIMITES_COMANDOS = (1, 2, 3, 5, 8, 13, 21, 50)
+
+_lock = threading.Lock()
+latencias_rotas = {}
+comandos_por_rota = {}
+tempo_mongo_por_rota = {}
+
+
+def _histograma(tabela, chave, limites=Histograma.LIMITES):
+    h = tabela.get(chave)
+    if h is None:
+        with _lock:
+            h = tabela.setdefault(chave, Histograma(limites))
+    return h
+
+
+def zerar():
+    with _lock:
+        latencias_rotas.clear()
+        comandos_por_rota.clear()
+        tempo_mongo_por_rota.clear()
+    monitor_comandos.zerar()
+
+
+def _antes_do_pedido():
+    if not METRICAS_ATIVAS:
+        return
+    g.inicio_pedido = time.perf_counter()
+    monitor_comandos.iniciar_pedido()
+
+
+def _depois_do_pedido(resposta):
+    inicio = g.get('inicio_pedido')
+    if inicio is None:
+        return resposta
+    duracao = time.perf_counter() - inicio
+    comandos, segundos_mongo = monitor_comandos.terminar_pedido()
+    rota = request.url_rule.rule if request.url_rule else 'desconhecida'
+    chave = (request.method, rota)
+
+    _histograma(latencias_rotas, chave + (resposta.status_code,)).observar(duracao)
+    _histograma(comandos_por_rota, chave, LIMITES_COMANDOS).observar(comandos)
+    _histograma(tempo_mongo_por_rota, chave).observar(segundos_mongo)
+    log.info("pedido", extra={'campos': {
+        'metodo': request.method,
+        'rota': rota,
+        'status': resposta.status_code,
+        'duracao_ms': round(duracao * 1000, 3),
+        'mongo_comandos': comandos,
+        'mongo_ms': round(segundos_mongo * 1000, 3),
+    }})
+    return resposta
+
+
+def instrumentar(app):
+    # Precisa ser o primeiro before_request: um 401 do token também é medido
+    app.before_request_funcs.setdefault(None, []).insert(0, _antes_do_pedido)
+    app.after_request(_depois_do_pedido)
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Texto no formato do Prometheus. medidores: {nome: (ajuda, [(rotulos, valor)])},
+# valores do momento calculados por quem chama (tamanho das filas, pool...).
+def texto_prometheus(medidores=None, latencias_ia=None):
+    linhas = []
+
+    def histogramas(nome, ajuda, tabela, nomes_rotulos):
+        linhas.append(f"# HELP {nome} {ajuda}")
+        linhas.append(f"# TYPE {nome} histogram")
+        with _lock:
+            itens = sorted(tabela.items(), key=lambda item: tuple(map(str, item[0])))
+        for chave, h in itens:
+            linhas.extend(h.linhas_prometheus(nome, dict(zip(nomes_rotulos, chave))))
+
+    histogramas('http_pedido_segundos', 'Duração dos pedidos por rota',
+                latencias_rotas, ('metodo', 'rota', 'status'))
+    histogramas('http_pedido_mongo_comandos', 'Comandos enviados ao Mongo por pedido',
+                comandos_por_rota, ('metodo', 'rota'))
+    histogramas('http_pedido_mongo_segundos', 'Tempo no Mongo por pedido',
+                tempo_mongo_por_rota, ('metodo', 'rota'))
+    if latencias_ia:
+        histogramas('triagem_ia_segundos', 'Latência das chamadas à IA por resultado',
+                    {(r,): h for r, h in latencias_ia.items()}, ('resultado',))
+
+    linhas.append("# HELP mongo_comandos_total Comandos enviados ao Mongo por nome")
+    linhas.append("# TYPE mongo_comandos_total counter")
+    for nome, dados in sorted(monitor_comandos.resumo().items()):
+        linhas.append(f"mongo_comandos_total{_rotulos(comando=nome)} {dados['comandos']}")
+    linhas.append("# HELP mongo_comandos_segundos_total Tempo gasto no Mongo por nome de comando")
+    linhas.append("# TYPE mongo_comandos_segundos_total counter")
+    for nome, dados in sorted(monitor_comandos.resumo().items()):
+        linhas.append(f"mongo_comandos_segundos_total{_rotulos(comando=nome)} {dados['segundos']}")
+
+    for nome, (ajuda, valores) in (medidores or {}).items():
+        linhas.append(f"# HELP {nome} {ajuda}")
+        linhas.append(f"# TYPE {nome} gauge")
+        for rotulos, valor in valores:
+            linhas.append(f"{nome}{_rotulos(rotulos)} {valor}")
+    return "\n".join(linhas) + "\n"
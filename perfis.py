@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+PERFIS_TTL = float(os.getenv('PERFIS_TTL', 300))
+PERFIS_MAX = int(os.getenv('PERFIS_MAX', 10000))
+CAMPOS_PERFIL = ('cpf', 'nome_completo')
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Os poucos campos do paciente que a entrada na fila usa, por cpf. O cadastro e o
+# PUT /triagem/<cpf> invalidam a entrada; em outro worker ela vence pelo TTL.
+# Paciente que não existe não fica guardado, ele pode se cadastrar a qualquer hora.
+class Perfis:
+    def __init__(self, max_itens=PERFIS_MAX, ttl=PERFIS_TTL):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, db, cpf):
+        agora = time.monotonic()
+        with self._lock:
+            item = self._itens.get(cpf)
+            if item is not None and item[1] > agora:
+                self._itens.move_to_end(cpf)
+                self.acertos += 1
+                return item[0]
+            self.falhas += 1
+
+        projecao = dict.fromkeys(CAMPOS_PERFIL, 1)
+        projecao['_id'] = 0
+        perfil = db['pacientes'].find_one({'cpf': cpf}, projecao)
+        if perfil is None:
+            return None
+        with self._lock:
+            self._itens[cpf] = (perfil, agora + self.ttl)
+            self._itens.move_to_end(cpf)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+        return perfil
+
+    def invalidar(self, cpf):
+        with self._lock:
+            self._itens.pop(cpf, None)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self.acertos = 0
+            self.falhas = 0
+
+    def resumo(self):
+        with self._lock:
+            return {'itens': len(self._itens), 'acertos': self.acertos, 'falhas': self.falhas}
+
+
+perfis = Perfis()
@@ -0,0 +1,62 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# Chave do pseudônimo dos pacientes nos logs. Sem ela cada processo sorteia a sua
+# e o mesmo paciente só se reconhece dentro do mesmo worker.
+LOG_SAL = (os.getenv('LOG_SAL') or os.urandom(16).hex()).encode()
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Uma linha JSON por evento, no lugar dos prints. Campos extras vão em
+# extra={'campos': {...}} e entram no mesmo objeto.
+class FormatoJSON(logging.Formatter):
+    def format(self, record):
+        linha = {
+            'hora': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'nivel': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        linha.update(getattr(record, 'campos', None) or {})
+        if record.exc_info:
+            linha['erro'] = self.formatException(record.exc_info)
+        return json.dumps(linha, ensure_ascii=False, default=str)
+
+
+# Sempre o sys.stderr da hora, mesmo que alguém o troque depois (gunicorn, pytest)
+class SaidaErro(logging.StreamHandler):
+    @property
+    def stream(self):
+        return sys.stderr
+
+    @stream.setter
+    def stream(self, valor):
+        pass
+
+
+def configurar(nivel=LOG_LEVEL):
+    logger = logging.getLogger('healthcenter')
+    if not logger.handlers:
+        saida = SaidaErro()
+        saida.setFormatter(FormatoJSON())
+        logger.addHandler(saida)
+        logger.propagate = False
+    logger.setLevel(nivel)
+    return logger
+
+
+log = configurar()
+
+
+# CPF nunca vai para o log: vai um HMAC curto, que dá para cruzar entre linhas do
+# mesmo paciente sem expor quem é (um hash puro de 11 dígitos se desfaz por força bruta)
+def pseudonimo(valor):
+    if valor is None:
+        return None
+    return hmac.new(LOG_SAL, str(valor).encode(), hashlib.sha256).hexdigest()[:16]
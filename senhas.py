@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as TempoEsgotado
+import bcrypt
+from registro import log
+
+BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+SENHAS_WORKERS = int(os.getenv('SENHAS_WORKERS', 2))
+# Quantos hashes podem esperar na fila do pool antes de recusarmos o pedido
+SENHAS_MAX_PENDENTES = int(os.getenv('SENHAS_MAX_PENDENTES', 32))
+SENHAS_TIMEOUT = float(os.getenv('SENHAS_TIMEOUT', 10))
+
+LOGIN_MAX_FALHAS = int(os.getenv('LOGIN_MAX_FALHAS', 5))
+# O IP é compartilhado (NAT do hospital, proxy): o limite dele é bem mais alto
+LOGIN_MAX_FALHAS_IP = int(os.getenv('LOGIN_MAX_FALHAS_IP', 100))
+LOGIN_JANELA = float(os.getenv('LOGIN_JANELA', 300))
+
+
+class PoolSenhasOcupado(Exception):
+    pass
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# O bcrypt é caro de propósito. Em vez de rodar na thread do pedido, ele roda num
+# pool pequeno: uma rajada de logins na troca de turno ocupa no máximo
+# SENHAS_WORKERS núcleos e o resto das rotas continua respondendo. Com o pool e a
+# fila cheios o login recebe 503 na hora, em vez de empilhar.
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+_vagas = threading.BoundedSemaphore(SENHAS_MAX_PENDENTES)
+
+
+def executor():
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is not None and _executor_pid == pid:
+        return _executor
+    with _lock:
+        if _executor is None or _executor_pid != pid:
+            _executor = ThreadPoolExecutor(max_workers=SENHAS_WORKERS, thread_name_prefix='senhas')
+            _executor_pid = pid
+    return _executor
+
+
+def encerrar(esperar=True):
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=esperar)
+        _executor = None
+        _executor_pid = None
+
+
+def descartar():
+    # Depois do fork: as threads do pool do mestre não existem neste processo
+    global _executor, _executor_pid
+    with _lock:
+        _executor = None
+        _executor_pid = None
+
+
+# A vaga só volta quando o hash termina de verdade, não quando o pedido desiste de
+# esperar: um bcrypt lento continua ocupando o pool e conta no limite. Quem passa
+# de SENHAS_TIMEOUT recebe o mesmo 503 do pool cheio.
+def _no_pool(funcao, *args):
+    vagas = _vagas
+    if not vagas.acquire(blocking=False):
+        raise PoolSenhasOcupado()
+    try:
+        futuro = executor().submit(funcao, *args)
+    except Exception:
+        vagas.release()
+        raise
+    futuro.add_done_callback(lambda _: vagas.release())
+    try:
+        return futuro.result(timeout=SENHAS_TIMEOUT)
+    except TempoEsgotado:
+        raise PoolSenhasOcupado()
+
+
+def _gerar(senha, rounds):
+    return bcrypt.hashpw(senha.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _conferir(senha_hash, senha):
+    try:
+        return bcrypt.checkpw(senha.encode('utf-8'), senha_hash.encode('utf-8'))
+    except ValueError:
+        return False
+
+
+def gerar_hash(senha):
+    return _no_pool(_gerar, senha, BCRYPT_LOG_ROUNDS)
+
+
+def conferir(senha_hash, senha):
+    if not senha_hash:
+        return False
+    return _no_pool(_conferir, senha_hash, senha)
+
+
+# Rehash no login quando o custo mudou: vai para o pool sem o pedido esperar, e
+# com o pool cheio (ou um erro ao gravar) fica para o próximo login. A senha já
+# foi conferida, então nada aqui pode derrubar o login.
+def regerar_em_segundo_plano(senha, gravar):
+    vagas = _vagas
+    if not vagas.acquire(blocking=False):
+        return None
+
+    def regerar():
+        try:
+            gravar(_gerar(senha, BCRYPT_LOG_ROUNDS))
+        except Exception as e:
+            log.warning("erro ao refazer hash da senha", extra={'campos': {'erro': str(e)}})
+
+    try:
+        futuro = executor().submit(regerar)
+    except RuntimeError:
+        # Pool já encerrado (worker saindo)
+        vagas.release()
+        return None
+    futuro.add_done_callback(lambda _: vagas.release())
+    return futuro
+
+
+def rounds_do_hash(senha_hash):
+    # Formato $2b$12$...
+    try:
+        return int(senha_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def precisa_rehash(senha_hash):
+    return rounds_do_hash(senha_hash) != BCRYPT_LOG_ROUNDS
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Limite de tentativas erradas por chave (ip:... e email:...), em janela deslizante.
+# Bloqueado, o login volta 429 antes de gastar CPU com o bcrypt. max_por_tipo troca
+# o limite pelo prefixo da chave ({'ip': 100}); o resto usa max_falhas.
+class LimiteTentativas:
+    def __init__(self, max_falhas=LOGIN_MAX_FALHAS, janela=LOGIN_JANELA, max_por_tipo=None):
+        self.max_falhas = max_falhas
+        self.max_por_tipo = dict(max_por_tipo or {})
+        self.janela = janela
+        self._lock = threading.Lock()
+        self._falhas = {}
+        self._ultima_limpeza = time.monotonic()
+
+    def limpar(self):
+        with self._lock:
+            self._falhas.clear()
+
+    def _maximo(self, chave):
+        return self.max_por_tipo.get(chave.split(':', 1)[0], self.max_falhas)
+
+    def _recentes(self, chave, agora):
+        falhas = [t for t in self._falhas.get(chave, ()) if agora - t < self.janela]
+        if falhas:
+            self._falhas[chave] = falhas
+        else:
+            self._falhas.pop(chave, None)
+        return falhas
+
+    def bloqueado(self, *chaves):
+        agora = time.monotonic()
+        with self._lock:
+            return any(len(self._recentes(c, agora)) >= self._maximo(c) for c in chaves)
+
+    def registrar_falha(self, *chaves):
+        agora = time.monotonic()
+        with self._lock:
+            for c in chaves:
+                self._falhas.setdefault(c, []).append(agora)
+            # De tempos em tempos joga fora as chaves que já saíram da janela
+            if agora - self._ultima_limpeza > self.janela:
+                for c in list(self._falhas):
+                    self._recentes(c, agora)
+                self._ultima_limpeza = agora
+
+    def registrar_sucesso(self, *chaves):
+        with self._lock:
+            for c in chaves:
+                self._falhas.pop(c, None)
+
+
+limite_login = LimiteTentativas(max_por_tipo={'ip': LOGIN_MAX_FALHAS_IP})
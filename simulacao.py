@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+import estimativa
+from estimativa import TEMPO_GRAVIDADE, distribuir_baldes
+from registro import log
+import unidades
+from unidades import UNIDADE_PADRAO
+
+# Rodar com: python simulacao.py --saida tempos_calibrados.json
+# e subir o app com TEMPOS_CALIBRADOS=tempos_calibrados.json
+
+EVENTOS = 'eventos_fila'
+REGISTRAR_EVENTOS = os.getenv('REGISTRAR_EVENTOS', '1') != '0'
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Histórico das filas: entrada (na triagem), promocao (fim da triagem, entrada no
+# atendimento) e alta (fim do atendimento). Cada evento leva quantos funcionários
+# estavam disponíveis, que é o que as estimativas usaram naquele momento.
+# Falha ao gravar não derruba a rota: o histórico é só para calibrar.
+# Cada unidade tem as próprias filas, então o histórico é lido por unidade.
+def registrar_eventos(db, tipo, cpfs, triagistas, atendentes, gravidade=None, quando=None,
+                      unidade=UNIDADE_PADRAO):
+    if not REGISTRAR_EVENTOS or not cpfs:
+        return
+    quando = quando or datetime.now(timezone.utc)
+    try:
+        db[EVENTOS].insert_many([
+            {'tipo': tipo, 'cpf': cpf, 'gravidade': gravidade, 'quando': quando,
+             'triagistas': triagistas, 'atendentes': atendentes, 'unidade': unidade}
+            for cpf in cpfs
+        ], ordered=False)
+    except PyMongoError as e:
+        log.warning("erro ao registrar evento da fila", extra={'campos': {'tipo': tipo, 'erro': str(e)}})
+
+
+def carregar_eventos(db, desde=None, unidade=UNIDADE_PADRAO):
+    filtro = unidades.filtro(unidade)
+    if desde:
+        filtro['quando'] = {'$gte': desde}
+    return list(db[EVENTOS].find(filtro, {'_id': 0}).sort([('quando', ASCENDING)]))
+
+
+def _minutos(eventos):
+    import numpy as np
+    if not eventos:
+        return np.zeros(0)
+    inicio = eventos[0]['quando']
+    return np.array([(e['quando'] - inicio).total_seconds() / 60 for e in eventos])
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Refaz, para cada paciente promovido, a estimativa que o GET /triagem/<cpf> daria
+# logo depois da promoção (mesmo distribuir_baldes sobre a fila de atendimento do
+# momento, mais o próprio atendimento) e compara com o tempo até a alta registrada.
+def reproduzir(eventos, tempos=None):
+    tempos = tempos or TEMPO_GRAVIDADE
+
+    fila = {}
+    previstos = {}
+    promovidos_em = {}
+    for evento in eventos:
+        cpf = evento['cpf']
+        if evento['tipo'] == 'promocao' and evento['gravidade'] in tempos:
+            antes = [tempos[g] for g in fila.values()]
+            espera = min(distribuir_baldes(antes, max(evento['atendentes'] or 1, 1)))
+            previstos[cpf] = (evento['gravidade'], espera + tempos[evento['gravidade']])
+            promovidos_em[cpf] = evento['quando']
+            fila[cpf] = evento['gravidade']
+        elif evento['tipo'] == 'alta' and cpf in fila:
+            del fila[cpf]
+            gravidade, previsto = previstos.pop(cpf)
+            real = (evento['quando'] - promovidos_em.pop(cpf)).total_seconds() / 60
+            yield cpf, gravidade, previsto, real
+
+
+def comparar(eventos, tempos=None):
+    import numpy as np
+    linhas = list(reproduzir(eventos, tempos))
+    if not linhas:
+        return {'pacientes': 0}
+    gravidades = np.array([l[1] for l in linhas])
+    previsto = np.array([l[2] for l in linhas], dtype=float)
+    real = np.array([l[3] for l in linhas], dtype=float)
+    erro = previsto - real
+
+    def resumo(mascara):
+        return {
+            'pacientes': int(mascara.sum()),
+            'erro_medio': round(float(erro[mascara].mean()), 2),
+            'erro_absoluto_medio': round(float(np.abs(erro[mascara]).mean()), 2),
+            'real_medio': round(float(real[mascara].mean()), 2),
+            'previsto_medio': round(float(previsto[mascara].mean()), 2),
+        }
+
+    geral = resumo(np.ones(len(linhas), dtype=bool))
+    geral['por_gravidade'] = {g: resumo(gravidades == g) for g in TEMPO_GRAVIDADE if (gravidades == g).any()}
+    return geral
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Ajuste dos tempos de serviço por mínimos quadrados.
+#
+# Enquanto todos os funcionários de um setor estão ocupados (tem mais gente na fila
+# do que funcionários), o trabalho concluído acompanha o relógio: a soma dos tempos
+# de serviço de quem saiu desde o começo do período ocupado ~= soma de
+# funcionários x tempo decorrido. Cada saída num período ocupado vira uma linha
+# com a contagem acumulada de saídas por gravidade; o lstsq acha os tempos (e um
+# termo constante por período, que absorve quem já estava em atendimento).
+def _linhas_ocupadas(tempos, saiu, tamanho_antes, funcionarios, colunas):
+    import numpy as np
+
+    ocupado = saiu & (tamanho_antes > funcionarios)
+    indices = np.flatnonzero(ocupado)
+    if len(indices) < 2:
+        return None, None
+
+    # Períodos: saídas ocupadas consecutivas sem uma saída ociosa no meio
+    saidas_antes = np.cumsum(saiu) - 1
+    posicao_saida = saidas_antes[indices]
+    quebra = np.r_[True, np.diff(posicao_saida) != 1]
+    periodo = np.cumsum(quebra) - 1
+
+    # Trabalho disponível acumulado: funcionários x minutos, integrado evento a evento
+    passo = np.r_[0.0, np.diff(tempos)] * np.r_[funcionarios[0], funcionarios[:-1]]
+    trabalho = np.cumsum(passo)[indices]
+    feito = np.cumsum(colunas[indices], axis=0)
+
+    # Tudo relativo ao começo de cada período
+    primeiro = np.flatnonzero(quebra)
+    y = trabalho - trabalho[primeiro][periodo]
+    X = feito - feito[primeiro][periodo]
+    constantes = np.eye(periodo.max() + 1)[periodo]
+    return np.hstack([X, constantes]), y
+
+
+def ajustar_tempos(eventos, minimo_amostras=20):
+    import numpy as np
+    tempos_calibrados = {'tempo_gravidade': dict(TEMPO_GRAVIDADE), 'tempo_triagem': estimativa.TEMPO_TRIAGEM}
+    if not eventos:
+        return tempos_calibrados
+
+    minutos = _minutos(eventos)
+    tipos = np.array([e['tipo'] for e in eventos])
+    triagistas = np.array([e['triagistas'] or 0 for e in eventos], dtype=float)
+    atendentes = np.array([e['atendentes'] or 0 for e in eventos], dtype=float)
+
+    # Atendimento: entra na promoção, sai na alta
+    entra = tipos == 'promocao'
+    sai = tipos == 'alta'
+    tamanho = np.cumsum(entra.astype(int) - sai.astype(int))
+    tamanho_antes = tamanho + sai
+    nomes = list(TEMPO_GRAVIDADE)
+    # A gravidade da alta é a da última promoção do mesmo paciente
+    gravidade_de = {}
+    gravidade_saida = []
+    for e in eventos:
+        if e['tipo'] == 'promocao':
+            gravidade_de[e['cpf']] = e['gravidade']
+        gravidade_saida.append(gravidade_de.pop(e['cpf'], '') if e['tipo'] == 'alta' else '')
+    gravidade_saida = np.array(gravidade_saida)
+    colunas = (gravidade_saida[:, None] == np.array(nomes)[None, :]).astype(float)
+
+    X, y = _linhas_ocupadas(minutos, sai, tamanho_antes, atendentes, colunas)
+    if X is not None:
+        solucao = np.linalg.lstsq(X, y, rcond=None)[0]
+        amostras = colunas[sai].sum(axis=0)
+        for i, nome in enumerate(nomes):
+            if amostras[i] >= minimo_amostras and solucao[i] > 0:
+                tempos_calibrados['tempo_gravidade'][nome] = max(1, int(round(solucao[i])))
+
+    # Triagem: entra na entrada, sai na promoção; um tempo só para todo mundo
+    entra = tipos == 'entrada'
+    sai = tipos == 'promocao'
+    tamanho_antes = np.cumsum(entra.astype(int) - sai.astype(int)) + sai
+    X, y = _linhas_ocupadas(minutos, sai, tamanho_antes, triagistas, sai[:, None].astype(float))
+    if X is not None and sai.sum() >= minimo_amostras:
+        solucao = np.linalg.lstsq(X, y, rcond=None)[0]
+        if solucao[0] > 0:
+            tempos_calibrados['tempo_triagem'] = max(1, int(round(solucao[0])))
+
+    return tempos_calibrados
+
+
+def salvar_tempos(tempos, caminho):
+    with open(caminho, 'w') as arquivo:
+        json.dump(tempos, arquivo, indent=2, ensure_ascii=False)
+
+#----------------------------------------------------------------------------------------------------------------------------------
+def main(argv=None):
+    from banco import get_client
+    parser = argparse.ArgumentParser(description="Compara as estimativas com o histórico e calibra os tempos")
+    parser.add_argument('--saida', help="grava os tempos calibrados neste arquivo (TEMPOS_CALIBRADOS)")
+    parser.add_argument('--dias', type=float, help="usa só os últimos N dias do histórico")
+    parser.add_argument('--unidade', default=UNIDADE_PADRAO, help="unidade cujo histórico é usado")
+    args = parser.parse_args(argv)
+
+    db = get_client(os.getenv('MONGO_URI'))[os.getenv('DB_NAME', 'healthcenter')]
+    desde = None
+    if args.dias:
+        from datetime import timedelta
+        desde = datetime.now(timezone.utc) - timedelta(days=args.dias)
+    eventos = carregar_eventos(db, desde, args.unidade)
+
+    tempos = ajustar_tempos(eventos)
+    print(f"Eventos: {len(eventos)}")
+    print(f"Tempos atuais:     {json.dumps({'tempo_gravidade': TEMPO_GRAVIDADE, 'tempo_triagem': estimativa.TEMPO_TRIAGEM})}")
+    print(f"Tempos calibrados: {json.dumps(tempos)}")
+    print(f"Estimativas com os tempos atuais:     {json.dumps(comparar(eventos), ensure_ascii=False)}")
+    print(f"Estimativas com os tempos calibrados: "
+          f"{json.dumps(comparar(eventos, tempos['tempo_gravidade']), ensure_ascii=False)}")
+    if args.saida:
+        salvar_tempos(tempos, args.saida)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Servidor local que imita o endpoint de chat completions, para testar latência e
+# concorrência sem sair da máquina. Responde sempre `resposta` depois de `latencia` segundos.
+class ServidorIAFalso:
+    def __init__(self, resposta="leve", latencia=0.0, status=200):
+        self.resposta = resposta
+        self.latencia = latencia
+        self.status = status
+        self.total = 0
+        self.em_andamento = 0
+        self.max_simultaneos = 0
+        self._lock = threading.Lock()
+        self._servidor = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._servidor.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, porta = self._servidor.server_address
+        return f"http://{host}:{porta}/chat/completions"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                tamanho = int(self.headers.get('Content-Length', 0))
+                self.rfile.read(tamanho)
+                with stub._lock:
+                    stub.total += 1
+                    stub.em_andamento += 1
+                    stub.max_simultaneos = max(stub.max_simultaneos, stub.em_andamento)
+                try:
+                    time.sleep(stub.latencia)
+                    corpo = json.dumps({
+                        "choices": [{"message": {"role": "assistant", "content": stub.resposta}}]
+                    }).encode('utf-8')
+                    self.send_response(stub.status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(corpo)))
+                    self.end_headers()
+                    self.wfile.write(corpo)
+                finally:
+                    with stub._lock:
+                        stub.em_andamento -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
@@ -6,6 +6,12 @@ from flask import json
 
 bcrypt = Bcrypt()
 
+
+def _token(cpf, tipo, cargo=None):
+    import autenticacao
+    with flask_app.app_context():
+        return f"Bearer {autenticacao.emitir_token(cpf, tipo, cargo)}"
+
 @pytest.fixture
 def client(monkeypatch):
     flask_app.config['TESTING'] = True
@@ -40,10 +46,46 @@ def client(monkeypatch):
 
     monkeypatch.setattr('app.connect_db', lambda: mock_db)
 
+    import app as app_module
+    import triagem_ia
+    app_module.cache_sintomas.limpar()
+    triagem_ia.disjuntor.fechar()
+    triagem_ia.caminhos.zerar()
+    from disponibilidade import disponibilidade
+    disponibilidade.limpar()
+    import senhas
+    senhas.limite_login.limpar()
+    import credenciais
+    credenciais.ausentes.limpar()
+    from perfis import perfis
+    perfis.limpar()
+    import metricas
+    metricas.zerar()
+    import ciclo
+    ciclo.drenando.clear()
+    # Nada de rede: sem o stub_ia, quem precisar da IA cai numa porta local fechada
+    monkeypatch.setattr(triagem_ia, 'TRIAGEM_MODO', 'local')
+    monkeypatch.setattr(triagem_ia, 'URL_IA', 'http://127.0.0.1:9/chat/completions')
+
     with flask_app.test_client() as client:
+        # Por padrão os pedidos vão como o funcionário, que pode usar todas as rotas
+        client.environ_base['HTTP_AUTHORIZATION'] = _token("98765432100", "funcionario", "atendimento")
         yield client
+
+    # Classificações ainda no pool não podem vazar para o próximo teste
+    triagem_ia.encerrar(esperar=True)
 # -------------------------- TESTES DE CADASTRO -------------------------------
 
+def test_cadastro_com_cpf_ja_cadastrado(client):
+    import indices
+    indices.criar_indices(flask_app.db)
+    response = client.post('/cadastro', json={
+        "email": "outro@example.com", "senha": "123456", "nome_completo": "Outro", "cpf": "12345678900"
+    })
+    assert response.status_code == 400
+    assert response.get_json()['msg'] == 'Usuário já existe'
+
+
 def test_cadastro_sucesso(client):
     novo = {
         "email": "novo@example.com",
@@ -127,6 +169,237 @@ def test_login_dados_faltando(client):
     assert response.get_json()['msg'] == 'Email e senha são obrigatórios'
 
 
+def test_login_refaz_hash_quando_o_custo_muda(client, monkeypatch):
+    import senhas
+    monkeypatch.setattr(senhas, 'BCRYPT_LOG_ROUNDS', 4)
+    db = flask_app.db
+
+    response = client.post('/login', json={"email": "teste@exemplo.com", "senha": "senha123"})
+    assert response.status_code == 200
+    # O rehash roda no pool depois da resposta
+    senhas.encerrar(esperar=True)
+    novo_hash = db.pacientes.find_one({"email": "teste@exemplo.com"})["senha"]
+    assert senhas.rounds_do_hash(novo_hash) == 4
+
+    # O hash novo continua valendo para a mesma senha
+    response = client.post('/login', json={"email": "teste@exemplo.com", "senha": "senha123"})
+    assert response.status_code == 200
+    assert db.pacientes.find_one({"email": "teste@exemplo.com"})["senha"] == novo_hash
+
+
+
+def test_rehash_com_pool_cheio_nao_derruba_o_login(client, monkeypatch):
+    import threading
+    import senhas
+    monkeypatch.setattr(senhas, 'BCRYPT_LOG_ROUNDS', 4)
+    monkeypatch.setattr(senhas, 'conferir', lambda *a: True)
+    monkeypatch.setattr(senhas, '_vagas', threading.BoundedSemaphore(1))
+    senhas._vagas.acquire()
+    antigo = flask_app.db.pacientes.find_one({"email": "teste@exemplo.com"})["senha"]
+
+    response = client.post('/login', json={"email": "teste@exemplo.com", "senha": "senha123"})
+    assert response.status_code == 200
+    # Ficou para o próximo login
+    assert flask_app.db.pacientes.find_one({"email": "teste@exemplo.com"})["senha"] == antigo
+
+def test_login_bloqueia_depois_de_muitas_falhas(client, monkeypatch):
+    import senhas
+    monkeypatch.setattr(senhas.limite_login, 'max_falhas', 3)
+
+    for _ in range(3):
+        response = client.post('/login', json={"email": "teste@exemplo.com", "senha": "errada"})
+        assert response.status_code == 401
+
+    # Bloqueado mesmo com a senha certa, sem chegar no bcrypt
+    conferidas = []
+    monkeypatch.setattr(senhas, 'conferir', lambda *a: conferidas.append(a) or True)
+    response = client.post('/login', json={"email": "teste@exemplo.com", "senha": "senha123"})
+    assert response.status_code == 429
+    assert conferidas == []
+
+    senhas.limite_login.limpar()
+    response = client.post('/login', json={"email": "teste@exemplo.com", "senha": "senha123"})
+    assert response.status_code == 200
+
+
+
+def test_falhas_de_um_email_nao_bloqueiam_o_ip(client, monkeypatch):
+    import senhas
+    monkeypatch.setattr(senhas.limite_login, 'max_falhas', 3)
+    for _ in range(5):
+        client.post('/login', json={"email": "teste@exemplo.com", "senha": "errada"})
+        client.post('/login', json={"email": "nao@existe.com", "senha": "x"})
+
+    # Mesmo IP, outro usuário: o IP tem limite próprio, bem mais alto
+    response = client.post('/login', json={"email": "funcionario@exemplo.com", "senha": "funcsenha"})
+    assert response.status_code == 200
+
+
+def test_limite_por_ip_usa_o_ip_do_proxy_confiavel(client, monkeypatch):
+    import app as app_module
+    import senhas
+    monkeypatch.setitem(senhas.limite_login.max_por_tipo, 'ip', 2)
+    atras_do_proxy = app_module.create_app({'PROXIES_CONFIAVEIS': 1}).test_client()
+
+    def tentar(ip):
+        return atras_do_proxy.post('/login', json={"email": "nao@existe.com", "senha": "x"},
+                                   headers={'X-Forwarded-For': ip}).status_code
+
+    assert [tentar("10.0.0.1") for _ in range(3)] == [404, 404, 429]
+    # Outro cliente atrás do mesmo proxy continua entrando
+    assert tentar("10.0.0.2") == 404
+
+def test_pool_de_senhas_cheio_responde_503(client, monkeypatch):
+    import senhas
+    monkeypatch.setattr(senhas, '_vagas', __import__('threading').BoundedSemaphore(1))
+    senhas._vagas.acquire()
+    response = client.post('/login', json={"email": "teste@exemplo.com", "senha": "senha123"})
+    assert response.status_code == 503
+
+
+def test_hash_lento_responde_503_e_segura_a_vaga(client, monkeypatch):
+    import threading
+    import senhas
+    liberar = threading.Event()
+    monkeypatch.setattr(senhas, '_vagas', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(senhas, 'SENHAS_TIMEOUT', 0.05)
+    monkeypatch.setattr(senhas, '_conferir', lambda senha_hash, senha: liberar.wait(5))
+
+    response = client.post('/login', json={"email": "teste@exemplo.com", "senha": "senha123"})
+    assert response.status_code == 503
+    # O hash ainda está rodando: a vaga continua ocupada
+    assert not senhas._vagas.acquire(blocking=False)
+
+    liberar.set()
+    assert senhas._vagas.acquire(timeout=5)
+    senhas._vagas.release()
+
+
+def test_login_de_funcionario_usa_uma_consulta_depois_da_primeira(client, monkeypatch):
+    db = flask_app.db
+    consultas = []
+    for colecao in ('credenciais', 'pacientes', 'funcionarios'):
+        original = db[colecao].find_one
+        monkeypatch.setattr(db[colecao], 'find_one',
+                            lambda *a, c=colecao, f=original, **k: consultas.append(c) or f(*a, **k))
+
+    dados = {"email": "funcionario@exemplo.com", "senha": "funcsenha"}
+    # Primeira vez cai no caminho antigo e cria a credencial
+    assert client.post('/login', json=dados).status_code == 200
+    assert consultas == ['credenciais', 'pacientes', 'funcionarios']
+
+    # Depois: só a credencial pelo email
+    consultas.clear()
+    response = client.post('/login', json=dados)
+    assert response.status_code == 200
+    assert response.get_json()['tipo'] == 'funcionario'
+    assert consultas == ['credenciais']
+
+
+def test_email_desconhecido_fica_em_cache_ate_o_cadastro(client, monkeypatch):
+    db = flask_app.db
+    consultas = []
+    original = db.credenciais.find_one
+    monkeypatch.setattr(db.credenciais, 'find_one', lambda *a, **k: consultas.append(a) or original(*a, **k))
+
+    dados = {"email": "nova@exemplo.com", "senha": "123456"}
+    assert client.post('/login', json=dados).status_code == 404
+    assert client.post('/login', json=dados).status_code == 404
+    assert len(consultas) == 1
+
+    assert client.post('/cadastro', json=dict(dados, cpf="55566677788")).status_code == 201
+    response = client.post('/login', json=dados)
+    assert response.status_code == 200
+    assert response.get_json()['cpf'] == "55566677788"
+
+
+def test_cadastro_recusa_email_de_funcionario(client):
+    response = client.post('/cadastro', json={"email": "funcionario@exemplo.com", "senha": "x"})
+    assert response.status_code == 400
+
+
+def test_sincronizar_credenciais(client):
+    import credenciais
+    db = flask_app.db
+    assert credenciais.sincronizar(db) == 2
+    tipos = {c['email']: c['tipo'] for c in db.credenciais.find()}
+    assert tipos == {"teste@exemplo.com": "paciente", "funcionario@exemplo.com": "funcionario"}
+
+    # Funcionário apagado direto no banco perde a credencial na próxima sincronização
+    db.funcionarios.delete_one({"email": "funcionario@exemplo.com"})
+    assert credenciais.sincronizar(db) == 1
+    assert [c['email'] for c in db.credenciais.find()] == ["teste@exemplo.com"]
+
+
+def test_mudanca_direta_no_banco_vale_depois_de_sincronizar(client):
+    import autenticacao
+    import credenciais
+    db = flask_app.db
+    dados = {"email": "funcionario@exemplo.com", "senha": "funcsenha"}
+    assert client.post('/login', json=dados).status_code == 200
+
+    # Senha e cargo trocados direto no banco
+    db.funcionarios.update_one({"email": dados["email"]}, {"$set": {
+        "senha": bcrypt.generate_password_hash("nova").decode('utf-8'), "cargo": "triagem"
+    }})
+    credenciais.sincronizar(db)
+    assert client.post('/login', json=dados).status_code == 401
+    response = client.post('/login', json=dict(dados, senha="nova"))
+    assert response.status_code == 200
+    with flask_app.app_context():
+        assert autenticacao.ler_token(response.get_json()['token'])['cargo'] == "triagem"
+
+    # Funcionário apagado deixa de entrar
+    db.funcionarios.delete_one({"email": dados["email"]})
+    credenciais.sincronizar(db)
+    assert client.post('/login', json=dict(dados, senha="nova")).status_code == 404
+
+
+def test_login_devolve_token_aceito_nas_rotas(client):
+    response = client.post('/login', json={"email": "teste@exemplo.com", "senha": "senha123"})
+    token = response.get_json()['token']
+    cabecalho = {"Authorization": f"Bearer {token}"}
+
+    assert client.get('/triagem/12345678900', headers=cabecalho).status_code == 404
+    # Paciente não vê o cpf de outro nem as rotas de funcionário
+    assert client.get('/triagem/00000000000', headers=cabecalho).status_code == 403
+    assert client.get('/pacientes', headers=cabecalho).status_code == 403
+    assert client.delete('/atendimento/12345678900', headers=cabecalho).status_code == 403
+
+
+def test_rotas_sem_token_ou_com_token_adulterado(client):
+    client.environ_base.pop('HTTP_AUTHORIZATION')
+    assert client.get('/triagem/12345678900').status_code == 401
+    assert client.get('/pacientes').status_code == 401
+
+    adulterado = {"Authorization": _token("12345678900", "paciente")[:-2] + "xx"}
+    assert client.get('/triagem/12345678900', headers=adulterado).status_code == 401
+    # Login continua funcionando com um token velho no cabeçalho
+    response = client.post('/login', headers=adulterado,
+                           json={"email": "teste@exemplo.com", "senha": "senha123"})
+    assert response.status_code == 200
+
+
+def test_token_do_funcionario_traz_o_cargo(client):
+    import autenticacao
+    flask_app.db.funcionarios.update_one({"cpf": "98765432100"}, {"$set": {"cargo": "triagem"}})
+    response = client.post('/login', json={"email": "funcionario@exemplo.com", "senha": "funcsenha"})
+    with flask_app.app_context():
+        dados = autenticacao.ler_token(response.get_json()['token'])
+    assert dados == {"cpf": "98765432100", "tipo": "funcionario", "cargo": "triagem"}
+
+
+def test_perfil_em_cache_e_invalidado_no_put(client, monkeypatch):
+    from perfis import perfis
+    db = flask_app.db
+    assert perfis.obter(db, "12345678900")["nome_completo"] == "Usuário Teste"
+    db.pacientes.update_one({"cpf": "12345678900"}, {"$set": {"nome_completo": "Outro Nome"}})
+    assert perfis.obter(db, "12345678900")["nome_completo"] == "Usuário Teste"
+
+    assert client.put('/triagem/12345678900', json={"peso": 61}).status_code == 200
+    assert perfis.obter(db, "12345678900")["nome_completo"] == "Outro Nome"
+
+
 # -------------------------- TESTES VERIFICA_TRIAGEM --------------------------------
 
 def test_verifica_triagem_paciente_nao_esta_na_fila(client):
@@ -160,4 +433,1038 @@ def test_verifica_triagem_com_valor_nao_reconhecido(client):
 
     response = client.get('/triagem/12312312399')
     assert response.status_code == 202
-    assert "não foi concluída" in response.get_json()['msg']
\ No newline at end of file
+    assert "não foi concluída" in response.get_json()['msg']
+
+# -------------------------- TESTES DE CONEXAO --------------------------------
+
+def test_client_mongo_compartilhado():
+    import banco
+    banco.fechar_client()
+    c1 = banco.get_client('mongodb://localhost:27017')
+    c2 = banco.get_client('mongodb://localhost:27017')
+    assert c1 is c2
+    assert c1.options.pool_options.max_pool_size == banco.MONGO_MAX_POOL_SIZE
+    banco.fechar_client()
+
+
+def test_saude_reporta_pool(client):
+    response = client.get('/saude')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['status'] == 'ok'
+    assert 'checkouts' in data['pool_mongo']
+
+
+def test_saude_viva_e_pronta_sem_token(client):
+    import os
+    del client.environ_base['HTTP_AUTHORIZATION']
+    response = client.get('/saude/viva')
+    assert response.status_code == 200
+    assert response.get_json()['pid'] == os.getpid()
+    response = client.get('/saude/pronta')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'pronto'
+
+
+def test_saude_pronta_sem_banco(client, monkeypatch):
+    def sem_banco():
+        raise RuntimeError("sem conexão")
+    monkeypatch.setattr('app.connect_db', sem_banco)
+    response = client.get('/saude/pronta')
+    assert response.status_code == 503
+    assert response.get_json()['status'] == 'sem_banco'
+    assert client.get('/saude/viva').status_code == 200
+
+
+def test_drenagem_tira_o_worker_da_rota(client):
+    import ciclo
+    ciclo.iniciar_drenagem()
+    response = client.get('/saude/pronta')
+    assert response.status_code == 503
+    assert response.get_json()['status'] == 'drenando'
+    # Os pedidos normais continuam sendo atendidos até o worker sair
+    assert client.get('/saude').status_code == 200
+
+
+def test_create_app_monta_apps_independentes():
+    import app as app_module
+    a = app_module.create_app({'TESTING': True, 'SECRET_KEY': 'a'})
+    b = app_module.create_app({'SECRET_KEY': 'b'})
+    assert a is not b and a is not flask_app
+    assert a.config['TESTING'] and not b.config['TESTING']
+    assert b.test_client().get('/saude/viva').status_code == 200
+
+
+# -------------------------- TESTES DAS FILAS ---------------------------------
+
+def _adiciona_funcionarios(db, triagem=1, atendimento=1, unidade=None):
+    lotacao = {"unidade": unidade} if unidade else {}
+    for _ in range(triagem):
+        db.funcionarios.insert_one({"disponível": True, "cargo": "triagem", **lotacao})
+    for _ in range(atendimento):
+        db.funcionarios.insert_one({"disponível": True, "cargo": "atendimento", **lotacao})
+
+
+def _espera_triagem_ia(db, cpf, limite=5.0):
+    import time
+    fim = time.time() + limite
+    while time.time() < fim:
+        doc = db.fila_triagem.find_one({"paciente_cpf": cpf})
+        if doc and doc.get("status_ia") != "pendente":
+            return doc
+        time.sleep(0.01)
+    raise AssertionError(f"triagem da IA não terminou para {cpf}")
+
+
+def test_remocao_nao_reescreve_quem_esta_atras(client):
+    import filas
+    db = client.application.db
+    _adiciona_funcionarios(db)
+    for cpf in ["111", "222", "333"]:
+        filas.entrar(db, filas.FILA_ATENDIMENTO, {
+            "paciente_cpf": cpf, "nome": cpf, "triagem_oficial": "leve"
+        })
+    chave_333 = db.fila_atendimento.find_one({"paciente_cpf": "333"})["posicao_fila"]
+
+    response = client.delete('/atendimento/222')
+    assert response.status_code == 200
+
+    # A chave guardada de quem estava atrás não muda; a posição exibida sim
+    assert db.fila_atendimento.find_one({"paciente_cpf": "333"})["posicao_fila"] == chave_333
+    response = client.get('/triagem/333')
+    assert response.status_code == 200
+    assert response.get_json()['posicao_na_fila'] == 2
+    assert response.get_json()['tempo_estimado_espera'] == "40 minutos"
+
+
+def test_entrar_na_triagem_e_promover(client, monkeypatch):
+    db = client.application.db
+    _adiciona_funcionarios(db)
+    monkeypatch.setattr('triagem_ia.TRIAGEM_MODO', 'remote')
+    monkeypatch.setattr('triagem_ia.triagem_sintomas', lambda sintomas: "grave")
+
+    response = client.post('/triagem/12345678900', json={"sintomas": "dor no peito"})
+    assert response.status_code == 202
+    corpo = response.get_json()
+    assert corpo['posicao_triagem'] == 1
+    # Chaves de antes do 202; sem gravidade, o atendimento mais curto, como provisório
+    assert corpo['gravidade_estimada'] is None and corpo['resposta_ia'] is None
+    assert corpo['estimativa_provisoria'] is True
+    assert corpo['tempo_atendimento'] == "20 minutos"
+    assert corpo['tempo_total_estimado'] == "25 minutos"
+    _espera_triagem_ia(db, "12345678900")
+    assert db.fila_triagem.find_one({"paciente_cpf": "12345678900"})['triagemIA'] == "grave"
+
+    response = client.put('/triagem_e_fila/12345678900', json={"triagem_oficial": "moderada"})
+    assert response.status_code == 200
+    assert db.fila_triagem.count_documents({}) == 0
+
+    response = client.get('/triagem/12345678900')
+    assert response.status_code == 200
+    assert response.get_json()['posicao_na_fila'] == 1
+    assert response.get_json()['tempo_estimado_espera'] == "40 minutos"
+
+
+# -------------------------- TESTES DA ESTIMATIVA -----------------------------
+
+def test_agenda_igual_a_distribuir_baldes():
+    import random
+    from estimativa import Agenda, TEMPO_GRAVIDADE, distribuir_baldes
+
+    rnd = random.Random(42)
+    documentos = [{"triagem_oficial": rnd.choice(list(TEMPO_GRAVIDADE) + ["", "invalida"])}
+                  for _ in range(200)]
+
+    for n in [1, 2, 3, 7]:
+        agenda = Agenda("triagem_oficial", n)
+        for d in documentos:
+            agenda.adicionar_documento(d)
+
+        for i in range(len(documentos)):
+            tempos_antes = [TEMPO_GRAVIDADE[d["triagem_oficial"]] for d in documentos[:i]
+                            if d["triagem_oficial"] in TEMPO_GRAVIDADE]
+            assert agenda.inicio(i) == min(distribuir_baldes(tempos_antes, n))
+            assert agenda.validos_antes[i] == len(tempos_antes)
+
+
+def test_agenda_acompanha_novos_pacientes_sem_reler_a_fila(client):
+    import filas
+    from estimativa import agenda_atendimento
+    db = client.application.db
+
+    filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": "1", "triagem_oficial": "grave"})
+    visao = filas.ordem(db, filas.FILA_ATENDIMENTO)
+    agenda = agenda_atendimento(visao, 1)
+
+    filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": "2", "triagem_oficial": "leve"})
+    assert filas.ordem(db, filas.FILA_ATENDIMENTO) is visao
+    assert agenda_atendimento(visao, 1) is agenda
+    assert agenda.inicio(1) == 70
+
+    # Remoção troca a geração e a agenda é refeita na próxima leitura
+    filas.sair(db, filas.FILA_ATENDIMENTO, "1")
+    nova = filas.ordem(db, filas.FILA_ATENDIMENTO)
+    assert nova is not visao
+    assert agenda_atendimento(nova, 1).inicio(0) == 0
+
+
+def test_entrada_fora_de_ordem_descarta_a_visao(client, monkeypatch):
+    import filas
+    db = client.application.db
+
+    # A chave k é reservada, mas quem pegou k+1 grava primeiro
+    k = filas.proxima_chave(db, filas.FILA_ATENDIMENTO)
+    filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": "2", "triagem_oficial": "leve"})
+    visao = filas.ordem(db, filas.FILA_ATENDIMENTO)
+    assert visao.chaves == [k + 1]
+
+    monkeypatch.setattr(filas, 'proxima_chave', lambda *a, **kw: k)
+    filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": "1", "triagem_oficial": "leve"})
+    nova = filas.ordem(db, filas.FILA_ATENDIMENTO)
+    assert nova is not visao
+    assert nova.chaves == [k, k + 1]
+    assert nova.documento_do_cpf("1")["posicao_fila"] == k
+
+
+def test_inicios_da_agenda_iguais_ao_menor_balde():
+    import random
+    from estimativa import Agenda, TEMPO_GRAVIDADE
+
+    rnd = random.Random(7)
+    gravidades = [rnd.choice(list(TEMPO_GRAVIDADE)) for _ in range(300)]
+    for n in [1, 4, 400]:
+        agenda = Agenda("triagem_oficial", n)
+        baldes = [0] * n
+        esperado = []
+        for g in gravidades:
+            agenda.adicionar_documento({"triagem_oficial": g})
+            esperado.append(min(baldes))
+            baldes[baldes.index(min(baldes))] += TEMPO_GRAVIDADE[g]
+        assert agenda.inicios == esperado
+
+
+
+def test_log_da_classificacao_sem_cpf_nem_texto_clinico(client, monkeypatch, capsys):
+    import app as app_module
+    from registro import pseudonimo
+    monkeypatch.setattr(app_module, 'classificar_sintomas',
+                        lambda s: ("grave", "Paciente com dor no peito irradiando", "ia"))
+    app_module.classificar_em_segundo_plano(flask_app.db, "12345678900", 1, "dor no peito")
+
+    linha = next(json.loads(l) for l in capsys.readouterr().err.splitlines() if "triagem classificada" in l)
+    assert linha['paciente'] == pseudonimo("12345678900")
+    assert linha['gravidade'] == "grave"
+    assert "12345678900" not in json.dumps(linha)
+    assert "peito" not in json.dumps(linha)
+
+# -------------------------- TESTES DA TRIAGEM ASSINCRONA ---------------------
+
+@pytest.fixture
+def ia_lenta(monkeypatch):
+    import triagem_ia
+    from stub_ia import ServidorIAFalso
+
+    triagem_ia.encerrar()
+    monkeypatch.setattr(triagem_ia, 'TRIAGEM_IA_WORKERS', 2)
+    monkeypatch.setattr(triagem_ia, 'TRIAGEM_MODO', 'remote')
+    with ServidorIAFalso(resposta="grave", latencia=0.3) as stub:
+        monkeypatch.setattr(triagem_ia, 'URL_IA', stub.url)
+        yield stub
+    triagem_ia.encerrar()
+
+
+def test_post_triagem_responde_antes_da_ia(client, ia_lenta):
+    import time
+    db = client.application.db
+    _adiciona_funcionarios(db)
+    cpfs = [f"0000000000{i}" for i in range(5)]
+    for cpf in cpfs:
+        db.pacientes.insert_one({"cpf": cpf, "nome_completo": f"Paciente {cpf}"})
+
+    inicio = time.time()
+    for cpf in cpfs:
+        response = client.post(f'/triagem/{cpf}', json={"sintomas": "dor no peito"})
+        assert response.status_code == 202
+        assert response.get_json()['status_ia'] == "pendente"
+    # As cinco entradas voltam antes de uma única resposta do modelo
+    assert time.time() - inicio < ia_lenta.latencia
+
+    for cpf in cpfs:
+        assert _espera_triagem_ia(db, cpf)['triagemIA'] == "grave"
+    assert ia_lenta.total == 5
+    assert ia_lenta.max_simultaneos <= 2
+
+
+# -------------------------- TESTES DO CACHE DE SINTOMAS ----------------------
+
+def test_normalizar_sintomas():
+    from cache_sintomas import normalizar_sintomas
+    assert normalizar_sintomas("  Dor de CABEÇA!!  ") == "dor de cabeca"
+    assert normalizar_sintomas("Febre,   tosse.") == "febre tosse"
+
+
+def test_cache_memoria_lru_e_ttl(monkeypatch):
+    import cache_sintomas
+    from cache_sintomas import CacheMemoria
+
+    agora = [1000.0]
+    monkeypatch.setattr(cache_sintomas.time, 'monotonic', lambda: agora[0])
+    cache = CacheMemoria(max_itens=2, ttl=60)
+
+    cache.guardar("febre", "leve")
+    cache.guardar("dor no peito", "grave")
+    assert cache.obter("Febre!") == "leve"
+    cache.guardar("tosse", "leve")           # expulsa "dor no peito", o menos usado
+    assert cache.obter("dor no peito") is None
+
+    agora[0] += 61
+    assert cache.obter("febre") is None       # expirou
+    assert cache.resumo()['acertos'] == 1
+    assert cache.resumo()['falhas'] == 2
+
+
+def test_cache_mongo_compartilhado():
+    import time
+    from cache_sintomas import CacheMongo
+    colecao = mongomock.MongoClient().db.cache_triagem
+    cache = CacheMongo(lambda: colecao, max_itens=2, podar_a_cada=1)
+
+    # usado_em tem resolução de milissegundos no Mongo
+    cache.guardar("febre", "leve")
+    time.sleep(0.002)
+    cache.guardar("tosse", "leve")
+    time.sleep(0.002)
+    assert cache.obter("FEBRE") == "leve"
+    time.sleep(0.002)
+    cache.guardar("dor no peito", "grave")
+    assert colecao.count_documents({}) == 2
+    assert cache.obter("tosse") is None
+
+
+def test_post_triagem_usa_cache(client, monkeypatch):
+    db = client.application.db
+    _adiciona_funcionarios(db)
+    monkeypatch.setattr('triagem_ia.TRIAGEM_MODO', 'remote')
+    chamadas = []
+    monkeypatch.setattr('triagem_ia.triagem_sintomas', lambda sintomas: chamadas.append(sintomas) or "leve")
+    db.pacientes.insert_one({"cpf": "55555555555", "nome_completo": "Outro"})
+
+    client.post('/triagem/12345678900', json={"sintomas": "Dor de cabeça"})
+    _espera_triagem_ia(db, "12345678900")
+
+    response = client.post('/triagem/55555555555', json={"sintomas": "dor de cabeca!"})
+    assert response.status_code == 202
+    assert response.get_json()['gravidade_estimada'] == "leve"
+    assert response.get_json()['estimativa_provisoria'] is False
+    assert db.fila_triagem.find_one({"paciente_cpf": "55555555555"})['triagemIA'] == "leve"
+    assert len(chamadas) == 1
+
+
+# -------------------------- TESTES DA CHAMADA À IA ---------------------------
+
+def test_extrair_gravidade_aceita_masculino():
+    from triagem_ia import extrair_gravidade
+    assert extrair_gravidade("Moderado.") == "moderada"
+    assert extrair_gravidade("Gravidade: grave") == "grave"
+    assert extrair_gravidade("Erro ao conectar à API") is None
+
+
+def test_ia_com_erro_tenta_de_novo_e_cai_no_local(monkeypatch):
+    import triagem_ia
+    from stub_ia import ServidorIAFalso
+
+    triagem_ia.fechar_sessao()
+    triagem_ia.disjuntor.fechar()
+    monkeypatch.setattr(triagem_ia, 'TRIAGEM_IA_BACKOFF', 0.001)
+    with ServidorIAFalso(status=503) as stub:
+        monkeypatch.setattr(triagem_ia, 'URL_IA', stub.url)
+        gravidade, resposta, origem = triagem_ia.classificar_sintomas("dor no peito forte")
+
+    assert (gravidade, origem) == ("grave", "local")
+    assert "503" in resposta
+    assert stub.total == triagem_ia.TRIAGEM_IA_TENTATIVAS
+
+
+def test_disjuntor_abre_e_para_de_chamar_a_ia(monkeypatch):
+    import triagem_ia
+    from stub_ia import ServidorIAFalso
+
+    triagem_ia.fechar_sessao()
+    monkeypatch.setattr(triagem_ia, 'TRIAGEM_IA_TENTATIVAS', 1)
+    monkeypatch.setattr(triagem_ia, 'disjuntor', triagem_ia.Disjuntor(falhas_para_abrir=2, tempo_aberto=60))
+    with ServidorIAFalso(status=500) as stub:
+        monkeypatch.setattr(triagem_ia, 'URL_IA', stub.url)
+        for _ in range(5):
+            assert triagem_ia.classificar_sintomas("tosse")[2] == "local"
+
+    assert stub.total == 2
+    assert triagem_ia.disjuntor.estado == 'aberto'
+
+
+def test_sessao_reaproveitada_com_ia_funcionando(monkeypatch):
+    import triagem_ia
+    from stub_ia import ServidorIAFalso
+
+    triagem_ia.fechar_sessao()
+    triagem_ia.disjuntor.fechar()
+    with ServidorIAFalso(resposta="Moderado") as stub:
+        monkeypatch.setattr(triagem_ia, 'URL_IA', stub.url)
+        assert triagem_ia.classificar_sintomas("febre") == ("moderada", "Moderado", "ia")
+        sessao = triagem_ia.sessao()
+        triagem_ia.classificar_sintomas("febre alta")
+        assert triagem_ia.sessao() is sessao
+
+
+# -------------------------- TESTES DO CLASSIFICADOR LOCAL --------------------
+
+def test_classificador_local():
+    from classificador_local import classificar_local
+    assert classificar_local("Estou com DOR NO PEITO e falta de ar") == ("grave", 1.0)
+    assert classificar_local("tosse, coriza e dor de garganta")[0] == "leve"
+    assert classificar_local("tosse")[1] < 0.75
+    assert classificar_local("xyz") == ("moderada", 0.0)
+
+
+@pytest.mark.parametrize("modo, sintomas, chamadas_ia, caminho", [
+    ("hybrid", "dor no peito", 0, "local"),
+    ("hybrid", "sinto uma coisa estranha", 1, "ia"),
+    ("local", "sinto uma coisa estranha", 0, "local"),
+    ("remote", "dor no peito", 1, "ia"),
+])
+def test_modos_de_triagem(client, monkeypatch, modo, sintomas, chamadas_ia, caminho):
+    import triagem_ia
+    db = client.application.db
+    _adiciona_funcionarios(db)
+    chamadas = []
+    monkeypatch.setattr(triagem_ia, 'TRIAGEM_MODO', modo)
+    monkeypatch.setattr(triagem_ia, 'triagem_sintomas', lambda s: chamadas.append(s) or "grave")
+
+    response = client.post('/triagem/12345678900', json={"sintomas": sintomas})
+    assert response.status_code == 202
+    _espera_triagem_ia(db, "12345678900")
+
+    assert len(chamadas) == chamadas_ia
+    assert triagem_ia.caminhos.resumo()[caminho] == 1
+
+
+# -------------------------- TESTES DOS INDICES -------------------------------
+
+def test_criar_indices_e_verificar(client):
+    import indices
+    db = client.application.db
+    assert len(indices.indices_faltando(db)) == 10
+
+    indices.criar_indices(db)
+    assert indices.indices_faltando(db) == []
+    assert "Todos os índices necessários existem." in indices.relatorio(db)
+
+
+def test_indice_recusado_nao_impede_os_outros(client):
+    import indices
+    db = client.application.db
+    # cpf duplicado de dados antigos: pacientes.cpf_unico não pode ser criado
+    db.pacientes.insert_one({"email": "dup@exemplo.com", "cpf": "12345678900"})
+
+    indices.criar_indices(db)
+    assert [(c, nome) for c, nome, _ in indices.indices_faltando(db)] == [("pacientes", "cpf_unico")]
+
+
+def test_indices_criados_na_subida(client, monkeypatch):
+    import banco
+    import ciclo
+    import indices
+    db = client.application.db
+    monkeypatch.setattr(banco, 'get_client', lambda uri=None: db.client)
+    monkeypatch.setenv('DB_NAME', db.name)
+    ciclo.preparar_banco()
+    assert indices.indices_faltando(db) == []
+
+
+def test_indice_unico_impede_paciente_duas_vezes_na_fila(client):
+    import indices
+    db = client.application.db
+    indices.criar_indices(db)
+    _adiciona_funcionarios(db)
+
+    # Simula a corrida: a verificação "já está na fila" passou, mas o outro pedido inseriu antes
+    db.fila_triagem.insert_one({"paciente_cpf": "12345678900", "posicao_fila": 10**9})
+    original = db.fila_triagem.find_one
+    db.fila_triagem.find_one = lambda *a, **k: None
+    try:
+        response = client.post('/triagem/12345678900', json={"sintomas": "dor no peito"})
+    finally:
+        db.fila_triagem.find_one = original
+    assert response.status_code == 400
+    assert db.fila_triagem.count_documents({"paciente_cpf": "12345678900"}) == 1
+
+
+# -------------------------- TESTES DA DISPONIBILIDADE ------------------------
+
+def test_disponibilidade_em_memoria_e_invalidacao(client):
+    from disponibilidade import disponibilidade
+    db = client.application.db
+    db.funcionarios.insert_one({"cpf": "111", "disponível": True, "cargo": "atendimento"})
+    db.funcionarios.insert_one({"cpf": "222", "disponível": True, "cargo": "atendimento"})
+
+    assert disponibilidade.contar(db, "atendimento") == 2
+    # Mudança direta no banco só aparece depois do TTL...
+    db.funcionarios.update_one({"cpf": "111"}, {"$set": {"disponível": False}})
+    assert disponibilidade.contar(db, "atendimento") == 2
+
+    # ...mas pela rota a contagem é invalidada na hora
+    response = client.put('/funcionarios/222/disponibilidade', json={"disponível": False})
+    assert response.status_code == 200
+    assert disponibilidade.contar(db, "atendimento") == 0
+    assert disponibilidade.contar(db, "triagem") == 0
+
+
+def test_alterar_disponibilidade_validacao(client):
+    response = client.put('/funcionarios/98765432100/disponibilidade', json={"disponível": "sim"})
+    assert response.status_code == 400
+    response = client.put('/funcionarios/00000000000/disponibilidade', json={"disponível": True})
+    assert response.status_code == 404
+
+
+# -------------------------- TESTES DO STREAMING ------------------------------
+
+def _proximo_evento(partes):
+    texto = ""
+    while not texto.endswith("\n\n") or texto.startswith(":"):
+        if texto.startswith(":"):
+            texto = ""
+        texto += next(partes).decode("utf-8")
+    nome, dados = texto.strip().split("\n")
+    return nome.removeprefix("event: "), json.loads(dados.removeprefix("data: "))
+
+
+def test_streaming_envia_evento_so_quando_a_fila_muda(client):
+    import filas
+    db = client.application.db
+    _adiciona_funcionarios(db)
+    for cpf in ["111", "12345678900"]:
+        filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": cpf, "nome": cpf, "triagem_oficial": "grave"})
+
+    response = client.get('/triagem/12345678900/eventos', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    partes = iter(response.response)
+
+    nome, dados = _proximo_evento(partes)
+    assert nome == "fila"
+    assert dados["posicao_na_fila"] == 2
+    assert dados["tempo_estimado_espera"] == "140 minutos"
+
+    client.delete('/atendimento/111')
+    nome, dados = _proximo_evento(partes)
+    assert dados["posicao_na_fila"] == 1
+    assert dados["tempo_estimado_espera"] == "70 minutos"
+
+    client.delete('/atendimento/12345678900')
+    assert _proximo_evento(partes)[0] == "fim"
+    response.close()
+
+
+def test_streaming_se_despede_na_drenagem(client):
+    import filas
+    import ciclo
+    db = client.application.db
+    _adiciona_funcionarios(db)
+    filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": "12345678900", "nome": "x", "triagem_oficial": "leve"})
+
+    response = client.get('/triagem/12345678900/eventos', buffered=False)
+    partes = iter(response.response)
+    assert _proximo_evento(partes)[0] == "fila"
+
+    ciclo.iniciar_drenagem()
+    assert _proximo_evento(partes)[0] == "reconectar"
+    with pytest.raises(StopIteration):
+        next(partes)
+    response.close()
+
+
+
+def test_streaming_acima_do_limite_responde_503(client, monkeypatch):
+    import threading
+    import filas
+    import app as app_module
+    db = client.application.db
+    _adiciona_funcionarios(db)
+    filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": "12345678900", "nome": "x", "triagem_oficial": "leve"})
+    monkeypatch.setattr(app_module, '_vagas_sse', threading.BoundedSemaphore(1))
+
+    aberto = client.get('/triagem/12345678900/eventos', buffered=False)
+    assert aberto.status_code == 200
+
+    # Worker cheio: o cliente volta a consultar
+    response = client.get('/triagem/12345678900/eventos', buffered=False)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(app_module.SSE_RETRY_AFTER)
+    assert client.get('/triagem/12345678900').status_code == 200
+
+    # Fechado o primeiro (mesmo sem ter lido nada), a vaga volta
+    aberto.close()
+    response = client.get('/triagem/12345678900/eventos', buffered=False)
+    assert response.status_code == 200
+    response.close()
+
+
+def test_barramento_acorda_so_a_unidade_que_mudou():
+    import threading
+    from eventos import BarramentoFilas
+    barramento = BarramentoFilas()
+    filas_acompanhadas = ("fila_atendimento", "fila_triagem")
+    vista = barramento.versao("principal", filas_acompanhadas)
+
+    barramento.publicar("fila_triagem", "norte")
+    assert barramento.esperar("principal", filas_acompanhadas, vista, timeout=0.01) == vista
+
+    acordou = []
+    esperando = threading.Thread(target=lambda: acordou.append(
+        barramento.esperar("principal", filas_acompanhadas, vista, timeout=5)))
+    esperando.start()
+    barramento.publicar("fila_atendimento", "principal")
+    esperando.join(5)
+    assert acordou and acordou[0] != vista
+
+    # Drenagem acorda todas as unidades
+    vista = barramento.versao("norte", filas_acompanhadas)
+    barramento.acordar_todos()
+    assert barramento.esperar("norte", filas_acompanhadas, vista, timeout=0.01) != vista
+
+# -------------------------- TESTES DA PROMOCAO -------------------------------
+
+@pytest.fixture
+def mongo_atomico(monkeypatch):
+    # O mongomock não serializa as operações entre threads; um servidor de verdade
+    # garante atomicidade por documento. Aqui cada operação vira atômica com um lock.
+    import threading
+    from mongomock.collection import Collection
+    lock = threading.RLock()
+    for nome in ["find_one_and_update", "find_one_and_delete", "insert_one", "update_one",
+                 "delete_one", "find_one", "count_documents"]:
+        original = getattr(Collection, nome)
+
+        def atomico(self, *args, _original=original, **kwargs):
+            with lock:
+                return _original(self, *args, **kwargs)
+        monkeypatch.setattr(Collection, nome, atomico)
+    db = mongomock.MongoClient().db
+    import indices
+    indices.criar_indices(db)
+    return db
+
+
+def test_promocoes_simultaneas_tem_posicoes_distintas(mongo_atomico):
+    import threading
+    import filas
+    db = mongo_atomico
+    cpfs = [f"{i:011d}" for i in range(40)]
+    for cpf in cpfs:
+        filas.entrar(db, filas.FILA_TRIAGEM, {"paciente_cpf": cpf, "nome": cpf, "triagemIA": "leve"})
+
+    erros = []
+
+    def promove(lote):
+        for cpf in lote:
+            try:
+                assert filas.promover(db, cpf, "moderada") is not None
+            except Exception as e:
+                erros.append(e)
+
+    threads = [threading.Thread(target=promove, args=(cpfs[i::8],)) for i in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    assert erros == []
+    assert db.fila_triagem.count_documents({}) == 0
+    chaves = [p["posicao_fila"] for p in db.fila_atendimento.find()]
+    assert len(chaves) == len(set(chaves)) == 40
+    assert all("promovendo" not in p for p in db.fila_atendimento.find())
+
+
+def test_mesmo_paciente_promovido_uma_vez_so(mongo_atomico):
+    import threading
+    import filas
+    db = mongo_atomico
+    filas.entrar(db, filas.FILA_TRIAGEM, {"paciente_cpf": "123", "nome": "x", "triagemIA": "grave"})
+
+    resultados = []
+    threads = [threading.Thread(target=lambda: resultados.append(filas.promover(db, "123", "grave")))
+               for _ in range(10)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    assert sum(r is not None for r in resultados) == 1
+    assert db.fila_atendimento.count_documents({"paciente_cpf": "123"}) == 1
+    assert db.fila_triagem.count_documents({}) == 0
+
+
+def test_reparar_promocao_interrompida(client):
+    import filas
+    db = client.application.db
+    filas.entrar(db, filas.FILA_TRIAGEM, {"paciente_cpf": "1", "promovendo": True})
+    filas.entrar(db, filas.FILA_TRIAGEM, {"paciente_cpf": "2", "promovendo": True})
+    filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": "1", "triagem_oficial": "leve"})
+
+    assert filas.reparar_promocoes(db) == 2
+    assert db.fila_triagem.find_one({"paciente_cpf": "1"}) is None
+    assert db.fila_triagem.find_one({"paciente_cpf": "2"}).get("promovendo") is None
+
+
+def test_alta_em_lote(client):
+    import filas
+    db = client.application.db
+    _adiciona_funcionarios(db)
+    for cpf in ["1", "2", "3", "4"]:
+        filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": cpf, "nome": cpf, "triagem_oficial": "leve"})
+
+    response = client.delete('/atendimento', json={"cpfs": ["1", "3", "9"]})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert sorted(p["cpf"] for p in data["removidos"]) == ["1", "3"]
+    assert data["nao_encontrados"] == ["9"]
+
+    assert client.get('/triagem/4').get_json()["posicao_na_fila"] == 2
+    assert client.delete('/atendimento', json={"cpfs": []}).status_code == 400
+
+
+# -------------------------- TESTES DO GET /pacientes -------------------------
+
+def _fila_de_triagem(db, n):
+    import filas
+    for i in range(n):
+        filas.entrar(db, filas.FILA_TRIAGEM, {"paciente_cpf": str(i), "nome": f"P{i}",
+                                              "triagemIA": "leve", "sintomas": "tosse " * 50})
+
+
+def test_pacientes_paginado_com_campos(client):
+    import filas
+    db = client.application.db
+    _fila_de_triagem(db, 5)
+    filas.sair(db, filas.FILA_TRIAGEM, "1")
+
+    response = client.get('/pacientes?campos=nome,posicao_fila&limite=2')
+    pagina = response.get_json()
+    assert [p["nome"] for p in pagina] == ["P0", "P2"]
+    assert [p["posicao_fila"] for p in pagina] == [1, 2]
+    assert "sintomas" not in pagina[0]
+
+    response = client.get(f'/pacientes?campos=nome,posicao_fila&limite=2&apos={pagina[-1]["cursor"]}')
+    pagina = response.get_json()
+    assert [(p["nome"], p["posicao_fila"]) for p in pagina] == [("P3", 3), ("P4", 4)]
+
+    assert client.get('/pacientes?campos=senha').status_code == 400
+    assert client.get('/pacientes?limite=abc').status_code == 400
+
+
+def test_pacientes_sem_parametros_devolve_tudo(client):
+    db = client.application.db
+    _fila_de_triagem(db, 3)
+    pacientes = client.get('/pacientes').get_json()
+    assert [p["posicao_fila"] for p in pacientes] == [1, 2, 3]
+    assert "cursor" not in pacientes[0]
+    assert pacientes[0]["sintomas"].startswith("tosse")
+
+
+def test_pacientes_etag(client):
+    import filas
+    db = client.application.db
+    _fila_de_triagem(db, 3)
+
+    response = client.get('/pacientes')
+    etag = response.headers['ETag']
+    response = client.get('/pacientes', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    filas.sair(db, filas.FILA_TRIAGEM, "0")
+    response = client.get('/pacientes', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()) == 2
+
+
+
+def test_pacientes_fora_do_contexto_do_app(client):
+    # Como num servidor de verdade: o corpo é lido depois que o contexto do pedido acabou
+    db = client.application.db
+    _fila_de_triagem(db, 2)
+    avulso = flask_app.test_client()
+    response = avulso.get('/pacientes', headers={'Authorization': client.environ_base['HTTP_AUTHORIZATION']})
+    assert [p["nome"] for p in response.get_json()] == ["P0", "P1"]
+
+
+# -------------------------- TESTES DAS METRICAS ------------------------------
+
+def test_metrics_por_rota_e_tamanho_das_filas(client):
+    _adiciona_funcionarios(flask_app.db)
+    client.post('/login', json={"email": "teste@exemplo.com", "senha": "senha123"})
+    client.post('/triagem/12345678900', json={"sintomas": "dor de cabeça leve"})
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    texto = response.get_data(as_text=True)
+    assert 'http_pedido_segundos_count{metodo="POST",rota="/login",status="200"} 1' in texto
+    assert 'http_pedido_segundos_bucket{metodo="POST",rota="/login",status="200",le="+Inf"} 1' in texto
+    assert 'http_pedido_mongo_comandos_count{metodo="POST",rota="/triagem/<cpf>"} 1' in texto
+    assert 'fila_pacientes{fila="fila_triagem"} 1' in texto
+    assert 'fila_pacientes{fila="fila_atendimento"} 0' in texto
+    assert '# TYPE triagem_ia_segundos histogram' in texto
+
+
+def test_monitor_de_comandos_conta_por_pedido():
+    from types import SimpleNamespace
+    from metricas import MonitorComandos
+    monitor = MonitorComandos()
+    evento = SimpleNamespace(command_name='find', duration_micros=1500)
+
+    # Fora de um pedido (ex.: thread da IA) só entra no total por comando
+    monitor.succeeded(evento)
+    monitor.iniciar_pedido()
+    monitor.succeeded(evento)
+    monitor.failed(SimpleNamespace(command_name='update', duration_micros=500))
+    assert monitor.terminar_pedido() == (2, 0.002)
+    assert monitor.resumo() == {
+        'find': {'comandos': 2, 'segundos': 0.003, 'falhas': 0},
+        'update': {'comandos': 1, 'segundos': 0.0005, 'falhas': 1},
+    }
+
+
+def test_log_em_json():
+    import logging
+    from registro import FormatoJSON
+    registro = logging.LogRecord('healthcenter', logging.INFO, __file__, 1, "pedido", None, None)
+    registro.campos = {'rota': '/login', 'status': 200}
+    linha = json.loads(FormatoJSON().format(registro))
+    assert linha['msg'] == "pedido"
+    assert linha['nivel'] == "info"
+    assert linha['rota'] == '/login' and linha['status'] == 200
+
+
+# -------------------------- TESTE DA CARGA -----------------------------------
+
+def test_carga_de_um_dia_pequeno():
+    import carga
+    relatorio = carga.simular_dia(pacientes=20, chegadas_por_hora=60, modo='local', faixa=5)
+    assert relatorio['erros_5xx'] == 0
+    assert set(relatorio['rotas']) == {
+        'POST /cadastro', 'POST /login', 'POST /triagem/<cpf>', 'GET /triagem/<cpf>',
+        'PUT /triagem_e_fila/<cpf>', 'DELETE /atendimento/<cpf>',
+    }
+    assert relatorio['status']['DELETE /atendimento/<cpf>'] == {200: 20}
+    # Vazão = pedidos / tempo de parede do dia
+    assert relatorio['pedidos'] == sum(sum(c.values()) for c in relatorio['status'].values())
+    assert relatorio['por_segundo'] == pytest.approx(relatorio['pedidos'] / relatorio['duracao_s'], rel=0.01)
+    # E por rota e faixa, sobre o tempo de parede que o dia passou na faixa
+    assert all(f['por_segundo'] for faixas in relatorio['rotas'].values() for f in faixas)
+    # Mesma semente, mesmos pedidos
+    assert carga.simular_dia(pacientes=20, chegadas_por_hora=60, modo='local', faixa=5)['status'] == relatorio['status']
+
+
+# -------------------------- TESTES DA SIMULACAO ------------------------------
+
+def _historico(servico, triagem=8, triagistas=1, atendentes=2, pacientes=300, semente=1):
+    # Dia sintético: chegadas mais rápidas que o atendimento, fila por ordem de chegada
+    import heapq
+    import random
+    from datetime import datetime, timedelta, timezone
+    rng = random.Random(semente)
+    inicio = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    eventos = []
+
+    def evento(tipo, minuto, cpf, gravidade=None):
+        eventos.append({'tipo': tipo, 'cpf': cpf, 'gravidade': gravidade, 'quando': inicio + timedelta(minutes=minuto),
+                        'triagistas': triagistas, 'atendentes': atendentes})
+
+    livre_triagem = [0.0] * triagistas
+    promocoes = []
+    t = 0.0
+    for i in range(pacientes):
+        t += rng.expovariate(1 / 4)
+        cpf = str(i)
+        evento('entrada', t, cpf)
+        comeco = max(t, heapq.heappop(livre_triagem))
+        heapq.heappush(livre_triagem, comeco + triagem)
+        promocoes.append((comeco + triagem, cpf, rng.choice(list(servico))))
+
+    livre_atendimento = [0.0] * atendentes
+    for fim_triagem, cpf, gravidade in sorted(promocoes):
+        evento('promocao', fim_triagem, cpf, gravidade)
+        comeco = max(fim_triagem, heapq.heappop(livre_atendimento))
+        heapq.heappush(livre_atendimento, comeco + servico[gravidade])
+        evento('alta', comeco + servico[gravidade], cpf)
+    return sorted(eventos, key=lambda e: e['quando'])
+
+
+def test_ajuste_recupera_tempos_de_servico():
+    import simulacao
+    verdade = {"leve": 15, "moderada": 45, "grave": 80}
+    tempos = simulacao.ajustar_tempos(_historico(verdade))
+    for gravidade, t in verdade.items():
+        assert abs(tempos['tempo_gravidade'][gravidade] - t) <= 0.1 * t
+    assert tempos['tempo_triagem'] == 8
+
+
+def test_reproduzir_compara_previsto_com_real():
+    import simulacao
+    from estimativa import TEMPO_GRAVIDADE
+    eventos = _historico(dict(TEMPO_GRAVIDADE), triagem=80, atendentes=1, pacientes=30)
+    # Atendimento sempre livre e tempos iguais às constantes: estimativa exata
+    resultado = simulacao.comparar(eventos)
+    assert resultado['pacientes'] == 30
+    assert resultado['erro_absoluto_medio'] == 0
+
+    eventos = _historico({"leve": 30, "moderada": 60, "grave": 100}, triagem=120, atendentes=1, pacientes=30)
+    assert simulacao.comparar(eventos)['erro_medio'] < 0
+
+
+def test_carregar_tempos_calibrados(tmp_path, monkeypatch):
+    import estimativa
+    for gravidade, t in estimativa.TEMPO_GRAVIDADE.items():
+        monkeypatch.setitem(estimativa.TEMPO_GRAVIDADE, gravidade, t)
+    monkeypatch.setattr(estimativa, 'TEMPO_TRIAGEM', 5)
+    caminho = tmp_path / "tempos.json"
+    caminho.write_text(json.dumps({"tempo_gravidade": {"leve": 25, "inexistente": 3}, "tempo_triagem": 7}))
+
+    estimativa.carregar_tempos(str(caminho))
+    assert estimativa.TEMPO_GRAVIDADE == {"leve": 25, "moderada": 40, "grave": 70}
+    assert estimativa.TEMPO_TRIAGEM == 7
+
+
+def test_rotas_registram_eventos_da_fila(client):
+    db = flask_app.db
+    _adiciona_funcionarios(db, triagem=2, atendimento=3)
+    client.post('/triagem/12345678900', json={"sintomas": "dor de cabeça"})
+    client.put('/triagem_e_fila/12345678900', json={"triagem_oficial": "grave"})
+    client.delete('/atendimento/12345678900')
+
+    eventos = list(db.eventos_fila.find({}, {'_id': 0, 'quando': 0}))
+    assert eventos == [
+        {'tipo': 'entrada', 'cpf': '12345678900', 'gravidade': None, 'triagistas': 2, 'atendentes': 3,
+             'unidade': 'principal'},
+        {'tipo': 'promocao', 'cpf': '12345678900', 'gravidade': 'grave', 'triagistas': 2, 'atendentes': 3,
+             'unidade': 'principal'},
+        {'tipo': 'alta', 'cpf': '12345678900', 'gravidade': None, 'triagistas': 2, 'atendentes': 3,
+             'unidade': 'principal'},
+    ]
+
+
+# -------------------------- TESTES DO SNAPSHOT -------------------------------
+
+def test_snapshot_gravado_pelo_primeiro_leitor(client):
+    import filas
+    db = flask_app.db
+    _adiciona_funcionarios(db, atendimento=2)
+    for cpf, gravidade in (("1", "leve"), ("2", "grave"), ("3", "moderada")):
+        filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": cpf, "triagem_oficial": gravidade})
+    # As alterações não refazem o snapshot
+    assert db.filas_snapshot.find_one({"_id": filas.FILA_ATENDIMENTO}) is None
+
+    filas.ordem(db, filas.FILA_ATENDIMENTO)
+    snapshot = db.filas_snapshot.find_one({"_id": filas.FILA_ATENDIMENTO})
+    assert snapshot["cpfs"] == ["1", "2", "3"]
+    assert snapshot["versao"] == 3
+    assert snapshot["agenda"]["funcionarios"] == 2
+    assert snapshot["agenda"]["inicios"] == [0, 0, 20]
+
+    # A alta só troca a geração; o snapshot fica para o próximo leitor
+    filas.sair(db, filas.FILA_ATENDIMENTO, "1")
+    assert db.filas_snapshot.find_one({"_id": filas.FILA_ATENDIMENTO})["versao"] == 3
+
+    # Outro worker lendo a geração nova
+    filas._ordens.clear()
+    filas.ordem(db, filas.FILA_ATENDIMENTO)
+    snapshot = db.filas_snapshot.find_one({"_id": filas.FILA_ATENDIMENTO})
+    assert snapshot["cpfs"] == ["2", "3"]
+    assert snapshot["versao"] == 4
+    assert snapshot["geracao"] == filas.geracao(db, filas.FILA_ATENDIMENTO)
+
+    # Leitor atrasado, de uma versão antiga, não passa por cima
+    filas.gravar_snapshot(db, filas.FILA_ATENDIMENTO, filas.OrdemFila([]), "velha", 2)
+    assert db.filas_snapshot.find_one({"_id": filas.FILA_ATENDIMENTO})["geracao"] != "velha"
+
+
+def test_consulta_com_geracao_nova_le_so_o_snapshot(client, monkeypatch):
+    import filas
+    db = flask_app.db
+    _adiciona_funcionarios(db, atendimento=2)
+    for i, gravidade in enumerate(["grave", "leve", "moderada", "leve"]):
+        filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": str(i), "triagem_oficial": gravidade})
+    esperado = client.get('/triagem/3').get_json()
+
+    # Como outro worker veria: nenhuma visão em memória
+    filas._ordens.clear()
+    leituras = []
+    for metodo in ('find', 'find_one', 'count_documents'):
+        original = getattr(db.fila_atendimento, metodo)
+        monkeypatch.setattr(db.fila_atendimento, metodo,
+                            lambda *a, m=metodo, f=original, **k: leituras.append(m) or f(*a, **k))
+
+    response = client.get('/triagem/3')
+    assert response.status_code == 200
+    assert response.get_json() == esperado
+    assert esperado["posicao_na_fila"] == 4
+    assert esperado["tempo_estimado_espera"] == "80 minutos"
+    assert leituras == []
+
+
+# -------------------------- TESTES DAS UNIDADES ------------------------------
+
+def test_filas_separadas_por_unidade(client):
+    import filas
+    db = flask_app.db
+    _adiciona_funcionarios(db)
+    _adiciona_funcionarios(db, unidade="norte")
+    filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": "111", "triagem_oficial": "grave"})
+    filas.entrar(db, filas.FILA_ATENDIMENTO, {"paciente_cpf": "12345678900", "nome": "x", "triagem_oficial": "grave"},
+                 "norte")
+
+    # Na unidade norte o paciente é o primeiro, mesmo com alguém na unidade padrão
+    response = client.get('/unidades/norte/triagem/12345678900')
+    assert response.status_code == 200
+    assert response.get_json()["posicao_na_fila"] == 1
+    assert response.get_json()["tempo_estimado_espera"] == "70 minutos"
+    assert client.get('/triagem/12345678900').status_code == 404
+    assert client.delete('/atendimento/12345678900').status_code == 404
+
+    # Mexer numa unidade não troca a geração da outra
+    geracao = filas.geracao(db, filas.FILA_ATENDIMENTO)
+    assert client.delete('/unidades/norte/atendimento/12345678900').status_code == 200
+    assert filas.geracao(db, filas.FILA_ATENDIMENTO) == geracao
+    filas.ordem(db, filas.FILA_ATENDIMENTO, "norte")
+    assert db.filas_snapshot.find_one({"_id": "fila_atendimento@norte"})["cpfs"] == []
+    assert db.filas_snapshot.find_one({"_id": "fila_atendimento"})["cpfs"] == ["111"]
+
+
+def test_unidade_padrao_aceita_documentos_sem_unidade(client):
+    db = flask_app.db
+    _adiciona_funcionarios(db)
+    db.fila_atendimento.insert_one({"paciente_cpf": "12345678900", "posicao_fila": 1, "triagem_oficial": "leve"})
+
+    response = client.get('/triagem/12345678900')
+    assert response.status_code == 200
+    assert response.get_json()["posicao_na_fila"] == 1
+    assert client.get('/unidades/principal/triagem/12345678900').get_json() == response.get_json()
+    assert client.get('/unidades/norte/triagem/12345678900').status_code == 404
+
+
+def test_funcionarios_contam_so_na_propria_unidade(client):
+    db = flask_app.db
+    _adiciona_funcionarios(db, unidade="norte")
+
+    response = client.post('/triagem/12345678900', json={"sintomas": "dor de cabeça"})
+    assert response.status_code == 500
+    response = client.post('/unidades/norte/triagem/12345678900', json={"sintomas": "dor de cabeça"})
+    assert response.status_code == 202
+    assert db.fila_triagem.find_one({"paciente_cpf": "12345678900"})["unidade"] == "norte"
+
+    response = client.put('/unidades/norte/triagem_e_fila/12345678900', json={"triagem_oficial": "leve"})
+    assert response.status_code == 200
+    assert db.fila_atendimento.find_one({"paciente_cpf": "12345678900"})["unidade"] == "norte"
+    assert client.get('/unidades/norte/pacientes').get_json() == []
+
+
+def test_processo_preso_a_outras_unidades(client, monkeypatch):
+    import unidades
+    monkeypatch.setattr(unidades, 'UNIDADES_ATENDIDAS', frozenset({"norte"}))
+    assert client.get('/unidades/sul/triagem/12345678900').status_code == 421
+    assert client.get('/triagem/12345678900').status_code == 421
+    assert client.get('/unidades/norte/triagem/12345678900').status_code == 404
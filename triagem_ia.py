@@ -0,0 +1,291 @@
+import os
+import re
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from estimativa import TEMPO_GRAVIDADE
+from classificador_local import classificar_local, gravidade_local
+from metricas import Histograma
+
+URL_IA = os.getenv(
+    'OPEN_AI_URL',
+    'https://openai-insper.openai.azure.com/openai/deployments/gpt-4o_ProgEficaz/chat/completions?api-version=2025-01-01-preview'
+)
+TRIAGEM_IA_WORKERS = int(os.getenv('TRIAGEM_IA_WORKERS', 8))
+TRIAGEM_IA_TIMEOUT = float(os.getenv('TRIAGEM_IA_TIMEOUT', 10))
+TRIAGEM_IA_TENTATIVAS = int(os.getenv('TRIAGEM_IA_TENTATIVAS', 3))
+TRIAGEM_IA_BACKOFF = float(os.getenv('TRIAGEM_IA_BACKOFF', 0.2))
+TRIAGEM_IA_FALHAS_PARA_ABRIR = int(os.getenv('TRIAGEM_IA_FALHAS_PARA_ABRIR', 5))
+TRIAGEM_IA_TEMPO_ABERTO = float(os.getenv('TRIAGEM_IA_TEMPO_ABERTO', 30))
+
+# local: só o classificador local; remote: sempre a IA; hybrid: a IA só quando o
+# classificador local não tem confiança suficiente
+TRIAGEM_MODO = os.getenv('TRIAGEM_MODO', 'hybrid')
+TRIAGEM_LIMIAR_CONFIANCA = float(os.getenv('TRIAGEM_LIMIAR_CONFIANCA', 0.75))
+
+# Respostas HTTP em que vale a pena tentar de novo
+STATUS_TRANSITORIOS = {429, 500, 502, 503, 504}
+
+
+class ErroTriagemIA(Exception):
+    pass
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Latência das chamadas à IA (em segundos), um histograma por resultado
+latencias = {
+    'sucesso': Histograma(),
+    'erro': Histograma(),
+    'disjuntor_aberto': Histograma(),
+}
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Disjuntor: depois de várias falhas seguidas para de chamar a IA por um tempo e
+# deixa uma única chamada de teste passar quando esse tempo acaba
+class Disjuntor:
+    def __init__(self, falhas_para_abrir=TRIAGEM_IA_FALHAS_PARA_ABRIR, tempo_aberto=TRIAGEM_IA_TEMPO_ABERTO):
+        self.falhas_para_abrir = falhas_para_abrir
+        self.tempo_aberto = tempo_aberto
+        self._lock = threading.Lock()
+        self.fechar()
+
+    def fechar(self):
+        with self._lock:
+            self.falhas = 0
+            self.aberto_ate = None
+            self._testando = False
+
+    @property
+    def estado(self):
+        with self._lock:
+            if self.aberto_ate is None:
+                return 'fechado'
+            if time.monotonic() < self.aberto_ate:
+                return 'aberto'
+            return 'meio_aberto'
+
+    def permitir(self):
+        with self._lock:
+            if self.aberto_ate is None:
+                return True
+            if time.monotonic() < self.aberto_ate or self._testando:
+                return False
+            self._testando = True
+            return True
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self.falhas = 0
+            self.aberto_ate = None
+            self._testando = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self.falhas += 1
+            if self._testando or self.falhas >= self.falhas_para_abrir:
+                self.aberto_ate = time.monotonic() + self.tempo_aberto
+            self._testando = False
+
+
+disjuntor = Disjuntor()
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Quantas classificações saíram de cada caminho: local (primeira passada),
+# cache, ia (resposta do modelo) e fallback (classificador local no lugar da IA)
+class ContadorCaminhos:
+    CAMINHOS = ('local', 'cache', 'ia', 'fallback')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.zerar()
+
+    def zerar(self):
+        with self._lock:
+            self.contagens = dict.fromkeys(self.CAMINHOS, 0)
+
+    def registrar(self, caminho):
+        with self._lock:
+            self.contagens[caminho] += 1
+
+    def resumo(self):
+        with self._lock:
+            return dict(self.contagens)
+
+
+caminhos = ContadorCaminhos()
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Uma sessão por processo, reaproveitando as conexões keep-alive com o Azure
+_lock = threading.Lock()
+_sessao = None
+_sessao_pid = None
+
+
+def sessao():
+    global _sessao, _sessao_pid
+    pid = os.getpid()
+    if _sessao is not None and _sessao_pid == pid:
+        return _sessao
+    with _lock:
+        if _sessao is None or _sessao_pid != pid:
+            s = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=TRIAGEM_IA_WORKERS)
+            s.mount('https://', adaptador)
+            s.mount('http://', adaptador)
+            _sessao = s
+            _sessao_pid = pid
+    return _sessao
+
+
+def fechar_sessao():
+    global _sessao, _sessao_pid
+    with _lock:
+        if _sessao is not None and _sessao_pid == os.getpid():
+            _sessao.close()
+        _sessao = None
+        _sessao_pid = None
+
+#----------------------------------------------------------------------------------------------------------------------------------
+#conectando com a api e função da triagem
+def triagem_sintomas(sintomas: str):
+    headers = {
+        'Authorization': os.getenv('OPEN_AI_KEY'),
+        'Content-Type': 'application/json'
+    }
+
+    data = {
+        "messages": [
+            {
+                "role": "system",
+                "content": (
+                    "Você é um assistente de triagem médica. "
+                    "Ao receber sintomas, você deve estimar a gravidade (leve, moderado, grave) "
+                    "com base no relato e retornar apenas a situação do problema, como leve, moderado ou grave"
+                )
+            },
+            {"role": "user", "content": sintomas}
+        ]
+    }
+
+    ultimo_erro = None
+    for tentativa in range(TRIAGEM_IA_TENTATIVAS):
+        if tentativa:
+            # Backoff exponencial com jitter, para não sincronizar as novas tentativas
+            time.sleep(random.uniform(0, TRIAGEM_IA_BACKOFF * 2 ** (tentativa - 1)))
+        try:
+            response = sessao().post(URL_IA, headers=headers, json=data, timeout=TRIAGEM_IA_TIMEOUT)
+            if response.status_code in STATUS_TRANSITORIOS:
+                ultimo_erro = f"HTTP {response.status_code}"
+                continue
+            response.raise_for_status()
+            result = response.json()
+            return result['choices'][0]['message']['content']
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            ultimo_erro = e
+        except (requests.exceptions.RequestException, ValueError, KeyError, IndexError) as e:
+            # Erro que não melhora tentando de novo (4xx, resposta fora do formato)
+            raise ErroTriagemIA(f"Erro ao conectar à API: {e}")
+
+    raise ErroTriagemIA(f"Erro ao conectar à API: {ultimo_erro}")
+
+
+def extrair_gravidade(resposta_ia):
+    # O modelo costuma responder no masculino ("moderado")
+    achado = re.search(r'\b(leve|moderad[ao]|grave)\b', resposta_ia.lower())
+    if not achado:
+        return None
+    grav = "moderada" if achado.group(1).startswith("moderad") else achado.group(1)
+    return grav if grav in TEMPO_GRAVIDADE else None
+
+
+# Primeira passada, dentro do próprio pedido. Devolve a gravidade quando dá para
+# decidir sem a IA, ou None quando é preciso perguntar ao modelo.
+def classificacao_imediata(sintomas, modo=None):
+    modo = modo or TRIAGEM_MODO
+    if modo == 'remote':
+        return None
+
+    gravidade, confianca = classificar_local(sintomas)
+    if modo == 'local' or confianca >= TRIAGEM_LIMIAR_CONFIANCA:
+        caminhos.registrar('local')
+        return gravidade
+    return None
+
+
+# Devolve (gravidade, resposta, origem). Com a IA fora do ar ou sem uma gravidade
+# reconhecível, cai no classificador local em vez de deixar o paciente sem gravidade.
+def classificar_sintomas(sintomas):
+    if not disjuntor.permitir():
+        inicio = time.perf_counter()
+        gravidade = gravidade_local(sintomas)
+        latencias['disjuntor_aberto'].observar(time.perf_counter() - inicio)
+        caminhos.registrar('fallback')
+        return gravidade, "IA indisponível (disjuntor aberto)", "local"
+
+    inicio = time.perf_counter()
+    try:
+        resposta_ia = triagem_sintomas(sintomas)
+    except ErroTriagemIA as e:
+        disjuntor.registrar_falha()
+        latencias['erro'].observar(time.perf_counter() - inicio)
+        caminhos.registrar('fallback')
+        return gravidade_local(sintomas), str(e), "local"
+
+    disjuntor.registrar_sucesso()
+    latencias['sucesso'].observar(time.perf_counter() - inicio)
+    gravidade = extrair_gravidade(resposta_ia)
+    if gravidade is None:
+        caminhos.registrar('fallback')
+        return gravidade_local(sintomas), resposta_ia, "local"
+    caminhos.registrar('ia')
+    return gravidade, resposta_ia, "ia"
+
+
+def resumo():
+    return {
+        'modo': TRIAGEM_MODO,
+        'caminhos': caminhos.resumo(),
+        'disjuntor': disjuntor.estado,
+        'latencias': {resultado: h.resumo() for resultado, h in latencias.items()},
+    }
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Pool de threads para as chamadas à IA, fora da thread do pedido HTTP.
+# O número de workers limita quantas chamadas ficam abertas ao mesmo tempo.
+_executor = None
+_executor_pid = None
+
+
+def executor():
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is not None and _executor_pid == pid:
+        return _executor
+    with _lock:
+        if _executor is None or _executor_pid != pid:
+            _executor = ThreadPoolExecutor(max_workers=TRIAGEM_IA_WORKERS, thread_name_prefix='triagem-ia')
+            _executor_pid = pid
+    return _executor
+
+
+def agendar(funcao, *args):
+    return executor().submit(funcao, *args)
+
+
+def encerrar(esperar=True):
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=esperar)
+        _executor = None
+        _executor_pid = None
+
+
+def descartar():
+    # Depois do fork: as threads e as conexões do mestre não existem neste processo
+    global _sessao, _sessao_pid, _executor, _executor_pid
+    with _lock:
+        _sessao = _sessao_pid = None
+        _executor = _executor_pid = None
@@ -0,0 +1,33 @@
+import os
+
+#----------------------------------------------------------------------------------------------------------------------------------
+# Várias unidades de saúde no mesmo deploy.
+#
+# Cada paciente nas filas e cada funcionário guarda o campo unidade, e as filas,
+# contadores, snapshots e contagens de disponibilidade são separados por unidade:
+# nada que uma unidade faz lê os pacientes de outra. As rotas antigas (sem
+# /unidades/<unidade>) valem para a UNIDADE_PADRAO, e documentos gravados antes
+# desta mudança (sem o campo) contam como dela.
+#
+# UNIDADES_ATENDIDAS=a,b restringe este processo a essas unidades (as outras
+# recebem 421), para separar grupos de workers por unidade atrás do balanceador.
+# Vazio atende todas.
+UNIDADE_PADRAO = os.getenv('UNIDADE_PADRAO', 'principal')
+UNIDADES_ATENDIDAS = frozenset(u.strip() for u in os.getenv('UNIDADES_ATENDIDAS', '').split(',') if u.strip())
+
+
+def filtro(unidade):
+    if unidade == UNIDADE_PADRAO:
+        # $in com None também pega documentos sem o campo
+        return {'unidade': {'$in': [UNIDADE_PADRAO, None]}}
+    return {'unidade': unidade}
+
+
+def atende(unidade):
+    return not UNIDADES_ATENDIDAS or unidade in UNIDADES_ATENDIDAS
+
+
+def chave(fila, unidade):
+    # _id em filas_meta/filas_snapshot; a unidade padrão continua com o _id antigo
+    # para aproveitar contador e geração que já existem
+    return fila if unidade == UNIDADE_PADRAO else f"{fila}@{unidade}"
@@ -0,0 +1,9 @@
+from dotenv import load_dotenv
+
+# Entrada de produção: gunicorn -c gunicorn.conf.py wsgi:app
+# O .env precisa estar carregado antes dos módulos que leem configuração no import
+load_dotenv()
+
+from app import create_app
+
+app = create_app()